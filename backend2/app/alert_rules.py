@@ -0,0 +1,303 @@
+"""
+Alert rules over incoming metrics.
+
+check_server.ps1 compares disk, memory and uptime with fixed thresholds, but
+only to word the check's issue summary, and nothing raised Alert rows. The
+rule engine does, from the metrics every check and agent heartbeat records.
+Rules come from ALERT_RULES (JSON); the defaults are the script's thresholds:
+
+    [{"name": "disk-full", "metric": "disk.*.used_pct", "op": ">", "value": 85, "severity": "Warning"},
+     {"name": "memory-high", "metric": "memory.used_pct", "op": ">", "value": 90, "severity": "Warning"},
+     {"name": "uptime-long", "metric": "uptime.days", "op": ">", "value": 30, "severity": "Info"}]
+
+A threshold rule compares each sample with `value`. A rate rule compares the
+change since the series' previous sample, scaled to `per_seconds`. With
+`for: N`, a rule fires only after N breaching samples in a row. It resolves
+on the first sample that no longer breaches `clear`, which defaults to
+`value`; a lower `clear` stops a reading hovering at the threshold from
+flapping. For example:
+
+    [{"name": "disk-full", "metric": "disk.*.used_pct", "value": 85, "clear": 80},
+     {"name": "memory-high", "metric": "memory.used_pct", "value": 90, "for": 3, "severity": "Critical"},
+     {"name": "disk-filling", "type": "rate", "metric": "disk.*.used_pct", "value": 5, "per_seconds": 3600}]
+
+Evaluation is incremental. Rules are indexed by metric name, with wildcards
+resolved once per distinct name. Each (rule, server, metric) series keeps
+only its streak, its previous sample and whether it is firing, so a sample
+costs O(rules matching its metric) and never reads history. Threshold series
+are dropped from memory while quiet, so memory follows the number of
+breaching series, not the fleet size.
+
+Firing inserts an Alert and resolving marks it resolved. A partial unique
+index allows one open alert per series, so processes evaluating the same
+series never raise it twice. Which series are firing is read from the open
+alerts (a scan of that partial index) at the start of every batch, so an
+alert one process raised is resolved by whichever process sees the series
+clear. Streaks and previous samples are per process and start again from
+zero after a restart. The caller commits the alert writes; if its
+transaction rolls back instead, the series go back to where they were, so
+the same samples can be offered again.
+"""
+
+import fnmatch
+import json
+import operator
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import func, text
+from sqlalchemy.event import listens_for
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SHARDED, get_db
+from .metrics import from_epoch, to_epoch
+from .shards import fan_out
+
+OPS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+RULE_TYPES = ("threshold", "rate")
+
+DEFAULT_RULES = [
+    {"name": "disk-full", "metric": "disk.*.used_pct", "op": ">", "value": 85, "severity": "Warning"},
+    {"name": "memory-high", "metric": "memory.used_pct", "op": ">", "value": 90, "severity": "Warning"},
+    {"name": "uptime-long", "metric": "uptime.days", "op": ">", "value": 30, "severity": "Info"},
+]
+
+
+class Rule:
+    __slots__ = ("name", "type", "metric", "op", "value", "clear", "for_count", "per_seconds", "severity")
+
+    def __init__(self, name: str, metric: str, value: float, op: str = ">", type: str = "threshold",
+                 clear: float = None, severity: str = "Warning", per_seconds: float = 3600, **options):
+        if op not in OPS:
+            raise ValueError(f"Rule {name}: op must be one of {sorted(OPS)}")
+        if type not in RULE_TYPES:
+            raise ValueError(f"Rule {name}: type must be one of {RULE_TYPES}")
+        self.name = name
+        self.type = type
+        self.metric = metric
+        self.op = op
+        self.value = float(value)
+        self.clear = float(value if clear is None else clear)
+        # "for" is a keyword, so it arrives with the other options
+        self.for_count = max(1, int(options.pop("for", 1)))
+        self.per_seconds = float(per_seconds)
+        self.severity = severity
+        if options:
+            raise ValueError(f"Rule {name}: unknown options {sorted(options)}")
+
+    def message(self, metric: str, reading: float) -> str:
+        what = f"{metric} at {reading:g}" if self.type == "threshold" else (
+            f"{metric} changing {reading:+.2f} per {self.per_seconds:g}s")
+        streak = f" for {self.for_count} samples" if self.for_count > 1 else ""
+        return f"{what} ({self.op} {self.value:g}{streak})"
+
+    def describe(self) -> dict:
+        return {"name": self.name, "type": self.type, "metric": self.metric, "op": self.op, "value": self.value,
+                "clear": self.clear, "for": self.for_count, "per_seconds": self.per_seconds,
+                "severity": self.severity}
+
+
+class Series:
+    __slots__ = ("streak", "last_ts", "last_value", "firing")
+
+    def __init__(self):
+        self.streak = 0
+        self.last_ts = None
+        self.last_value = None
+        self.firing = False
+
+    def copy(self) -> "Series":
+        series = Series()
+        series.streak, series.last_ts, series.last_value, series.firing = (
+            self.streak, self.last_ts, self.last_value, self.firing)
+        return series
+
+
+def load_rules(raw: Optional[str]) -> List[Rule]:
+    rules = [Rule(**config) for config in (json.loads(raw) if raw else DEFAULT_RULES)]
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise ValueError("Alert rule names must be unique")
+    return rules
+
+
+class RuleEngine:
+    def __init__(self, rules: List[Rule]):
+        self.rules = rules
+        self._by_name = {rule.name: rule for rule in rules}
+        self._by_metric: Dict[str, List[Rule]] = {}
+        self._series: Dict[tuple, Series] = {}
+        self._lock = threading.Lock()
+        # Keys of the firing series, per database
+        self._firing: Dict[str, set] = {}
+
+    def rules_for(self, metric: str) -> List[Rule]:
+        rules = self._by_metric.get(metric)
+        if rules is None:
+            rules = self._by_metric[metric] = [rule for rule in self.rules if fnmatch.fnmatchcase(metric, rule.metric)]
+        return rules
+
+    def _open_series(self, db: Session) -> set:
+        alert = models.Alert
+        return {(rule, server_id, metric) for server_id, rule, metric in db.query(
+            alert.server_id, alert.rule, alert.metric).filter(alert.resolved == False, alert.rule.is_not(None))
+            if rule in self._by_name}
+
+    def _sync_firing(self, firing: set, open_series: set):
+        """Mark exactly the series with an open alert as firing; other processes raise and resolve them too"""
+        for key in firing - open_series:
+            series = self._series.get(key)
+            if series is not None:
+                series.firing = False
+                if self._by_name[key[0]].type == "threshold" and not series.streak:
+                    del self._series[key]
+        for key in open_series - firing:
+            self._series.setdefault(key, Series()).firing = True
+        firing.clear()
+        firing.update(open_series)
+
+    def _step(self, rule: Rule, server_id: int, metric: str, value: float, ts: int, firing: set):
+        """Advance one series; returns ("fire" | "resolve", reading) or None"""
+        key = (rule.name, server_id, metric)
+        series = self._series.get(key)
+        check = OPS[rule.op]
+        reading = value
+        if rule.type == "threshold":
+            if series is None:
+                # Quiet threshold series have no state
+                if not check(reading, rule.value):
+                    return None
+                series = self._series[key] = Series()
+        else:
+            if series is None:
+                series = self._series[key] = Series()
+            last_ts, last_value = series.last_ts, series.last_value
+            if last_ts is not None and ts <= last_ts:
+                return None  # late sample
+            series.last_ts, series.last_value = ts, value
+            if last_ts is None:
+                return None
+            reading = (value - last_value) / (ts - last_ts) * rule.per_seconds
+        event = None
+        if series.firing:
+            if not check(reading, rule.clear):
+                series.firing, series.streak, event = False, 0, ("resolve", reading)
+                firing.discard(key)
+        elif check(reading, rule.value):
+            series.streak += 1
+            if series.streak >= rule.for_count:
+                series.firing, series.streak, event = True, 0, ("fire", reading)
+                firing.add(key)
+        else:
+            series.streak = 0
+        if rule.type == "threshold" and not series.firing and not series.streak:
+            del self._series[key]
+        return event
+
+    def _restore(self, firing: set, undo: Dict[tuple, Optional[Series]]):
+        """Put series back as they were before a batch whose transaction did not commit"""
+        with self._lock:
+            for key, series in undo.items():
+                if series is None:
+                    self._series.pop(key, None)
+                    firing.discard(key)
+                    continue
+                self._series[key] = series
+                if series.firing:
+                    firing.add(key)
+                else:
+                    firing.discard(key)
+
+    def observe(self, db: Session, samples: List[tuple]) -> dict:
+        """Evaluate (server_id, metrics, ts) samples and write the alerts they fire or resolve (caller commits)"""
+        fired, resolved = [], []
+        # Read before taking the lock, so a slow database does not hold up the others
+        open_series = self._open_series(db)
+        # Each series as it was before this batch, by key
+        undo = {}
+        with self._lock:
+            firing = self._firing.setdefault(db.get_bind().url.database, set())
+            self._sync_firing(firing, open_series)
+            for server_id, metrics, ts in samples:
+                epoch = to_epoch(ts)
+                for metric, value in metrics.items():
+                    for rule in self.rules_for(metric):
+                        key = (rule.name, server_id, metric)
+                        if key not in undo:
+                            series = self._series.get(key)
+                            undo[key] = None if series is None else series.copy()
+                        event = self._step(rule, server_id, metric, value, epoch, firing)
+                        if event is None:
+                            continue
+                        kind, reading = event
+                        row = {"server_id": server_id, "rule": rule.name, "metric": metric}
+                        if kind == "fire":
+                            fired.append({**row, "severity": rule.severity, "message": rule.message(metric, reading),
+                                          "value": reading, "resolved": False, "created_at": from_epoch(epoch)})
+                        else:
+                            resolved.append({**row, "ts": from_epoch(epoch)})
+        if undo:
+            db.info.setdefault(_UNDO, []).append((self, firing, undo))
+        if fired:
+            db.execute(insert(models.Alert).on_conflict_do_nothing(
+                index_elements=["server_id", "rule", "metric"],
+                index_where=text("resolved = 0 AND rule IS NOT NULL")), fired)
+        for row in resolved:
+            db.query(models.Alert).filter_by(
+                server_id=row["server_id"], rule=row["rule"], metric=row["metric"], resolved=False
+            ).update({"resolved": True, "resolved_at": row["ts"]}, synchronize_session=False)
+        return {"fired": len(fired), "resolved": len(resolved)}
+
+    def tracked(self) -> Dict[str, int]:
+        counts = {rule.name: 0 for rule in self.rules}
+        with self._lock:
+            for name, _, _ in self._series:
+                counts[name] += 1
+        return counts
+
+
+# Session.info key of the series changes made in the session's open transaction
+_UNDO = "alert_rules.undo"
+
+
+@listens_for(Session, "after_commit")
+def _keep_series(session: Session):
+    session.info.pop(_UNDO, None)
+
+
+@listens_for(Session, "after_transaction_end")
+def _undo_series(session: Session, transaction):
+    # Still there when the transaction ended without a commit: rolled back or closed
+    if transaction.parent is None:
+        for rule_engine, firing, undo in reversed(session.info.pop(_UNDO, [])):
+            rule_engine._restore(firing, undo)
+
+
+engine = RuleEngine(load_rules(os.getenv("ALERT_RULES")))
+
+
+def evaluate(db: Session, server_id: int, metrics: Dict[str, float], ts: datetime = None) -> dict:
+    return engine.observe(db, [(server_id, metrics, ts or datetime.utcnow())])
+
+
+def _open_alerts(db: Session) -> Dict[str, int]:
+    alert = models.Alert
+    return dict(db.query(alert.rule, func.count()).filter(
+        alert.resolved == False, alert.rule.is_not(None)).group_by(alert.rule))
+
+
+router = APIRouter()
+
+@router.get("/alert-rules")
+def list_alert_rules(db: Session = Depends(get_db)):
+    # Series in memory are this process's; open alerts are fleet-wide, from every database
+    open_alerts = sum(map(Counter, fan_out(_open_alerts)), Counter()) if SHARDED else _open_alerts(db)
+    tracked = engine.tracked()
+    return [{**rule.describe(), "tracked_series": tracked[rule.name], "open_alerts": open_alerts.get(rule.name, 0)}
+            for rule in engine.rules]
@@ -0,0 +1,193 @@
+"""
+Fleet capacity analytics.
+
+Answers questions like "how many Production servers are above 85% disk" or
+"p95 memory usage per environment" from latest_metrics. One SQL query loads
+the selected servers' newest values into contiguous numpy arrays, and all
+groups are then summarised together: a single lexsort orders the values by
+group, and percentiles, histograms and threshold counts come out of
+bincount/indexing over the whole array rather than a Python loop per group.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from .database import SHARDED, get_db
+from .shards import fan_out
+
+NO_GROUP = "(none)"
+
+
+def _fetch(db: Session, sql: str, params=()):
+    # Plain DBAPI cursor: building 100k SQLAlchemy Row objects costs more than the query
+    cursor = db.connection().connection.driver_connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def _factorize(labels):
+    """Map labels to dense integer codes; returns (sorted keys, codes)"""
+    mapping = {}
+    codes = np.fromiter((mapping.setdefault(label, len(mapping)) for label in labels), dtype=np.int64, count=len(labels))
+    keys = sorted(mapping, key=str)
+    remap = np.empty(len(keys), dtype=np.int64)
+    for new_code, key in enumerate(keys):
+        remap[mapping[key]] = new_code
+    return keys, remap[codes]
+
+
+def labeled_values(db: Session, metric: str, group_by: str, environment: str = None,
+                   owner: str = None, tag: str = None) -> Tuple[list, np.ndarray]:
+    """Return (group label per row, value per row) for the selected servers that have the metric.
+
+    A `*` in the metric name (e.g. disk.*.used_pct) matches several series per
+    server and keeps the worst (highest) one. Servers are counted once per tag
+    when grouping by tag.
+    """
+    op = "GLOB" if "*" in metric else "="
+    rows = _fetch(db, f"SELECT server_id, value FROM latest_metrics WHERE metric {op} ?", (metric,))
+    if not rows:
+        return [], np.array([], dtype=np.float64)
+    data = np.array(rows, dtype=np.float64)
+    server_ids = data[:, 0].astype(np.int64)
+    # Dense per-server value array, indexed by server id
+    latest = np.full(int(server_ids.max()) + 1, np.nan)
+    if op == "=":
+        latest[server_ids] = data[:, 1]
+    else:
+        np.fmax.at(latest, server_ids, data[:, 1])
+
+    filters, params = [], []
+    if environment:
+        filters.append("s.environment = ?")
+        params.append(environment)
+    if owner:
+        filters.append("s.owner = ?")
+        params.append(owner)
+    if tag:
+        filters.append("s.id IN (SELECT server_id FROM server_tags WHERE tag = ?)")
+        params.append(tag)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    if group_by == "tag":
+        members = _fetch(db, f"SELECT s.id, t.tag FROM server_tags t JOIN servers s ON s.id = t.server_id {where}", params)
+    else:
+        column = "s.environment" if group_by == "environment" else "s.owner"
+        members = _fetch(db, f"SELECT s.id, COALESCE({column}, '{NO_GROUP}') FROM servers s {where}", params)
+    if not members:
+        return [], np.array([], dtype=np.float64)
+
+    ids, labels = zip(*members)
+    ids = np.fromiter(ids, dtype=np.int64, count=len(ids))
+    in_range = ids < latest.size
+    values = np.full(ids.size, np.nan)
+    values[in_range] = latest[ids[in_range]]
+    measured = ~np.isnan(values)
+    return [label for label, keep in zip(labels, measured) if keep], values[measured]
+
+
+def load_metric_arrays(db: Session, metric: str, group_by: str, environment: str = None,
+                       owner: str = None, tag: str = None):
+    """Return (group keys, group code per row, value per row) for the selected servers, from every
+    database unless an environment picks the one `db` is for"""
+    if SHARDED and not environment:
+        parts = fan_out(labeled_values, metric, group_by, None, owner, tag)
+        labels = [label for part_labels, _ in parts for label in part_labels]
+        values = np.concatenate([part_values for _, part_values in parts])
+    else:
+        labels, values = labeled_values(db, metric, group_by, environment, owner, tag)
+    keys, codes = _factorize(labels)
+    return keys, codes, values
+
+
+def summarize(keys: list, codes: np.ndarray, values: np.ndarray, threshold: float, percentiles: List[float],
+              bins: int, value_range=None) -> dict:
+    """Per-group count/mean/min/max, percentiles, threshold count and histogram in one pass"""
+    if values.size == 0:
+        return {"groups": [], "histogram_edges": []}
+    n_groups = len(keys)
+
+    # Sort by (group, value) once; every group is then a contiguous, ordered slice
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    counts = np.bincount(codes, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ends = starts + counts - 1
+
+    means = np.bincount(codes, weights=values, minlength=n_groups) / counts
+    above = np.bincount(codes, weights=(values > threshold).astype(np.float64), minlength=n_groups)
+
+    # Linear interpolation between closest ranks, same as numpy.percentile's default
+    q = np.asarray(percentiles, dtype=np.float64) / 100.0
+    positions = starts[:, None] + q[None, :] * (counts[:, None] - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    fraction = positions - lower
+    pct_values = sorted_values[lower] * (1 - fraction) + sorted_values[upper] * fraction
+
+    low, high = value_range if value_range else (float(values.min()), float(values.max()))
+    if high <= low:
+        high = low + 1.0
+    edges = np.linspace(low, high, bins + 1)
+    bin_index = np.clip(np.searchsorted(edges, values, side="right") - 1, 0, bins - 1)
+    histogram = np.bincount(codes * bins + bin_index, minlength=n_groups * bins).reshape(n_groups, bins)
+
+    groups = []
+    for i, key in enumerate(keys):
+        groups.append({
+            "key": str(key),
+            "servers": int(counts[i]),
+            "mean": round(float(means[i]), 2),
+            "min": float(sorted_values[starts[i]]),
+            "max": float(sorted_values[ends[i]]),
+            "percentiles": {f"p{p:g}": round(float(v), 2) for p, v in zip(percentiles, pct_values[i])},
+            "above_threshold": int(above[i]),
+            "histogram": histogram[i].tolist(),
+        })
+    return {"groups": groups, "histogram_edges": [round(float(e), 2) for e in edges]}
+
+
+def capacity_report(db: Session, metric: str, group_by: str, threshold: float, percentiles: List[float],
+                    bins: int, environment: str = None, owner: str = None, tag: str = None) -> dict:
+    keys, codes, values = load_metric_arrays(db, metric, group_by, environment, owner, tag)
+    # Percentages get fixed 0-100 buckets so histograms are comparable between calls
+    value_range = (0.0, 100.0) if metric.endswith("_pct") else None
+    report = summarize(keys, codes, values, threshold, percentiles, bins, value_range)
+    overall = summarize(["all"], np.zeros(values.size, dtype=np.int64), values, threshold, percentiles, bins, value_range)
+    return {
+        "metric": metric,
+        "group_by": group_by,
+        "threshold": threshold,
+        "servers": int(values.size),
+        "histogram_edges": report["histogram_edges"],
+        "overall": overall["groups"][0] if overall["groups"] else None,
+        "groups": report["groups"],
+    }
+
+
+router = APIRouter()
+
+@router.get("/analytics/capacity")
+def fleet_capacity(
+    metric: str = "disk.*.used_pct",
+    group_by: str = Query("environment", pattern="^(environment|owner|tag)$"),
+    threshold: float = 85.0,
+    percentiles: str = "50,90,95,99",
+    bins: int = Query(10, ge=1, le=100),
+    environment: Optional[str] = None,
+    owner: Optional[str] = None,
+    tag: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    try:
+        wanted = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="percentiles must be a comma-separated list of numbers")
+    if not wanted or any(p < 0 or p > 100 for p in wanted):
+        raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+    return capacity_report(db, metric, group_by, threshold, wanted, bins, environment, owner, tag)
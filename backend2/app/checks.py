@@ -0,0 +1,273 @@
+"""
+Running a check script against a server.
+
+Each run is recorded in `check_runs` with the wall time of its phases
+(queue wait, process start, script run, DB write) and how it ended. The
+script's timeout is not fixed: `check_timeout` takes the p95 run time of
+recent runs in the server's environment/OS group and allows
+CHECK_TIMEOUT_MULTIPLIER times that, within CHECK_TIMEOUT_MIN/MAX_SECONDS.
+Runs that timed out count as taking exactly their timeout, so a group where
+more than 5% of checks time out gets a longer limit next time, while one hung
+host among healthy ones keeps being cut off quickly.
+
+A run can be cancelled through a threading.Event (the job worker sets it when
+the job is cancelled); the script process is killed and the check recorded
+as Cancelled.
+
+Simulated checks (no PowerShell on this host) wait on the simulator's event
+loop instead of the calling thread: `run_powershell_check` then returns a
+Future of the resulting check status, which the job worker finishes the job
+from once it resolves.
+"""
+
+from sqlalchemy.orm import Session
+import asyncio
+import time
+import subprocess
+import threading
+import json
+import os
+import signal
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Optional, Union
+from . import models
+from .database import session_for_server
+from .transitions import transition_status, begin_check, complete_check
+from .metrics import extract_metrics, record_metrics
+from .probes import is_linux, run_probe_check
+from . import alert_rules, simulator
+
+DEFAULT_TIMEOUT_SECONDS = float(os.getenv("CHECK_TIMEOUT_SECONDS", "30"))
+MIN_TIMEOUT_SECONDS = float(os.getenv("CHECK_TIMEOUT_MIN_SECONDS", "10"))
+MAX_TIMEOUT_SECONDS = float(os.getenv("CHECK_TIMEOUT_MAX_SECONDS", "300"))
+TIMEOUT_MULTIPLIER = float(os.getenv("CHECK_TIMEOUT_MULTIPLIER", "2"))
+TIMEOUT_MIN_SAMPLES = 20
+TIMEOUT_WINDOW = 200
+TIMEOUT_CACHE_SECONDS = 60
+POLL_SECONDS = 0.2
+KILL_GRACE_SECONDS = 5
+
+_timeouts = {}
+_timeouts_lock = threading.Lock()
+
+
+def _run_samples(db: Session, check_type: str, environment: str, os_name=None, by_os: bool = True):
+    """Recent run times in seconds; timed-out runs count as their timeout"""
+    run = models.CheckRun
+    query = db.query(run.outcome, run.run_ms, run.timeout_seconds).filter(
+        run.environment == environment, run.check_type == check_type,
+        run.outcome.in_(("completed", "timeout")))
+    if by_os:
+        query = query.filter(run.os.is_(os_name) if os_name is None else run.os == os_name)
+    return [timeout if outcome == "timeout" else run_ms / 1000
+            for outcome, run_ms, timeout in query.order_by(run.id.desc()).limit(TIMEOUT_WINDOW)
+            if (timeout if outcome == "timeout" else run_ms) is not None]
+
+
+def timeout_stats(db: Session, check_type: str, environment: str, os_name: str = None) -> dict:
+    """The adaptive timeout for a group and what it was derived from"""
+    basis, samples = "environment/os", _run_samples(db, check_type, environment, os_name)
+    if len(samples) < TIMEOUT_MIN_SAMPLES:
+        basis, samples = "environment", _run_samples(db, check_type, environment, by_os=False)
+    if len(samples) < TIMEOUT_MIN_SAMPLES:
+        return {"basis": "default", "samples": len(samples), "p95_seconds": None,
+                "timeout_seconds": DEFAULT_TIMEOUT_SECONDS}
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+    timeout = min(MAX_TIMEOUT_SECONDS, max(MIN_TIMEOUT_SECONDS, p95 * TIMEOUT_MULTIPLIER))
+    return {"basis": basis, "samples": len(samples), "p95_seconds": round(p95, 3),
+            "timeout_seconds": round(timeout, 1)}
+
+
+def check_timeout(db: Session, server: models.Server, check_type: str) -> float:
+    key = (server.environment, server.os, check_type)
+    now = time.monotonic()
+    with _timeouts_lock:
+        cached = _timeouts.get(key)
+    if cached and cached[1] > now:
+        return cached[0]
+    timeout = timeout_stats(db, check_type, server.environment, server.os)["timeout_seconds"]
+    with _timeouts_lock:
+        _timeouts[key] = (timeout, now + TIMEOUT_CACHE_SECONDS)
+    return timeout
+
+
+def record_run(db: Session, server: models.Server, check_type: str, outcome: str, phases: dict,
+               job_id: int = None, timeout: float = None):
+    db.add(models.CheckRun(
+        server_id=server.id, job_id=job_id, check_type=check_type, environment=server.environment,
+        os=server.os, outcome=outcome, timeout_seconds=timeout, finished_at=datetime.utcnow(), **phases))
+    db.commit()
+
+
+def _ms(seconds: float) -> int:
+    return int(round(seconds * 1000))
+
+
+def kill_process_tree(process: subprocess.Popen):
+    """Kill the script with anything it started, and collect whatever output it left"""
+    if os.name == "nt":
+        subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+    else:
+        os.killpg(process.pid, signal.SIGKILL)
+    try:
+        return process.communicate(timeout=KILL_GRACE_SECONDS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        return "", ""
+
+
+def run_powershell_check(db: Session, server_id: int, check_type: str, cancel: threading.Event = None,
+                         job_id: int = None, queue_ms: int = None) -> Union[str, Future]:
+    """Run PowerShell script to check server health; returns how the run ended (see CheckRun.outcome),
+    or a Future of the check status for a simulated check"""
+    # Get server details
+    server = db.query(models.Server).filter(models.Server.id == server_id).first()
+    if not server:
+        return "error"
+    phases = {"queue_ms": queue_ms}
+
+    # Update status to Running
+    begin_check(db, server_id, check_type)
+    timeout = check_timeout(db, server, check_type)
+
+    if is_linux(server.os):
+        # WMI only answers on Windows; Linux hosts get network probes with the same result shape
+        started = time.monotonic()
+        check_result = run_probe_check(server.ip_address, check_type, deadline=timeout)
+        phases.update(start_ms=0, run_ms=_ms(time.monotonic() - started))
+        return _record_result(db, server, check_type, check_result, "completed", phases, time.monotonic(),
+                              job_id, timeout)
+
+    # Run PowerShell script
+    script_path = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'check_server.ps1')
+    started = time.monotonic()
+    try:
+        process = subprocess.Popen([
+            'powershell.exe', '-ExecutionPolicy', 'Bypass', '-File',
+            script_path, '-CheckType', check_type, '-ServerName', server.ip_address
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=os.name != "nt")
+    except OSError:
+        # No PowerShell on this host (development): simulate the check instead
+        return run_simulation_check(db, server_id, check_type, cancel, job_id, queue_ms, timeout)
+    spawned = time.monotonic()
+    phases["start_ms"] = _ms(spawned - started)
+
+    # Wait for the script, killing it when the timeout passes or the run is cancelled
+    outcome = "completed"
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=POLL_SECONDS)
+            break
+        except subprocess.TimeoutExpired:
+            if cancel is not None and cancel.is_set():
+                outcome = "cancelled"
+            elif time.monotonic() - spawned >= timeout:
+                outcome = "timeout"
+            else:
+                continue
+            stdout, stderr = kill_process_tree(process)
+            break
+    phases["run_ms"] = _ms(time.monotonic() - spawned)
+
+    written = time.monotonic()
+    check_result = None
+    if outcome == "cancelled":
+        result_status, issue_summary = 'Cancelled', 'Cancelled by operator'
+    elif outcome == "timeout":
+        result_status, issue_summary = 'Failed', f'Check timed out after {timeout:g}s'
+    elif process.returncode != 0 or not stdout.strip():
+        outcome = "error"
+        result_status = 'Failed'
+        issue_summary = (stderr or '').strip()[-500:] or f'Check script exited with code {process.returncode}'
+    else:
+        try:
+            check_result = json.loads(stdout.strip())
+        except json.JSONDecodeError:
+            outcome = "error"
+            result_status, issue_summary = 'Failed', 'Check script returned invalid JSON'
+    if check_result is not None:
+        return _record_result(db, server, check_type, check_result, outcome, phases, written, job_id, timeout)
+
+    complete_check(db, server_id, check_type, result_status, issue_summary)
+    phases["write_ms"] = _ms(time.monotonic() - written)
+    record_run(db, server, check_type, outcome, phases, job_id, timeout)
+    return outcome
+
+def _record_result(db: Session, server: models.Server, check_type: str, check_result: dict, outcome: str,
+                   phases: dict, written: float, job_id: int = None, timeout: float = None) -> str:
+    """Record a check_server.ps1-style result (PowerShell or probe) and the run"""
+    if check_result.get('Status') == 'Passed':
+        result_status = 'Passed'
+        issue_summary = check_result.get('Details', {}).get('Message', 'All checks passed')
+    elif check_result.get('Status') == 'Warning':
+        result_status = 'Warning'
+        issues = check_result.get('Issues', [])
+        issue_summary = '; '.join(issues)
+    else:
+        result_status = 'Failed'
+        issue_summary = check_result.get('Details', {}).get('Message', 'Check failed')
+
+    # Keep the numeric readings (disk/memory/uptime/latency) as time series, and raise or
+    # resolve the alerts they cross
+    metrics = extract_metrics(check_result)
+    record_metrics(db, server.id, metrics)
+    alert_rules.evaluate(db, server.id, metrics)
+    db.commit()
+
+    # Update database (Passed moves the server on to Migrated/Completed)
+    complete_check(db, server.id, check_type, result_status, issue_summary)
+    phases["write_ms"] = _ms(time.monotonic() - written)
+    record_run(db, server, check_type, outcome, phases, job_id, timeout)
+    return outcome
+
+def run_simulation_check(db: Session, server_id: int, check_type: str, cancel: threading.Event = None,
+                         job_id: int = None, queue_ms: int = None, timeout: float = None) -> Union[str, Future]:
+    """Fallback simulation check, drawn from the server's environment profile (see simulator.py).
+
+    The check is started here and then waits on the simulation loop; the returned
+    Future resolves to the resulting check status once the result is recorded.
+    """
+    # Set status to Running
+    status = begin_check(db, server_id, check_type)
+    if status is None:
+        return "error"
+    server = db.get(models.Server, server_id)
+    timeout = timeout or check_timeout(db, server, check_type)
+    sample = simulator.draw(server_id, check_type, status.version, server.environment)
+    return simulator.simulation_loop.submit(
+        _simulated_check(server_id, check_type, sample, timeout, cancel, job_id, queue_ms))
+
+async def _simulated_check(server_id: int, check_type: str, sample: dict, timeout: float,
+                           cancel: Optional[threading.Event], job_id: int, queue_ms: int) -> Optional[str]:
+    # Simulate check duration (a cancel ends the wait early)
+    started = time.monotonic()
+    outcome = await simulator.simulate(sample, timeout, cancel)
+    phases = {"queue_ms": queue_ms, "run_ms": _ms(time.monotonic() - started)}
+    # The writes block, so they run off the loop
+    return await asyncio.to_thread(_record_simulation, server_id, check_type, outcome, sample, timeout, phases,
+                                   job_id)
+
+def _record_simulation(server_id: int, check_type: str, outcome: str, sample: dict, timeout: float, phases: dict,
+                       job_id: int) -> Optional[str]:
+    db = session_for_server(server_id)
+    try:
+        written = time.monotonic()
+        result, issue_summary = simulator.check_result(outcome, sample, timeout)
+        complete_check(db, server_id, check_type, result, issue_summary)
+        phases["write_ms"] = _ms(time.monotonic() - written)
+        record_run(db, db.get(models.Server, server_id), check_type, simulator.RUN_OUTCOMES[outcome], phases,
+                   job_id, timeout)
+        current = db.get(models.CurrentStatus, server_id)
+        return getattr(current, f"{check_type}_status") if current is not None else None
+    finally:
+        db.close()
+
+def insert_new_status(db: Session, server_id: int, precheck_status: str, migration_status: str = None, issue_summary: str = None):
+    # Retires the previous current status and appends this one (see transitions.py). The
+    # migration status carries over unless the caller moves it; a new server starts Ready
+    changes = {"precheck_status": precheck_status, "postcheck_status": None, "issue_summary": issue_summary}
+    if migration_status is not None:
+        changes["migration_status"] = migration_status
+    return transition_status(db, server_id, changes)
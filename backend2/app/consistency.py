@@ -0,0 +1,104 @@
+"""
+Consistency checks between the status history (server_status) and the
+current-status read model (server_current_status).
+
+Drift can come from rows written before the read model existed, from manual
+edits to the database or from older code paths that left several
+is_current rows for one server. `find_drift` reports it and `repair_drift`
+fixes it by keeping the newest current row per server and rebuilding the
+read model from the history.
+"""
+
+from fastapi import APIRouter, Depends
+from sqlalchemy import func, or_, and_, not_, exists
+from sqlalchemy.orm import Session
+
+from . import models
+from .crud import CURRENT_STATUS_FIELDS
+from .database import get_db
+from .history import OPEN_END
+
+
+def _servers_with_multiple_current(db: Session):
+    return [server_id for (server_id,) in db.query(models.ServerStatus.server_id).filter(
+        models.ServerStatus.is_current == True
+    ).group_by(models.ServerStatus.server_id).having(func.count() > 1)]
+
+
+def _servers_without_current(db: Session):
+    has_current = exists().where(and_(
+        models.ServerStatus.server_id == models.Server.id,
+        models.ServerStatus.is_current == True,
+    ))
+    has_history = exists().where(models.ServerStatus.server_id == models.Server.id)
+    return [server_id for (server_id,) in db.query(models.Server.id).filter(has_history, not_(has_current))]
+
+
+def _stale_read_model_rows(db: Session):
+    """Servers whose read-model row is missing, points at a non-current row or has different values"""
+    ss, cs = models.ServerStatus, models.CurrentStatus
+    missing = db.query(ss.server_id).outerjoin(cs, cs.server_id == ss.server_id).filter(
+        ss.is_current == True, cs.server_id == None)
+    mismatched = db.query(cs.server_id).outerjoin(ss, ss.id == cs.status_id).filter(or_(
+        ss.id == None,
+        ss.is_current != True,
+        *[getattr(ss, field).is_not(getattr(cs, field)) for field in CURRENT_STATUS_FIELDS],
+    ))
+    return sorted({server_id for (server_id,) in missing.union(mismatched)})
+
+
+def find_drift(db: Session) -> dict:
+    multiple = _servers_with_multiple_current(db)
+    without = _servers_without_current(db)
+    stale = _stale_read_model_rows(db)
+    return {
+        "consistent": not (multiple or without or stale),
+        "multiple_current": multiple,
+        "missing_current": without,
+        "stale_current_status": stale,
+    }
+
+
+def rebuild_current_status(db: Session):
+    """Recreate the read model from the is_current history rows (caller commits)"""
+    ss = models.ServerStatus
+    db.query(models.CurrentStatus).delete(synchronize_session=False)
+    db.execute(models.CurrentStatus.__table__.insert().from_select(
+        ["server_id", "status_id", *CURRENT_STATUS_FIELDS],
+        db.query(ss.server_id, ss.id, *[getattr(ss, field) for field in CURRENT_STATUS_FIELDS])
+        .filter(ss.is_current == True, ss.server_id != None)
+    ))
+
+
+def repair_drift(db: Session) -> dict:
+    report = find_drift(db)
+    if report["consistent"]:
+        return report
+    ss = models.ServerStatus
+    # Keep only the newest row current for servers with several, and promote the
+    # newest history row for servers that lost their current one. The promoted row's
+    # interval is reopened and any other open one closed where it starts, so
+    # `statuses_at` sees the same row as the read model
+    for server_id in report["multiple_current"] + report["missing_current"]:
+        latest = db.query(ss.id, ss.valid_from).filter(ss.server_id == server_id).order_by(
+            ss.last_checked.desc().nullslast(), ss.id.desc()).first()
+        db.query(ss).filter(ss.server_id == server_id, ss.id != latest.id, ss.is_current == True).update(
+            {"is_current": False}, synchronize_session=False)
+        db.query(ss).filter(ss.server_id == server_id, ss.id != latest.id, ss.valid_to == OPEN_END).update(
+            {"valid_to": func.max(ss.valid_from, latest.valid_from)}, synchronize_session=False)
+        db.query(ss).filter(ss.id == latest.id).update(
+            {"is_current": True, "valid_to": OPEN_END}, synchronize_session=False)
+    rebuild_current_status(db)
+    db.commit()
+    return {**report, "repaired": True, "after": find_drift(db)}
+
+
+router = APIRouter()
+
+@router.get("/admin/consistency")
+def check_consistency(db: Session = Depends(get_db)):
+    return find_drift(db)
+
+@router.post("/admin/consistency/repair")
+def repair_consistency(db: Session = Depends(get_db)):
+    return repair_drift(db)
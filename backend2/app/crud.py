@@ -1,11 +1,59 @@
+from datetime import datetime
+from sqlalchemy import func, case
 from sqlalchemy.orm import Session
-from . import models
+from sqlalchemy.dialects.sqlite import insert
+from . import models, read_models, schemas
+
+CURRENT_STATUS_FIELDS = ("migration_status", "precheck_status", "postcheck_status", "issue_summary", "last_checked", "version")
 
 def get_servers(db: Session):
-    return db.query(models.Server).all()
+    return read_models.servers(db)
 
 def get_server_statuses(db: Session):
-    return db.query(models.ServerStatus).filter_by(is_current=True).all()
+    return read_models.current_statuses(db).all()
+
+# Newest first, ties newest id first. `alert_order` is the same order as a sort key (with
+# reverse=True), for merging lists that were each read in it; NULL times sort last, as in SQLite
+ALERT_ORDER = (models.Alert.created_at.desc(), models.Alert.id.desc())
+
+def alert_order(alert):
+    return (alert.created_at is not None, alert.created_at or datetime.min, alert.id)
+
+def get_alerts(db: Session, as_of=None):
+    query = db.query(*read_models.columns(models.Alert, schemas.Alert))
+    if as_of is not None:
+        query = query.filter(models.Alert.created_at <= as_of)
+    return query.order_by(*ALERT_ORDER).limit(10).all()
+
+def count_current_statuses(db: Session, as_of=None):
+    """All dashboard/chart status counts in one pass over the current-status table.
+
+    With `as_of`, counts the history rows whose validity interval contains that
+    time instead, which is the same single index scan.
+    """
+    def count(column, value):
+        return func.coalesce(func.sum(case((column == value, 1), else_=0)), 0)
+    cs = models.CurrentStatus if as_of is None else models.ServerStatus
+    query = db.query(
+        count(cs.migration_status, "Ready").label("ready"),
+        count(cs.migration_status, "Blocked").label("blocked"),
+        count(cs.migration_status, "Completed").label("completed"),
+        count(cs.precheck_status, "Passed").label("precheck_passed"),
+        count(cs.precheck_status, "Failed").label("precheck_failed"),
+        count(cs.postcheck_status, "Passed").label("postcheck_passed"),
+        count(cs.postcheck_status, "Failed").label("postcheck_failed"),
+    )
+    if as_of is not None:
+        query = query.filter(cs.valid_to > as_of, cs.valid_from <= as_of)
+    return query.one()
 
-def get_alerts(db: Session):
-    return db.query(models.Alert).order_by(models.Alert.created_at.desc()).limit(10).all() 
\ No newline at end of file
+def upsert_current_status(db: Session, status: models.ServerStatus):
+    """Mirror a current ServerStatus row into server_current_status in the caller's transaction"""
+    if status.id is None:
+        db.flush()
+    values = {field: getattr(status, field) for field in CURRENT_STATUS_FIELDS}
+    db.execute(
+        insert(models.CurrentStatus)
+        .values(server_id=status.server_id, status_id=status.id, **values)
+        .on_conflict_do_update(index_elements=["server_id"], set_=dict(status_id=status.id, **values))
+    )
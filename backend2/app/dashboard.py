@@ -0,0 +1,202 @@
+"""
+Dashboard datasets.
+
+Each section the dashboard shows (summary cards, check pie chart, timeline,
+alerts, recent activity) is built by one function here. The individual
+endpoints in api.py return a single section each; `GET /dashboard` returns
+any subset in one response. The bundle reads every section inside one read
+transaction, so all numbers come from the same snapshot of the database, and
+the summary and chart share one pass over the current-status table.
+
+Every section also takes `as_of` and then shows the dashboard as it stood at
+that time, counted from the validity intervals on the status history (see
+history.py).
+
+SQLite runs one statement at a time per connection, and a second connection
+would read a different snapshot, so the sections are built one after the
+other rather than in parallel; the bundle saves the round trips and
+per-request session setup instead.
+
+With shards (see shards.py), `fleet_bundle` builds the sections on every
+database at once and adds them up: counts are summed, and alerts and recent
+activity are merged newest first.
+"""
+
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import case, func, or_
+from sqlalchemy.orm import Session
+
+from . import crud, models, schemas
+from .database import SHARDED, get_db, read_snapshot
+from .history import utc
+from .shards import fan_out, merge
+
+SECTIONS = ("summary", "migration_chart", "timeline", "alerts", "recent_activity")
+
+
+def summary(db: Session, counts=None, as_of: datetime = None) -> dict:
+    counts = counts or crud.count_current_statuses(db, as_of)
+    servers = db.query(models.Server)
+    if as_of is not None:
+        servers = servers.filter(or_(models.Server.created_at == None, models.Server.created_at <= as_of))
+    return {
+        "total_servers": servers.count(),
+        "ready_servers": counts.ready,
+        "blocked_servers": counts.blocked,
+        "migrated_servers": counts.completed,
+        "postcheck_passed": counts.postcheck_passed,
+    }
+
+
+def migration_chart(db: Session, counts=None, as_of: datetime = None) -> list:
+    # Pie chart: PreCheck Passed/Failed, PostCheck Passed/Failed
+    counts = counts or crud.count_current_statuses(db, as_of)
+    return [
+        {"name": "PreCheck Passed", "value": counts.precheck_passed},
+        {"name": "PreCheck Failed", "value": counts.precheck_failed},
+        {"name": "PostCheck Passed", "value": counts.postcheck_passed},
+        {"name": "PostCheck Failed", "value": counts.postcheck_failed},
+    ]
+
+
+def timeline(db: Session, as_of: datetime = None) -> list:
+    # Bar chart: completed/failed migrations per day (last 7 days)
+    today = (as_of or datetime.utcnow()).date()
+    seven_days_ago = today - timedelta(days=6)
+    window = [models.Migration.completed_at != None, func.date(models.Migration.completed_at) >= seven_days_ago]
+    if as_of is not None:
+        window.append(models.Migration.completed_at <= as_of)
+    results = db.query(
+        func.date(models.Migration.completed_at).label("date"),
+        func.count(case((models.Migration.status == "completed", 1))).label("completed"),
+        func.count(case((models.Migration.status == "failed", 1))).label("failed")
+    ).filter(*window).group_by(func.date(models.Migration.completed_at)).order_by(func.date(models.Migration.completed_at)).all()
+    # Fill missing days
+    date_map = {r.date.strftime("%b %d"): {"completed": r.completed, "failed": r.failed} for r in results}
+    data = []
+    for i in range(7):
+        day = seven_days_ago + timedelta(days=i)
+        label = day.strftime("%b %d")
+        data.append({
+            "date": label,
+            "completed": date_map.get(label, {}).get("completed", 0),
+            "failed": date_map.get(label, {}).get("failed", 0),
+        })
+    return data
+
+
+def alerts(db: Session, as_of: datetime = None) -> list:
+    # Converted here because the snapshot's rollback expires the ORM objects
+    return [schemas.Alert.model_validate(alert) for alert in crud.get_alerts(db, as_of)]
+
+
+def _recent_statuses(db: Session, as_of: datetime = None) -> list:
+    # Example: last 4 status changes (customize as needed)
+    statuses = db.query(models.ServerStatus.last_checked, models.Server.name,
+                        models.ServerStatus.migration_status).join(models.Server)
+    if as_of is not None:
+        statuses = statuses.filter(models.ServerStatus.last_checked <= as_of)
+    return statuses.order_by(models.ServerStatus.last_checked.desc()).limit(4).all()
+
+
+def _activity(last_checked: Optional[datetime], server: str, migration_status: str) -> dict:
+    # Map migration_status to UI status
+    if migration_status == "Completed":
+        ui_status = "success"
+        action = "PostCheck Completed"
+    elif migration_status == "Blocked":
+        ui_status = "warning"
+        action = "PreCheck Warning"
+    elif migration_status == "Ready":
+        ui_status = "success"
+        action = "Migration Completed"
+    elif migration_status == "Failed":
+        ui_status = "error"
+        action = "PostCheck Failed"
+    else:
+        ui_status = "info"
+        action = migration_status
+    return {
+        "server": server,
+        "status": ui_status,
+        "action": action,
+        "time": last_checked.strftime("%b %d, %H:%M") if last_checked else "-",
+    }
+
+
+def recent_activity(db: Session, as_of: datetime = None) -> list:
+    return [_activity(*row) for row in _recent_statuses(db, as_of)]
+
+
+def dashboard_bundle(db: Session, sections=SECTIONS, as_of: datetime = None, activity=recent_activity) -> dict:
+    """The chosen sections, live or as they stood at `as_of`"""
+    bundle = {"generated_at": datetime.utcnow(), "as_of": as_of}
+    with read_snapshot(db):
+        counts = crud.count_current_statuses(db, as_of) if {"summary", "migration_chart"} & set(sections) else None
+        if "summary" in sections:
+            bundle["summary"] = summary(db, counts, as_of)
+        if "migration_chart" in sections:
+            bundle["migration_chart"] = migration_chart(db, counts, as_of)
+        if "timeline" in sections:
+            bundle["timeline"] = timeline(db, as_of)
+        if "alerts" in sections:
+            bundle["alerts"] = alerts(db, as_of)
+        if "recent_activity" in sections:
+            bundle["recent_activity"] = activity(db, as_of)
+    return bundle
+
+
+def _newest_first(value: Optional[datetime]):
+    # Like ORDER BY ... DESC in SQLite, where NULL sorts last
+    return (value is not None, value or datetime.min)
+
+
+def fleet_bundle(db: Session, sections=SECTIONS, as_of: datetime = None) -> dict:
+    """dashboard_bundle over every database, added up"""
+    if not SHARDED:
+        return dashboard_bundle(db, sections, as_of)
+    # Recent activity comes back as rows, so it can be merged by time
+    parts = fan_out(dashboard_bundle, sections, as_of, _recent_statuses)
+    bundle = {"generated_at": datetime.utcnow(), "as_of": as_of}
+    if "summary" in sections:
+        bundle["summary"] = {key: sum(part["summary"][key] for part in parts) for key in parts[0]["summary"]}
+    if "migration_chart" in sections:
+        bundle["migration_chart"] = [{"name": slice_["name"], "value": sum(part["migration_chart"][i]["value"]
+                                                                          for part in parts)}
+                                     for i, slice_ in enumerate(parts[0]["migration_chart"])]
+    if "timeline" in sections:
+        bundle["timeline"] = [{"date": day["date"], **{key: sum(part["timeline"][i][key] for part in parts)
+                                                       for key in ("completed", "failed")}}
+                              for i, day in enumerate(parts[0]["timeline"])]
+    if "alerts" in sections:
+        bundle["alerts"] = merge((part["alerts"] for part in parts), key=crud.alert_order, reverse=True)[:10]
+    if "recent_activity" in sections:
+        bundle["recent_activity"] = [_activity(*row) for row in merge(
+            (part["recent_activity"] for part in parts), key=lambda row: _newest_first(row[0]), reverse=True)[:4]]
+    return bundle
+
+
+def fleet_section(db: Session, section: str, as_of: datetime = None):
+    """One section over every database"""
+    if not SHARDED:
+        return SECTION_BUILDERS[section](db, as_of=as_of)
+    return fleet_bundle(db, [section], as_of)[section]
+
+
+SECTION_BUILDERS = {"summary": summary, "migration_chart": migration_chart, "timeline": timeline,
+                    "alerts": alerts, "recent_activity": recent_activity}
+
+router = APIRouter()
+
+@router.get("/dashboard", response_model=schemas.DashboardBundle, response_model_exclude_none=True)
+def get_dashboard(sections: Optional[str] = None, as_of: Optional[datetime] = None, db: Session = Depends(get_db)):
+    # ?sections=summary,alerts picks sections; all of them by default
+    wanted = [s.strip() for s in sections.split(",") if s.strip()] if sections else list(SECTIONS)
+    unknown = sorted(set(wanted) - set(SECTIONS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}; "
+                                                    f"choose from {', '.join(SECTIONS)}")
+    return fleet_bundle(db, wanted, utc(as_of))
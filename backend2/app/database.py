@@ -1,26 +1,146 @@
+import json
 import os
-from sqlalchemy import create_engine, text
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from fastapi import Request
+from sqlalchemy import create_engine, text, event, inspect
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
 load_dotenv()
 
 # Force SQLite usage - ignore any PostgreSQL DATABASE_URL from environment
-DATABASE_URL = "sqlite:///./infra_nova.db"
+# (INFRA_NOVA_DB only moves the SQLite file, e.g. for benchmarks)
+DATABASE_PATH = os.getenv("INFRA_NOVA_DB", "./infra_nova.db")
+DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
+# Environments whose servers live in a database file of their own (see shards.py), e.g.
+# {"Production": "./infra_nova_production.db", "UAT": "./infra_nova_nonprod.db"}; the rest stay in the main file
+SHARDS = {environment: path for environment, path in json.loads(os.getenv("INFRA_NOVA_SHARDS") or "{}").items()
+          if os.path.abspath(path) != os.path.abspath(DATABASE_PATH)}
+# How often a server id that no database is known to hold may trigger a reload of the directory
+DIRECTORY_RELOAD_SECONDS = 10
 
-# For SQLite, we need to enable foreign key support
-engine = create_engine(
-    DATABASE_URL, 
-    connect_args={"check_same_thread": False}
-)
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL keeps readers going while a worker process holds the write lock,
+    # busy_timeout makes competing writers wait instead of failing, and
+    # synchronous=NORMAL is the recommended durability level for WAL
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+def create_sqlite_engine(path: str):
+    # For SQLite, we need to enable foreign key support
+    sqlite_engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False, "timeout": 30})
+    event.listen(sqlite_engine, "connect", set_sqlite_pragmas)
+    return sqlite_engine
+
+engine = create_sqlite_engine(DATABASE_PATH)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
+# Every database by file path, the main one first
+engines = {DATABASE_PATH: engine}
+sessions = {DATABASE_PATH: SessionLocal}
+for _path in SHARDS.values():
+    if _path not in engines:
+        engines[_path] = create_sqlite_engine(_path)
+        sessions[_path] = sessionmaker(autocommit=False, autoflush=False, bind=engines[_path])
+SHARDED = len(engines) > 1
+
+def shard_for_environment(environment: Optional[str]) -> str:
+    """Path of the database that holds an environment's servers"""
+    return SHARDS.get(environment, DATABASE_PATH)
+
+class ShardDirectory:
+    """Which database holds each server, read from all of them and reloaded when an unknown id comes up"""
+
+    def __init__(self):
+        self._paths: Dict[int, str] = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        paths = {}
+        for path, factory in sessions.items():
+            db = factory()
+            try:
+                for server_id, environment in db.execute(text("SELECT id, environment FROM servers")):
+                    # Mid-move a server is in two databases; the one its environment maps to wins
+                    if server_id not in paths or shard_for_environment(environment) == path:
+                        paths[server_id] = path
+            finally:
+                db.close()
+        self._paths, self._loaded_at = paths, time.monotonic()
+
+    def lookup(self, server_id: int) -> Optional[str]:
+        path = self._paths.get(server_id)
+        if path is None:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > DIRECTORY_RELOAD_SECONDS:
+                    self.load()
+            path = self._paths.get(server_id)
+        return path
+
+directory = ShardDirectory()
+
+def shard_of(server_id: int) -> str:
+    """Path of the database that holds a server; the main one when no database does"""
+    return (directory.lookup(server_id) if SHARDED else None) or DATABASE_PATH
+
+def session_for_server(server_id: int):
+    return sessions[shard_of(server_id)]()
+
+def session_for_environment(environment: Optional[str]):
+    return sessions[shard_for_environment(environment)]()
+
+def shard_for_request(request: Request) -> str:
+    """The database a request reads and writes: the one holding {server_id}, else the ?environment= one"""
+    if not SHARDED:
+        return DATABASE_PATH
+    server_id = request.path_params.get("server_id")
+    if server_id is not None:
+        try:
+            return shard_of(int(server_id))
+        except ValueError:
+            return DATABASE_PATH
+    return shard_for_environment(request.query_params.get("environment"))
+
+def get_db(request: Request):
+    db = sessions[shard_for_request(request)]()
     try:
         # Enable foreign key support for SQLite
         db.execute(text("PRAGMA foreign_keys = ON"))
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+@contextmanager
+def read_snapshot(db):
+    """Run the enclosed reads in one read transaction (sqlite3 only opens one for writes)"""
+    db.execute(text("BEGIN"))
+    try:
+        yield
+    finally:
+        db.rollback()
+
+def add_missing_columns(metadata, bind=engine):
+    """Add model columns that an older database file lacks (create_all only creates whole tables)"""
+    with bind.begin() as conn:
+        inspector = inspect(conn)
+        existing_tables = set(inspector.get_table_names())
+        for table in metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            present = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in present:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"
+                if column.server_default is not None:
+                    # SQLite only accepts a NOT NULL column when it comes with a default
+                    ddl += f"{'' if column.nullable else ' NOT NULL'} DEFAULT {column.server_default.arg}"
+                conn.execute(text(ddl))
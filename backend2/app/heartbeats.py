@@ -0,0 +1,267 @@
+"""
+Agent heartbeats.
+
+Agents on the servers push their health readings to `POST /heartbeats`
+instead of being polled over WMI. At a 30 s interval, 40,000 servers send
+about 1,300 heartbeats a second, which is far more commits than SQLite's
+single writer can take one request at a time. So the endpoint only validates
+the reading and puts it in an in-memory map keyed by server. A newer reading
+replaces one that has not been written yet. `HeartbeatWriter` writes the map
+with one bulk upsert every HEARTBEAT_FLUSH_MS, so a server costs at most one
+row write per flush, however often it reports.
+
+The writer also marks servers whose last heartbeat is older than
+HEARTBEAT_STALE_SECONDS by setting `stale_since`; the next heartbeat clears
+it. Servers that never sent a heartbeat are left alone, as they are still
+polled.
+
+With several API processes, each buffers its own heartbeats, and the upsert
+keeps whichever reading was received last. With shards, a flush writes each
+database's heartbeats in a transaction of its own.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from . import alert_rules, models, schemas
+from .database import SHARDED, get_db, sessions, shard_of
+from .history import utc
+from .shards import fan_out, merge
+
+logger = logging.getLogger(__name__)
+
+FLUSH_MS = float(os.getenv("HEARTBEAT_FLUSH_MS", "500"))
+STALE_SECONDS = float(os.getenv("HEARTBEAT_STALE_SECONDS", "90"))
+STALE_CHECK_SECONDS = float(os.getenv("HEARTBEAT_STALE_CHECK_SECONDS", "10"))
+# How often an unknown server id may trigger a reload of the known ids
+KNOWN_RELOAD_SECONDS = 10
+COLUMNS = ("received_at", "sent_at", "agent_version", "metrics", "stale_since")
+
+
+class KnownServers:
+    """Server ids held in memory, so heartbeats are validated without a query each"""
+
+    def __init__(self):
+        self._ids = frozenset()
+        self._loaded_at = None
+
+    def __contains__(self, server_id: int) -> bool:
+        return server_id in self._ids
+
+    def due(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > KNOWN_RELOAD_SECONDS
+
+    def load(self):
+        ids = set()
+        for factory in sessions.values():
+            db = factory()
+            try:
+                ids.update(server_id for (server_id,) in db.query(models.Server.id))
+            finally:
+                db.close()
+        self._ids = frozenset(ids)
+        self._loaded_at = time.monotonic()
+
+
+def mark_stale(db: Session, now: datetime = None) -> int:
+    """Set stale_since on servers whose last heartbeat is older than STALE_SECONDS"""
+    now = now or datetime.utcnow()
+    hb = models.ServerHeartbeat
+    marked = db.query(hb).filter(
+        hb.stale_since.is_(None), hb.received_at < now - timedelta(seconds=STALE_SECONDS)
+    ).update({"stale_since": now}, synchronize_session=False)
+    db.commit()
+    return marked
+
+
+class HeartbeatWriter:
+    """Keeps the latest unwritten heartbeat per server and writes them in one upsert per flush"""
+
+    def __init__(self, flush_ms: float = FLUSH_MS):
+        self.flush_seconds = flush_ms / 1000
+        self.stats = {"received": 0, "written": 0, "flushes": 0, "flush_ms_total": 0.0, "flush_ms_max": 0.0}
+        self._pending: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._next_stale_check = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="heartbeat-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def offer(self, server_id: int, sent_at: datetime = None, agent_version: str = None, metrics: dict = None):
+        reading = {"server_id": server_id, "received_at": datetime.utcnow(), "sent_at": utc(sent_at),
+                   "agent_version": agent_version, "metrics": json.dumps(metrics or {}), "stale_since": None}
+        with self._lock:
+            self._pending[server_id] = reading
+            self.stats["received"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "pending": len(self._pending), "flush_ms": self.flush_seconds * 1000}
+
+    def pending(self, server_id: int) -> Optional[dict]:
+        with self._lock:
+            return self._pending.get(server_id)
+
+    def flush(self) -> int:
+        """Write the buffered heartbeats; returns how many rows were written"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        started = time.perf_counter()
+        by_shard = {}
+        for server_id, reading in pending.items():
+            by_shard.setdefault(shard_of(server_id), []).append(reading)
+        failed = None
+        for path, readings in by_shard.items():
+            db = sessions[path]()
+            try:
+                upsert = insert(models.ServerHeartbeat)
+                db.execute(upsert.on_conflict_do_update(
+                    index_elements=["server_id"],
+                    set_={column: upsert.excluded[column] for column in COLUMNS},
+                    where=upsert.excluded.received_at >= models.ServerHeartbeat.received_at,
+                ), readings)
+                alert_rules.engine.observe(db, [(reading["server_id"], json.loads(reading["metrics"]),
+                                                 reading["received_at"]) for reading in readings])
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                # Put them back unless a newer heartbeat arrived meanwhile
+                with self._lock:
+                    for reading in readings:
+                        self._pending.setdefault(reading["server_id"], reading)
+                failed = failed or e
+            finally:
+                db.close()
+        if failed is not None:
+            raise failed
+        flush_ms = (time.perf_counter() - started) * 1000
+        self.stats["written"] += len(pending)
+        self.stats["flushes"] += 1
+        self.stats["flush_ms_total"] += flush_ms
+        self.stats["flush_ms_max"] = max(self.stats["flush_ms_max"], flush_ms)
+        return len(pending)
+
+    def _tick(self):
+        try:
+            self.flush()
+            if time.monotonic() >= self._next_stale_check:
+                self._next_stale_check = time.monotonic() + STALE_CHECK_SECONDS
+                for factory in sessions.values():
+                    db = factory()
+                    try:
+                        mark_stale(db)
+                    finally:
+                        db.close()
+        except Exception:
+            logger.exception("Heartbeat flush failed")
+
+    def _loop(self):
+        while not self._stop.wait(self.flush_seconds):
+            self._tick()
+        # Don't drop what arrived since the last flush
+        self._tick()
+
+
+known_servers = KnownServers()
+writer = HeartbeatWriter()
+
+
+def _entry(server_id: int, name: str, environment: str, reading: dict, now: datetime) -> dict:
+    return {
+        "server_id": server_id,
+        "name": name,
+        "environment": environment,
+        "age_seconds": int((now - reading["received_at"]).total_seconds()),
+        **reading,
+        "metrics": json.loads(reading["metrics"]) if reading["metrics"] else {},
+    }
+
+
+def _heartbeat_rows(db: Session, environment: Optional[str], stale: Optional[bool], limit: int, offset: int = 0):
+    """(matching servers, their rows by server id from `offset`)"""
+    hb = models.ServerHeartbeat
+    query = db.query(models.Server.id, models.Server.name, models.Server.environment,
+                     *[getattr(hb, column) for column in COLUMNS]).join(hb, hb.server_id == models.Server.id)
+    if environment:
+        query = query.filter(models.Server.environment == environment)
+    if stale is not None:
+        query = query.filter(hb.stale_since.is_not(None) if stale else hb.stale_since.is_(None))
+    return query.count(), query.order_by(models.Server.id).limit(limit).offset(offset).all()
+
+
+router = APIRouter()
+
+@router.post("/heartbeats", status_code=204)
+async def receive_heartbeat(heartbeat: schemas.Heartbeat):
+    # Runs on the event loop and touches the database only when the server id is new to this process
+    if heartbeat.server_id not in known_servers and known_servers.due():
+        await run_in_threadpool(known_servers.load)
+    if heartbeat.server_id not in known_servers:
+        raise HTTPException(status_code=404, detail="Server not found")
+    writer.offer(heartbeat.server_id, heartbeat.sent_at, heartbeat.agent_version, heartbeat.metrics)
+    return Response(status_code=204)
+
+@router.get("/heartbeats/writer")
+def heartbeat_writer_stats():
+    # This process's buffer; received minus written is what coalescing saved
+    return writer.snapshot()
+
+@router.get("/heartbeats", response_model=schemas.HeartbeatPage)
+def list_heartbeats(
+    environment: Optional[str] = None,
+    stale: Optional[bool] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    # An environment is in one database, which get_db has picked; otherwise every database's
+    # first offset + limit servers are merged by id
+    if SHARDED and not environment:
+        parts = fan_out(_heartbeat_rows, None, stale, offset + limit)
+        total = sum(count for count, _ in parts)
+        rows = merge((part_rows for _, part_rows in parts), key=lambda row: row[0])[offset:offset + limit]
+    else:
+        total, rows = _heartbeat_rows(db, environment, stale, limit, offset)
+    now = datetime.utcnow()
+    return {"stale_after_seconds": int(STALE_SECONDS), "total": total, "offset": offset,
+            "items": [_entry(*row[:3], dict(zip(COLUMNS, row[3:])), now) for row in rows]}
+
+@router.get("/servers/{server_id}/heartbeat", response_model=schemas.HeartbeatEntry)
+def get_server_heartbeat(server_id: int, db: Session = Depends(get_db)):
+    server = db.query(models.Server.id, models.Server.name, models.Server.environment).filter(
+        models.Server.id == server_id).first()
+    if server is None:
+        raise HTTPException(status_code=404, detail="Server not found")
+    # A buffered heartbeat is newer than the stored one
+    reading = writer.pending(server_id)
+    if reading is None:
+        hb = models.ServerHeartbeat
+        row = db.query(*[getattr(hb, column) for column in COLUMNS]).filter(hb.server_id == server_id).first()
+        reading = dict(zip(COLUMNS, row)) if row else None
+    if reading is None:
+        raise HTTPException(status_code=404, detail="No heartbeat from this server")
+    return _entry(*server, reading, datetime.utcnow())
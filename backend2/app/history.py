@@ -0,0 +1,127 @@
+"""
+Point-in-time status history.
+
+Every server_status row carries the interval it was the server's status for,
+[valid_from, valid_to). A row starts at its `last_checked` time and ends when
+the server's next row is appended; the current row runs to OPEN_END instead of
+NULL, so "which rows were current at t" is the single range `valid_to > t`
+followed by a `valid_from <= t` check, both answered from the covering
+ix_server_status_valid index. That is what the dashboard's `as_of` counts
+read, and it touches about as many index entries as the live read model has
+rows (plus the changes made since t), rather than a correlated scan per
+server.
+
+The intervals are maintained by a trigger on server_status, so every writer
+(transitions, batch updates, seed scripts, plain SQL) gets them, and
+`ensure_status_intervals` backfills rows written before the columns existed.
+
+`GET /status-history/diff?from=...&to=...` compares the fleet at two times.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import get_db
+
+OPEN_END = datetime(9999, 12, 31)
+_OPEN_END_SQL = f"'{OPEN_END:%Y-%m-%d %H:%M:%S.%f}'"
+# Same text format SQLAlchemy stores DateTime values in, so comparisons stay lexical
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
+
+_DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS server_status_valid_ai AFTER INSERT ON server_status BEGIN
+        UPDATE server_status SET valid_from = COALESCE(new.last_checked, {NOW_SQL})
+        WHERE id = new.id AND valid_from IS NULL;
+        UPDATE server_status SET valid_to = max(valid_from, (SELECT valid_from FROM server_status WHERE id = new.id))
+        WHERE id = (SELECT max(id) FROM server_status WHERE server_id = new.server_id AND id < new.id)
+          AND valid_to = {_OPEN_END_SQL};
+    END""",
+]
+
+_BACKFILL_VALID_FROM = f"UPDATE server_status SET valid_from = COALESCE(last_checked, {NOW_SQL}) WHERE valid_from IS NULL"
+
+def utc(value: Optional[datetime]) -> Optional[datetime]:
+    """A query parameter as naive UTC, which is how the backend stores and compares times"""
+    return value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+
+
+FIELDS = ("migration_status", "precheck_status", "postcheck_status", "issue_summary", "version")
+
+
+def backfill_valid_from(engine):
+    """Start rows that predate the interval columns at their last_checked time; runs before the drift
+    repair on startup, which closes intervals where other rows start"""
+    with engine.begin() as conn:
+        conn.execute(text(_BACKFILL_VALID_FROM))
+
+
+def ensure_status_intervals(engine):
+    """Create the interval trigger and fill in intervals for rows that predate it"""
+    with engine.begin() as conn:
+        for ddl in _DDL:
+            conn.execute(text(ddl))
+        conn.execute(text(_BACKFILL_VALID_FROM))
+        # Close every open row that has a later row for the same server
+        conn.execute(text(f"""
+            UPDATE server_status SET valid_to = max(valid_from, (
+                SELECT n.valid_from FROM server_status n
+                WHERE n.server_id = server_status.server_id AND n.id > server_status.id
+                ORDER BY n.id LIMIT 1))
+            WHERE valid_to = {_OPEN_END_SQL} AND EXISTS (
+                SELECT 1 FROM server_status n WHERE n.server_id = server_status.server_id AND n.id > server_status.id)
+        """))
+
+
+def statuses_at(db: Session, as_of: datetime):
+    """History rows that were each server's status at `as_of`, keyed by server id"""
+    ss = models.ServerStatus
+    rows = db.query(ss.server_id, *[getattr(ss, field) for field in FIELDS]).filter(
+        ss.valid_to > as_of, ss.valid_from <= as_of)
+    return {row[0]: dict(zip(FIELDS, row[1:])) for row in rows}
+
+
+def _count_by_status(statuses: dict) -> dict:
+    counts = {}
+    for status in statuses.values():
+        counts[status["migration_status"]] = counts.get(status["migration_status"], 0) + 1
+    return dict(sorted(counts.items()))
+
+
+def status_diff(db: Session, start: datetime, end: datetime, limit: int = 500) -> dict:
+    before, after = statuses_at(db, start), statuses_at(db, end)
+    changed = sorted(server_id for server_id in before.keys() | after.keys()
+                     if before.get(server_id) != after.get(server_id))
+    shown = changed[:limit]
+    names = dict(db.query(models.Server.id, models.Server.name).filter(models.Server.id.in_(shown))) if shown else {}
+    return {
+        "from": start,
+        "to": end,
+        "counts": {"from": _count_by_status(before), "to": _count_by_status(after)},
+        "changed": len(changed),
+        "servers": [
+            {"server_id": server_id, "name": names.get(server_id),
+             "from": before.get(server_id), "to": after.get(server_id)}
+            for server_id in shown
+        ],
+    }
+
+
+router = APIRouter()
+
+@router.get("/status-history/diff")
+def diff_status_history(
+    start: datetime = Query(..., alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    limit: int = Query(500, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    # Servers whose status differs between the two times; `to` defaults to now
+    start, end = utc(start), utc(end) or datetime.utcnow()
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be before 'from'")
+    return status_diff(db, start, end, limit)
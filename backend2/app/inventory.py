@@ -0,0 +1,364 @@
+"""
+Server inventory cache.
+
+get_server_info.ps1 reads a server's manufacturer, model, OS, CPU, memory,
+disks and network adapters over WMI. Instead of running it whenever someone
+needs those facts, the refresher keeps them in `server_inventory`: every
+INVENTORY_POLL_SECONDS it claims entries older than INVENTORY_TTL_HOURS and
+runs the script for them on at most INVENTORY_CONCURRENCY threads. Entries
+are claimed with one UPDATE, like check jobs, so several API processes never
+collect the same server at once, and a failed collection is retried after
+INVENTORY_RETRY_MINUTES rather than on every poll.
+
+Only the facts that describe the machine are kept; usage figures change on
+every run and belong to the check metrics. When a collection differs from the
+cached facts, each changed field is appended to `inventory_changes` with its
+old and new value, so hardware changes have a history. Linux servers are
+skipped, as WMI does not answer there.
+
+`GET /inventory` serves the cache with the age of every entry and whether it
+is stale; nothing there waits for WMI.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, or_, text
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .checks import kill_process_tree
+from .database import get_db, session_for_server, sessions
+from .probes import LINUX_NAMES
+
+logger = logging.getLogger(__name__)
+
+TTL_HOURS = float(os.getenv("INVENTORY_TTL_HOURS", "24"))
+RETRY_MINUTES = float(os.getenv("INVENTORY_RETRY_MINUTES", "30"))
+CONCURRENCY = int(os.getenv("INVENTORY_CONCURRENCY", "4"))
+POLL_SECONDS = float(os.getenv("INVENTORY_POLL_SECONDS", "300"))
+TIMEOUT_SECONDS = float(os.getenv("INVENTORY_TIMEOUT_SECONDS", "120"))
+SCRIPT_PATH = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'get_server_info.ps1')
+
+FACTS = ("Manufacturer", "Model", "OSName", "OSVersion", "Architecture", "Processor", "ProcessorCores",
+         "TotalMemoryGB")
+
+
+class CollectionError(Exception):
+    """get_server_info.ps1 could not read the server"""
+
+
+def normalize(info: dict) -> dict:
+    """The facts kept from a get_server_info.ps1 result; disks and adapters are keyed so diffs line up"""
+    facts = {key: info.get(key) for key in FACTS}
+    disks = info.get("Disks") or []
+    nics = info.get("NetworkAdapters") or []
+    # ConvertTo-Json emits a single element as an object rather than a list
+    disks = [disks] if isinstance(disks, dict) else disks
+    nics = [nics] if isinstance(nics, dict) else nics
+    facts["Disks"] = {str(disk["Drive"]): {"TotalGB": disk.get("TotalGB")} for disk in disks if disk.get("Drive")}
+    facts["NetworkAdapters"] = {
+        str(nic.get("MACAddress") or nic.get("Name")): {"Name": nic.get("Name"), "SpeedMbps": nic.get("SpeedMbps")}
+        for nic in nics if nic.get("MACAddress") or nic.get("Name")
+    }
+    return facts
+
+
+def flatten(facts: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in facts.items():
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def diff(old: dict, new: dict) -> List[tuple]:
+    """(field, old value, new value) for every field that differs; missing fields are None"""
+    old, new = flatten(old), flatten(new)
+    return [(field, old.get(field), new.get(field)) for field in sorted(old.keys() | new.keys())
+            if old.get(field) != new.get(field)]
+
+
+def collect(host: str, timeout: float = TIMEOUT_SECONDS) -> dict:
+    """Run get_server_info.ps1 against a host and return its normalized facts"""
+    try:
+        process = subprocess.Popen([
+            'powershell.exe', '-ExecutionPolicy', 'Bypass', '-File', SCRIPT_PATH, '-ServerName', host
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=os.name != "nt")
+    except OSError:
+        raise CollectionError("PowerShell is not available on this host")
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        kill_process_tree(process)
+        raise CollectionError(f"Inventory script timed out after {timeout:g}s")
+    try:
+        info = json.loads(stdout.strip())
+    except json.JSONDecodeError:
+        raise CollectionError((stderr or '').strip()[-500:] or "Inventory script returned invalid JSON")
+    if info.get("Error"):
+        raise CollectionError(str(info["Error"]))
+    return normalize(info)
+
+
+def _collectable():
+    # Skip Linux servers, in SQL so they are never claimed
+    os_name = func.lower(func.coalesce(models.Server.os, ""))
+    return ~or_(*[os_name.like(f"%{name}%") for name in LINUX_NAMES])
+
+
+def claim_entries(db: Session, limit: int, server_ids: List[int] = None, force: bool = False,
+                  now: datetime = None) -> List[tuple]:
+    """Claim up to `limit` entries due for collection; returns (server_id, ip_address, token) tuples.
+
+    An entry is due when its facts are older than the TTL and it was not tried
+    within the retry window. `force` skips both checks for `server_ids`, but
+    never takes an entry another collection is still working on.
+    """
+    now = now or datetime.utcnow()
+    inv = models.ServerInventory
+    db.execute(text("INSERT OR IGNORE INTO server_inventory (server_id) SELECT id FROM servers"))
+    in_flight = inv.attempted_at >= now - timedelta(seconds=TIMEOUT_SECONDS * 2)
+    if force:
+        due = [inv.server_id.in_(server_ids or []), or_(inv.claim_token.is_(None), ~in_flight)]
+    else:
+        due = [or_(inv.fetched_at.is_(None), inv.fetched_at < now - timedelta(hours=TTL_HOURS)),
+               or_(inv.attempted_at.is_(None), inv.attempted_at < now - timedelta(minutes=RETRY_MINUTES))]
+        if server_ids is not None:
+            due.append(inv.server_id.in_(server_ids))
+    token = uuid.uuid4().hex
+    candidates = db.query(inv.server_id).join(models.Server, models.Server.id == inv.server_id).filter(
+        _collectable(), *due).order_by(inv.fetched_at.is_not(None), inv.fetched_at).limit(limit).scalar_subquery()
+    claimed = db.query(inv).filter(inv.server_id.in_(candidates), *due).update(
+        {"attempted_at": now, "claim_token": token}, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        return []
+    rows = db.query(inv.server_id, models.Server.ip_address).join(
+        models.Server, models.Server.id == inv.server_id).filter(inv.claim_token == token).all()
+    return [(server_id, ip_address, token) for server_id, ip_address in rows]
+
+
+def store_facts(db: Session, server_id: int, token: str, facts: dict = None, error: str = None,
+                now: datetime = None) -> Optional[int]:
+    """Record a collection; returns the number of changed fields, or None if the claim was lost"""
+    now = now or datetime.utcnow()
+    entry = db.query(models.ServerInventory).filter_by(server_id=server_id, claim_token=token).first()
+    if entry is None:
+        return None
+    changed = 0
+    if error is not None:
+        entry.error = error
+    else:
+        if entry.facts is not None:
+            changes = diff(json.loads(entry.facts), facts)
+            db.add_all([models.InventoryChange(
+                server_id=server_id, field=field, old_value=json.dumps(old), new_value=json.dumps(new),
+                changed_at=now) for field, old, new in changes])
+            changed = len(changes)
+        entry.facts = json.dumps(facts, sort_keys=True)
+        entry.fetched_at = now
+        entry.error = None
+    entry.claim_token = None
+    db.commit()
+    return changed
+
+
+def refresh_entry(server_id: int, host: str, token: str, collector=collect) -> Optional[int]:
+    db = session_for_server(server_id)
+    try:
+        try:
+            facts, error = collector(host), None
+        except CollectionError as e:
+            facts, error = None, str(e)
+        return store_facts(db, server_id, token, facts, error)
+    except Exception:
+        logger.exception("Inventory refresh failed for server %s", server_id)
+        db.rollback()
+    finally:
+        db.close()
+
+
+class InventoryRefresher:
+    """Claims due entries whenever a collection slot is free and collects them on a thread pool"""
+
+    def __init__(self, max_workers: int = CONCURRENCY, poll_seconds: float = POLL_SECONDS, collector=collect):
+        self.max_workers = max_workers
+        self.poll_seconds = poll_seconds
+        self.collector = collector
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inventory")
+        self._in_flight = 0
+        self._forced = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="inventory-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def request(self, server_ids: List[int]):
+        """Collect these servers next, whatever their age"""
+        with self._lock:
+            self._forced.update(server_ids)
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Inventory refresher tick failed")
+            self._wake.wait(self.poll_seconds)
+
+    def tick(self) -> int:
+        """Fill the free collection slots, forced requests first; returns how many were started"""
+        with self._lock:
+            free = self.max_workers - self._in_flight
+            forced, self._forced = self._forced, set()
+        if free <= 0:
+            with self._lock:
+                self._forced |= forced
+            return 0
+        claimed = []
+        # Forced requests first, from every database, then entries that are merely due
+        for options in ([{"server_ids": sorted(forced), "force": True}] if forced else []) + [{}]:
+            for factory in sessions.values():
+                if len(claimed) >= free:
+                    break
+                db = factory()
+                try:
+                    claimed += claim_entries(db, free - len(claimed), **options)
+                finally:
+                    db.close()
+        # Requests that did not get a slot, or whose entry is still being collected, wait for the next tick
+        waiting = forced - {server_id for server_id, _, _ in claimed}
+        if waiting:
+            waiting = self._collectable(waiting)
+            with self._lock:
+                self._forced |= waiting
+        for server_id, host, token in claimed:
+            with self._lock:
+                self._in_flight += 1
+            self._executor.submit(refresh_entry, server_id, host, token, self.collector).add_done_callback(self._done)
+        return len(claimed)
+
+    @staticmethod
+    def _collectable(server_ids: set) -> set:
+        """The ids that name a server some database can collect; the others would wait forever"""
+        found = set()
+        for factory in sessions.values():
+            db = factory()
+            try:
+                found.update(server_id for (server_id,) in db.query(models.Server.id).filter(
+                    models.Server.id.in_(server_ids), _collectable()))
+            finally:
+                db.close()
+        return found
+
+    def _done(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        # A slot is free: claim the next due entry now rather than at the next poll
+        self._wake.set()
+
+
+refresher = InventoryRefresher()
+
+
+def _entry(row, now: datetime) -> dict:
+    server_id, name, environment, facts, fetched_at, attempted_at, token, error = row
+    age = (now - fetched_at).total_seconds() if fetched_at else None
+    return {
+        "server_id": server_id,
+        "name": name,
+        "environment": environment,
+        "facts": json.loads(facts) if facts else None,
+        "fetched_at": fetched_at,
+        "age_seconds": int(age) if age is not None else None,
+        "stale": age is None or age > TTL_HOURS * 3600,
+        "refreshing": token is not None,
+        "last_attempt_at": attempted_at,
+        "error": error,
+    }
+
+
+def _entries_query(db: Session):
+    inv = models.ServerInventory
+    return db.query(models.Server.id, models.Server.name, models.Server.environment, inv.facts, inv.fetched_at,
+                    inv.attempted_at, inv.claim_token, inv.error).outerjoin(inv, inv.server_id == models.Server.id)
+
+
+router = APIRouter()
+
+@router.get("/inventory", response_model=schemas.InventoryPage)
+def list_inventory(
+    environment: Optional[str] = None,
+    stale: Optional[bool] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    # Served from the cache only; `stale=true` lists what the refresher has yet to catch up on
+    now = datetime.utcnow()
+    inv = models.ServerInventory
+    query = _entries_query(db)
+    if environment:
+        query = query.filter(models.Server.environment == environment)
+    if stale is not None:
+        fresh = inv.fetched_at >= now - timedelta(hours=TTL_HOURS)
+        query = query.filter(or_(inv.fetched_at.is_(None), ~fresh) if stale else fresh)
+    total = query.count()
+    rows = query.order_by(models.Server.id).limit(limit).offset(offset).all()
+    return {"ttl_seconds": int(TTL_HOURS * 3600), "total": total, "offset": offset,
+            "items": [_entry(row, now) for row in rows]}
+
+@router.get("/servers/{server_id}/inventory", response_model=schemas.ServerInventory)
+def get_server_inventory(
+    server_id: int,
+    changes: int = Query(50, ge=0, le=500),
+    db: Session = Depends(get_db),
+):
+    row = _entries_query(db).filter(models.Server.id == server_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Server not found")
+    history = db.query(models.InventoryChange).filter_by(server_id=server_id).order_by(
+        models.InventoryChange.id.desc()).limit(changes).all() if changes else []
+    return {**_entry(row, datetime.utcnow()), "changes": [
+        {"field": change.field, "old_value": json.loads(change.old_value), "new_value": json.loads(change.new_value),
+         "changed_at": change.changed_at} for change in history]}
+
+@router.post("/inventory/refresh", status_code=202)
+def refresh_inventory(request: schemas.InventoryRefreshRequest):
+    # Collected in the background, ahead of entries that are merely due
+    if not refresher.running:
+        raise HTTPException(status_code=503, detail="Inventory refresh is disabled (INVENTORY_REFRESH_ENABLED=0)")
+    refresher.request(request.server_ids)
+    return {"requested": len(request.server_ids)}
@@ -0,0 +1,460 @@
+"""
+Durable check queue.
+
+Checks are stored as rows in `check_jobs` instead of living in one process's
+BackgroundTasks. Workers (threads in the API process or separate `worker.py`
+processes) claim jobs by taking a lease with a single UPDATE, keep the lease
+alive with heartbeats while the check runs, and release it when they finish.
+A job whose lease expires (worker crashed or was killed) goes back to the
+queue until it runs out of attempts.
+
+`POST /jobs/{id}/cancel` cancels a queued job outright. For a running job it
+sets `cancel_requested`; the worker's heartbeat thread polls that flag every
+CANCEL_POLL_SECONDS and signals the check, which kills its script.
+
+A handler may instead return a Future (simulated checks do, see checks.py).
+The worker thread then goes back to claiming, and one tender thread per
+worker heartbeats, polls cancel flags for and finishes all such jobs, up to
+JOB_MAX_ASYNC_CHECKS of them at a time.
+"""
+
+import os
+import socket
+import threading
+import time
+import logging
+import uuid
+from concurrent.futures import Future, wait
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from . import models, read_models, schemas
+from .database import SessionLocal, get_db
+from .checks import run_powershell_check, timeout_stats
+from .transitions import complete_check, StatusConflict
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF_SECONDS = 5
+CANCEL_POLL_SECONDS = float(os.getenv("JOB_CANCEL_POLL_SECONDS", "2"))
+# Jobs a worker keeps in flight on Futures (simulated checks) besides its threads' own
+MAX_ASYNC_CHECKS = int(os.getenv("JOB_MAX_ASYNC_CHECKS", "1000"))
+ACTIVE_STATUSES = ("queued", "running")
+
+
+def find_active_job(db: Session, server_id: int, check_type: str) -> Optional[models.CheckJob]:
+    return db.query(models.CheckJob).filter(
+        models.CheckJob.server_id == server_id,
+        models.CheckJob.check_type == check_type,
+        models.CheckJob.status.in_(ACTIVE_STATUSES),
+    ).first()
+
+
+def enqueue_check(db: Session, server_id: int, check_type: str) -> models.CheckJob:
+    """Queue a check, reusing the server's pending job of the same type if there is one"""
+    job = find_active_job(db, server_id, check_type)
+    if job:
+        return job
+    now = datetime.utcnow()
+    job = models.CheckJob(
+        server_id=server_id,
+        check_type=check_type,
+        status="queued",
+        max_attempts=MAX_ATTEMPTS,
+        available_at=now,
+        created_at=now,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def claim_jobs(db: Session, worker_id: str, limit: int = 1, lease_seconds: int = LEASE_SECONDS) -> List[models.CheckJob]:
+    """Lease up to `limit` queued jobs for this worker.
+
+    The claim is one UPDATE ... WHERE id IN (SELECT ...) statement, which SQLite
+    runs under its write lock, so two workers can never lease the same row.
+    """
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    candidates = db.query(models.CheckJob.id).filter(
+        models.CheckJob.status == "queued",
+        models.CheckJob.available_at <= now,
+    ).order_by(models.CheckJob.id).limit(limit).scalar_subquery()
+    claimed = db.query(models.CheckJob).filter(
+        models.CheckJob.id.in_(candidates),
+        models.CheckJob.status == "queued",
+    ).update({
+        "status": "running",
+        "lease_owner": worker_id,
+        "lease_token": token,
+        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+        "heartbeat_at": now,
+        "started_at": now,
+        "attempts": models.CheckJob.attempts + 1,
+    }, synchronize_session=False)
+    db.commit()
+    if not claimed:
+        return []
+    return db.query(models.CheckJob).filter_by(lease_token=token).all()
+
+
+def heartbeat(db: Session, job: models.CheckJob, lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Extend the lease; False means the lease was lost and the job belongs to someone else now"""
+    now = datetime.utcnow()
+    extended = db.query(models.CheckJob).filter_by(
+        id=job.id, lease_token=job.lease_token, status="running"
+    ).update({
+        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+        "heartbeat_at": now,
+    }, synchronize_session=False)
+    db.commit()
+    return extended == 1
+
+
+def cancel_requested(db: Session, job_id: int) -> bool:
+    return bool(db.query(models.CheckJob.cancel_requested).filter_by(id=job_id).scalar())
+
+
+def heartbeat_many(db: Session, jobs: List[models.CheckJob], lease_seconds: int = LEASE_SECONDS) -> List[int]:
+    """`heartbeat` for several jobs in one transaction; returns the ids whose lease was lost"""
+    now = datetime.utcnow()
+    lost = [job.id for job in jobs if db.query(models.CheckJob).filter_by(
+        id=job.id, lease_token=job.lease_token, status="running"
+    ).update({
+        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+        "heartbeat_at": now,
+    }, synchronize_session=False) != 1]
+    db.commit()
+    return lost
+
+
+def finish_job(db: Session, job: models.CheckJob, result: Optional[str] = None, error: Optional[str] = None,
+               cancelled: bool = False) -> bool:
+    """Release the lease with the job's outcome. Failed attempts are retried until max_attempts."""
+    now = datetime.utcnow()
+    if cancelled:
+        values = {"status": "cancelled", "result": result, "error": error, "finished_at": now}
+    elif error is None:
+        values = {"status": "succeeded", "result": result, "finished_at": now}
+    elif job.attempts < job.max_attempts:
+        values = {"status": "queued", "error": error,
+                  "available_at": now + timedelta(seconds=RETRY_BACKOFF_SECONDS * job.attempts)}
+    else:
+        values = {"status": "failed", "error": error, "finished_at": now}
+    values.update({"lease_owner": None, "lease_expires_at": None})
+    released = db.query(models.CheckJob).filter_by(
+        id=job.id, lease_token=job.lease_token, status="running"
+    ).update(values, synchronize_session=False)
+    db.commit()
+    if released == 1 and values["status"] == "failed":
+        # Out of attempts, so nobody will finish the check; fail it rather than leave it Running
+        try:
+            complete_check(db, job.server_id, job.check_type, "Failed",
+                           f"Check failed after {job.attempts} attempts: {error}")
+        except StatusConflict:
+            logger.warning("Could not mark failed %s on server %s as failed", job.check_type, job.server_id)
+    return released == 1
+
+
+def requeue_expired(db: Session, now: datetime = None) -> int:
+    """Return jobs whose worker stopped heartbeating to the queue (or fail them when out of attempts)"""
+    now = now or datetime.utcnow()
+    expired = db.query(models.CheckJob).filter(
+        models.CheckJob.status == "running",
+        models.CheckJob.lease_expires_at < now,
+    ).all()
+    abandoned = []
+    for job in expired:
+        if job.cancel_requested:
+            job.status = "cancelled"
+            job.finished_at = now
+            abandoned.append((job.server_id, job.check_type, "Cancelled", "Cancelled by operator"))
+        elif job.attempts < job.max_attempts:
+            job.status = "queued"
+            job.available_at = now
+        else:
+            job.status = "failed"
+            job.finished_at = now
+            job.error = f"Lease expired after {job.attempts} attempts"
+            abandoned.append((job.server_id, job.check_type, "Failed", job.error))
+        job.lease_owner = None
+        job.lease_token = None
+        job.lease_expires_at = None
+    db.commit()
+    # Nobody will finish these checks, so fail them rather than leave them Running
+    for server_id, check_type, result, message in abandoned:
+        try:
+            complete_check(db, server_id, check_type, result, message)
+        except StatusConflict:
+            logger.warning("Could not mark abandoned %s on server %s as %s", check_type, server_id, result.lower())
+    return len(expired)
+
+
+def recover_stuck_statuses(db: Session) -> int:
+    """Queue a fresh check for current statuses left at 'Running' with no job behind them"""
+    stuck = db.query(models.CurrentStatus).filter(
+        or_(models.CurrentStatus.precheck_status == 'Running', models.CurrentStatus.postcheck_status == 'Running'),
+    ).all()
+    queued = 0
+    for status in stuck:
+        check_type = 'precheck' if status.precheck_status == 'Running' else 'postcheck'
+        if not find_active_job(db, status.server_id, check_type):
+            enqueue_check(db, status.server_id, check_type)
+            queued += 1
+    return queued
+
+
+def execute_check_job(db: Session, job: models.CheckJob, cancel: threading.Event = None):
+    """Default job handler: run the check and report the resulting check status (or a Future of it)"""
+    queue_ms = None
+    if job.started_at and job.available_at:
+        queue_ms = max(0, int((job.started_at - job.available_at).total_seconds() * 1000))
+    outcome = run_powershell_check(db, job.server_id, job.check_type, cancel=cancel, job_id=job.id,
+                                   queue_ms=queue_ms)
+    if isinstance(outcome, Future):
+        return outcome
+    db.expire_all()
+    status = db.get(models.CurrentStatus, job.server_id)
+    if status is None:
+        return None
+    return status.precheck_status if job.check_type == 'precheck' else status.postcheck_status
+
+
+class Worker:
+    """Pulls jobs from the queue of one database with `concurrency` threads until stopped"""
+
+    def __init__(self, worker_id: str = None, concurrency: int = 1, poll_seconds: float = 1.0,
+                 lease_seconds: int = LEASE_SECONDS, handler=execute_check_job, session_factory=SessionLocal,
+                 max_async: int = MAX_ASYNC_CHECKS):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.handler = handler
+        self.session_factory = session_factory
+        self.max_async = max_async
+        self.processed = 0
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        # Jobs running on a Future: {job id: (job, cancel event, future)}, looked after by the tender
+        self._async = {}
+        self._tender = None
+        self._tender_stop = threading.Event()
+        self._tender_wake = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        self._tender_stop.clear()
+        self._tender = threading.Thread(target=self._tend, name="job-tender", daemon=True)
+        self._tender.start()
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop_claiming(self):
+        self._stop.set()
+
+    def stop(self, timeout: float = 30, deadline: Optional[float] = None):
+        """Stop claiming new jobs and wait up to `timeout` (or until the monotonic `deadline`) for in-flight ones"""
+        self._stop.set()
+        if deadline is None:
+            deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        with self._lock:
+            futures = [future for _, _, future in self._async.values()]
+        wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        # Finishes the jobs that are done; leases of the rest expire and they are queued again
+        self._tender_stop.set()
+        self._tender_wake.set()
+        if self._tender is not None:
+            self._tender.join()
+            self._tender = None
+
+    def run_forever(self):
+        self.start()
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                for thread in self._threads:
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def _loop(self):
+        next_recovery = datetime.utcnow()
+        while not self._stop.is_set():
+            if len(self._async) >= self.max_async:
+                self._stop.wait(self.poll_seconds)
+                continue
+            db = self.session_factory()
+            try:
+                if datetime.utcnow() >= next_recovery:
+                    requeue_expired(db)
+                    next_recovery = datetime.utcnow() + timedelta(seconds=self.lease_seconds / 2)
+                jobs = claim_jobs(db, self.worker_id, limit=1, lease_seconds=self.lease_seconds)
+            except Exception:
+                logger.exception("Worker %s failed to claim jobs", self.worker_id)
+                jobs = []
+            finally:
+                db.close()
+            if not jobs:
+                self._stop.wait(self.poll_seconds)
+                continue
+            for job in jobs:
+                self._process(job)
+
+    def _process(self, job: models.CheckJob):
+        done = threading.Event()
+        cancel = threading.Event()
+
+        def keep_alive():
+            # Wakes often enough to notice a cancel request, heartbeats every lease/3
+            next_beat = time.monotonic() + self.lease_seconds / 3
+            while not done.wait(min(CANCEL_POLL_SECONDS, self.lease_seconds / 3)):
+                hb_db = self.session_factory()
+                try:
+                    if not cancel.is_set() and cancel_requested(hb_db, job.id):
+                        cancel.set()
+                    if time.monotonic() < next_beat:
+                        continue
+                    next_beat = time.monotonic() + self.lease_seconds / 3
+                    if not heartbeat(hb_db, job, self.lease_seconds):
+                        logger.warning("Worker %s lost the lease on job %s", self.worker_id, job.id)
+                        return
+                except Exception:
+                    logger.exception("Heartbeat failed for job %s", job.id)
+                finally:
+                    hb_db.close()
+
+        pulse = threading.Thread(target=keep_alive, name=f"job-{job.id}-heartbeat", daemon=True)
+        pulse.start()
+        db = self.session_factory()
+        try:
+            result, error = self.handler(db, job, cancel), None
+        except Exception as e:
+            logger.exception("Job %s failed", job.id)
+            db.rollback()
+            result, error = None, str(e) or e.__class__.__name__
+        finally:
+            done.set()
+            pulse.join()
+        if isinstance(result, Future):
+            # The check goes on without this thread; the tender finishes the job
+            db.close()
+            with self._lock:
+                self._async[job.id] = (job, cancel, result)
+            result.add_done_callback(lambda _: self._tender_wake.set())
+            return
+        try:
+            finish_job(db, job, result=result, error=error, cancelled=cancel.is_set())
+        finally:
+            db.close()
+        with self._lock:
+            self.processed += 1
+
+    def _tend(self):
+        """Heartbeat, pass on cancel requests for and finish the jobs running on Futures"""
+        next_beat = time.monotonic() + self.lease_seconds / 3
+        while True:
+            stopping = self._tender_stop.is_set()
+            self._tender_wake.clear()
+            with self._lock:
+                running = dict(self._async)
+            if running:
+                db = self.session_factory()
+                try:
+                    for job_id, (job, cancel, future) in running.items():
+                        if not future.done():
+                            continue
+                        error = future.exception()
+                        if error is not None:
+                            logger.error("Job %s failed", job_id, exc_info=error)
+                        finish_job(db, job, result=None if error else future.result(),
+                                   error=(str(error) or error.__class__.__name__) if error else None,
+                                   cancelled=cancel.is_set())
+                        with self._lock:
+                            del self._async[job_id]
+                            self.processed += 1
+                    waiting = {job_id: entry for job_id, entry in running.items() if not entry[2].done()}
+                    if waiting:
+                        flagged = db.query(models.CheckJob.id).filter(
+                            models.CheckJob.id.in_(list(waiting)), models.CheckJob.cancel_requested == True)
+                        for (job_id,) in flagged:
+                            waiting[job_id][1].set()
+                        db.rollback()
+                        if time.monotonic() >= next_beat:
+                            next_beat = time.monotonic() + self.lease_seconds / 3
+                            for job_id in heartbeat_many(db, [job for job, _, _ in waiting.values()],
+                                                         self.lease_seconds):
+                                logger.warning("Worker %s lost the lease on job %s", self.worker_id, job_id)
+                except Exception:
+                    logger.exception("Worker %s failed to tend its jobs", self.worker_id)
+                finally:
+                    db.close()
+            if stopping:
+                return
+            self._tender_wake.wait(min(CANCEL_POLL_SECONDS, self.lease_seconds / 3))
+
+
+router = APIRouter()
+
+@router.get("/jobs", response_model=List[schemas.CheckJob])
+def list_jobs(status: Optional[str] = None, server_id: Optional[int] = None, limit: int = 50, db: Session = Depends(get_db)):
+    query = db.query(*read_models.columns(models.CheckJob, schemas.CheckJob))
+    if status:
+        query = query.filter_by(status=status)
+    if server_id:
+        query = query.filter_by(server_id=server_id)
+    return query.order_by(models.CheckJob.id.desc()).limit(limit).all()
+
+@router.get("/jobs/{job_id}", response_model=schemas.CheckJob)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(models.CheckJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/jobs/{job_id}/cancel", response_model=schemas.CheckJob)
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(models.CheckJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    now = datetime.utcnow()
+    # Conditional updates: the job may be claimed or finish between the read and the write
+    cancelled = db.query(models.CheckJob).filter_by(id=job_id, status="queued").update(
+        {"status": "cancelled", "finished_at": now, "error": "Cancelled by operator"}, synchronize_session=False)
+    if cancelled:
+        db.commit()
+        complete_check(db, job.server_id, job.check_type, 'Cancelled', 'Cancelled by operator')
+    elif not db.query(models.CheckJob).filter_by(id=job_id, status="running").update(
+            {"cancel_requested": True}, synchronize_session=False):
+        db.rollback()
+        raise HTTPException(status_code=409, detail=f"Job {job_id} has already finished")
+    db.commit()
+    db.refresh(job)
+    return job
+
+@router.get("/jobs/{job_id}/runs", response_model=List[schemas.CheckRun])
+def list_job_runs(job_id: int, db: Session = Depends(get_db)):
+    return db.query(*read_models.columns(models.CheckRun, schemas.CheckRun)).filter_by(job_id=job_id).order_by(models.CheckRun.id).all()
+
+@router.get("/check-timeouts")
+def list_check_timeouts(db: Session = Depends(get_db)):
+    # Current adaptive timeout for every environment/OS/check type that has run history
+    run = models.CheckRun
+    groups = db.query(run.environment, run.os, run.check_type).distinct().order_by(
+        run.environment, run.os, run.check_type).all()
+    return [{"environment": environment, "os": os_name, "check_type": check_type,
+             **timeout_stats(db, check_type, environment, os_name)}
+            for environment, os_name, check_type in groups]
@@ -1,8 +1,43 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
+import os
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+from sqlalchemy import text, inspect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from .api import router as api_router
+from .scheduler import router as scheduler_router, scheduler, recover_interrupted_runs
+from .jobs import router as jobs_router, Worker, requeue_expired, recover_stuck_statuses
+from .consistency import router as consistency_router, repair_drift
+from .metrics import router as metrics_router, backfill_latest_metrics
+from .analytics import router as analytics_router
+from .reports import router as reports_router, recover_interrupted_exports, ensure_server_stamps
+from .waves import router as waves_router, wave_runner, recover_interrupted_waves
+from .search import router as search_router, ensure_search_index
+from .tags import router as tags_router, ensure_tag_index
+from .dashboard import router as dashboard_router
+from .server_detail import router as server_detail_router
+from .history import router as history_router, backfill_valid_from, ensure_status_intervals
+from .probes import router as probes_router
+from .simulator import router as simulator_router
+from .inventory import router as inventory_router, refresher as inventory_refresher
+from .outbox import router as outbox_router, relay as outbox_relay, ensure_outbox_triggers
+from .heartbeats import router as heartbeats_router, writer as heartbeat_writer
+from .alert_rules import router as alert_rules_router
+from .shards import router as shards_router
+from .database import engines, sessions, Base, add_missing_columns
+
+# Seconds to wait for in-flight checks when the process is asked to stop
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", "30"))
+# Responses smaller than this are sent uncompressed, as gzip would barely shrink them
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
 
 app = FastAPI()
+app.state.ready = False
+app.state.startup_seconds = None
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,5 +50,122 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Clients that send Accept-Encoding: gzip get compressed responses, streamed ones included
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=GZIP_LEVEL)
+
+# Routes are matched in order, and agents post heartbeats far more often than anything else is requested
+app.include_router(heartbeats_router, prefix="/api")
+app.include_router(api_router, prefix="/api")
+app.include_router(scheduler_router, prefix="/api")
+app.include_router(jobs_router, prefix="/api")
+app.include_router(consistency_router, prefix="/api")
+app.include_router(metrics_router, prefix="/api")
+app.include_router(analytics_router, prefix="/api")
+app.include_router(reports_router, prefix="/api")
+app.include_router(waves_router, prefix="/api")
+app.include_router(search_router, prefix="/api")
+app.include_router(tags_router, prefix="/api")
+app.include_router(dashboard_router, prefix="/api")
+app.include_router(server_detail_router, prefix="/api")
+app.include_router(history_router, prefix="/api")
+app.include_router(probes_router, prefix="/api")
+app.include_router(simulator_router, prefix="/api")
+app.include_router(inventory_router, prefix="/api")
+app.include_router(outbox_router, prefix="/api")
+app.include_router(alert_rules_router, prefix="/api")
+app.include_router(shards_router, prefix="/api")
+
+# Checks queued through the API are run by these in-process workers, one per
+# database; set JOB_WORKERS=0 when they are handled by separate `python worker.py` processes
+workers = [Worker(concurrency=int(os.getenv("JOB_WORKERS", "4")), session_factory=factory)
+           for factory in sessions.values()]
+
+def prepare_database():
+    """One-off work that must happen before serving, on every database: schema and crash recovery"""
+    for path, engine in engines.items():
+        prepare_shard(engine, sessions[path])
+
+def prepare_shard(engine, session_factory):
+    # Create tables added since the database file was first initialized
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(Base.metadata, engine)
+    db = session_factory()
+    try:
+        # Backfills the current-status read model and fixes any drift from the history,
+        # which must happen before the one-current-row unique index can be created.
+        # The repair closes intervals, so rows from before they existed need a start first
+        backfill_valid_from(engine)
+        repair_drift(db)
+        # create_all skips the indexes of tables that already exist
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+        ensure_search_index(engine)
+        ensure_tag_index(engine)
+        ensure_status_intervals(engine)
+        ensure_outbox_triggers(engine)
+        ensure_server_stamps(engine)
+        backfill_latest_metrics(db)
+        # Pick up checks that were in flight when the previous process died
+        requeue_expired(db)
+        recover_stuck_statuses(db)
+        recover_interrupted_runs(db)
+        recover_interrupted_exports(db)
+        recover_interrupted_waves(db)
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def startup():
+    # start.py --prod prepares the database once in the supervisor instead of in every worker
+    if os.getenv("INFRA_NOVA_SCHEMA_READY") != "1":
+        prepare_database()
+    for worker in workers:
+        if worker.concurrency > 0:
+            worker.start()
+    if os.getenv("SCHEDULER_ENABLED", "1") == "1":
+        scheduler.start()
+    wave_runner.start()
+    heartbeat_writer.start()
+    if os.getenv("INVENTORY_REFRESH_ENABLED", "1") == "1":
+        inventory_refresher.start()
+    if os.getenv("OUTBOX_RELAY_ENABLED", "1") == "1":
+        outbox_relay.start()
+    app.state.startup_seconds = round(time.perf_counter() - IMPORT_STARTED, 3)
+    app.state.ready = True
+
+@app.on_event("shutdown")
+def shutdown():
+    # Fail readiness first so the load balancer stops sending traffic, then drain
+    app.state.ready = False
+    scheduler.stop()
+    wave_runner.stop()
+    inventory_refresher.stop()
+    # Flushes the heartbeats still buffered
+    heartbeat_writer.stop()
+    outbox_relay.stop()
+    # One drain window shared by every worker, not one each
+    deadline = time.monotonic() + DRAIN_SECONDS
+    for worker in workers:
+        worker.stop_claiming()
+    for worker in workers:
+        worker.stop(deadline=deadline)
+
+@app.get("/healthz")
+def liveness():
+    return {"status": "alive", "pid": os.getpid()}
 
-app.include_router(api_router, prefix="/api") 
\ No newline at end of file
+@app.get("/readyz")
+def readiness():
+    if not app.state.ready:
+        return JSONResponse(status_code=503, content={"status": "not ready"})
+    for engine in engines.values():
+        try:
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+                missing = {"servers", "server_status", "check_jobs"} - set(inspect(conn).get_table_names())
+        except Exception as e:
+            return JSONResponse(status_code=503, content={"status": "database unavailable", "error": str(e)})
+        if missing:
+            return JSONResponse(status_code=503, content={"status": "schema missing", "tables": sorted(missing)})
+    return {"status": "ready", "pid": os.getpid(), "startup_seconds": app.state.startup_seconds}
@@ -0,0 +1,131 @@
+"""
+Numeric check metrics.
+
+check_server.ps1 reports memory usage, uptime and per-drive disk usage.
+Instead of flattening those into issue_summary, every check appends them to
+`check_metrics` as (server_id, metric, ts, value) samples. Range queries are
+downsampled in SQL into fixed-width buckets with min/max/avg, so even a
+90-day series comes back as a few hundred points.
+"""
+
+import calendar
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import get_db
+
+MAX_POINTS = 1000
+
+
+def to_epoch(value: datetime) -> int:
+    # Naive datetimes are UTC throughout the backend
+    return calendar.timegm(value.utctimetuple())
+
+
+def from_epoch(value: int) -> datetime:
+    return datetime.utcfromtimestamp(value)
+
+
+def extract_metrics(check_result: dict) -> Dict[str, float]:
+    """Pull the numeric readings out of a check_server.ps1 (or probe) result"""
+    details = check_result.get('Details') or {}
+    metrics = {}
+    if isinstance(details.get('MemoryUsagePercent'), (int, float)):
+        metrics['memory.used_pct'] = float(details['MemoryUsagePercent'])
+    if isinstance(details.get('UptimeDays'), (int, float)):
+        metrics['uptime.days'] = float(details['UptimeDays'])
+    # Network probes of Linux servers (probes.py)
+    if isinstance(details.get('LatencyMs'), (int, float)):
+        metrics['net.latency_ms'] = float(details['LatencyMs'])
+    disks = details.get('Disks') or []
+    # ConvertTo-Json emits a single drive as an object rather than a list
+    if isinstance(disks, dict):
+        disks = [disks]
+    for disk in disks:
+        drive = re.sub(r'[^A-Za-z0-9]', '', str(disk.get('Drive', '')))
+        if drive and isinstance(disk.get('UsagePercent'), (int, float)):
+            metrics[f'disk.{drive}.used_pct'] = float(disk['UsagePercent'])
+    return metrics
+
+
+def record_metrics(db: Session, server_id: int, metrics: Dict[str, float], ts: Optional[datetime] = None):
+    """Append one sample per metric and refresh latest_metrics (caller commits)"""
+    if not metrics:
+        return
+    epoch = to_epoch(ts or datetime.utcnow())
+    rows = [{"server_id": server_id, "metric": name, "ts": epoch, "value": value} for name, value in metrics.items()]
+    db.execute(models.CheckMetric.__table__.insert().prefix_with("OR IGNORE"), rows)
+    latest = insert(models.LatestMetric)
+    db.execute(
+        latest.on_conflict_do_update(
+            index_elements=["server_id", "metric"],
+            set_={"ts": latest.excluded.ts, "value": latest.excluded.value},
+            where=latest.excluded.ts >= models.LatestMetric.ts,
+        ),
+        rows,
+    )
+
+
+def backfill_latest_metrics(db: Session):
+    """Fill latest_metrics from the history when it is empty (databases from before it existed)"""
+    if db.query(models.LatestMetric.server_id).first() or not db.query(models.CheckMetric.server_id).first():
+        return
+    # SQLite returns the bare `value` column from the row that holds max(ts)
+    db.execute(text(
+        "INSERT INTO latest_metrics (server_id, metric, ts, value) "
+        "SELECT server_id, metric, max(ts), value FROM check_metrics GROUP BY server_id, metric"
+    ))
+    db.commit()
+
+
+def downsample(db: Session, server_id: int, metric: str, start: datetime, end: datetime, points: int):
+    """Bucket the samples in [start, end) into at most `points` buckets with min/max/avg"""
+    start_ts, end_ts = to_epoch(start), to_epoch(end)
+    bucket_seconds = max(1, -(-(end_ts - start_ts) // points))
+    m = models.CheckMetric
+    bucket = ((m.ts - start_ts) // bucket_seconds).label("bucket")
+    rows = db.query(
+        bucket,
+        func.min(m.value), func.max(m.value), func.avg(m.value), func.count(),
+    ).filter(
+        m.server_id == server_id, m.metric == metric, m.ts >= start_ts, m.ts < end_ts,
+    ).group_by(bucket).order_by(bucket).all()
+    return bucket_seconds, [
+        {"ts": from_epoch(start_ts + int(b) * bucket_seconds), "min": lo, "max": hi, "avg": avg, "count": n}
+        for b, lo, hi, avg, n in rows
+    ]
+
+
+router = APIRouter()
+
+@router.get("/servers/{server_id}/metrics", response_model=List[schemas.MetricSummary])
+def list_server_metrics(server_id: int, db: Session = Depends(get_db)):
+    m = models.CheckMetric
+    rows = db.query(m.metric, func.count(), func.min(m.ts), func.max(m.ts)).filter(
+        m.server_id == server_id).group_by(m.metric).order_by(m.metric).all()
+    return [{"metric": name, "samples": n, "first_ts": from_epoch(first), "last_ts": from_epoch(last)}
+            for name, n, first, last in rows]
+
+@router.get("/servers/{server_id}/metrics/{metric}", response_model=schemas.MetricSeries)
+def get_server_metric(
+    server_id: int,
+    metric: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    points: int = Query(300, ge=1, le=MAX_POINTS),
+    db: Session = Depends(get_db),
+):
+    end = from_epoch(to_epoch(end)) if end else datetime.utcnow()
+    start = from_epoch(to_epoch(start)) if start else end - timedelta(days=7)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    bucket_seconds, series = downsample(db, server_id, metric, start, end, points)
+    return {"server_id": server_id, "metric": metric, "start": start, "end": end,
+            "bucket_seconds": bucket_seconds, "points": series}
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, DateTime, Float, Index, text
 from sqlalchemy.orm import relationship
 from .database import Base
 
@@ -7,14 +7,19 @@ class Server(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     ip_address = Column(String, nullable=False)
+    # IPv4 address as an integer so CIDR/prefix searches are range scans (set in search.py)
+    ip_int = Column(Integer, index=True)
     environment = Column(String, nullable=False)
     os = Column(String)
     owner = Column(String)
     created_at = Column(DateTime)
+    # Last edit of the exported attributes, set by a trigger (see reports.py)
+    updated_at = Column(DateTime, index=True)
     statuses = relationship("ServerStatus", back_populates="server")
     tags = relationship("ServerTag", back_populates="server")
     alerts = relationship("Alert", back_populates="server")
     migrations = relationship("Migration", back_populates="server")
+    current_status = relationship("CurrentStatus", uselist=False, back_populates="server")
 
 class ServerStatus(Base):
     __tablename__ = "server_status"
@@ -26,13 +31,47 @@ class ServerStatus(Base):
     issue_summary = Column(Text)
     last_checked = Column(DateTime)
     is_current = Column(Boolean, default=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # When this row was the server's status: [valid_from, valid_to). Both are kept by
+    # triggers (history.py); the current row is open-ended at history.OPEN_END
+    valid_from = Column(DateTime)
+    valid_to = Column(DateTime, nullable=False, server_default=text("'9999-12-31 00:00:00.000000'"))
     server = relationship("Server", back_populates="statuses")
+    __table_args__ = (
+        Index("ix_server_status_server_current", "server_id", "is_current"),
+        # At most one current row per server, whatever the writers do
+        Index("ux_server_status_one_current", "server_id", unique=True, sqlite_where=text("is_current = 1")),
+        Index("ix_server_status_last_checked", "last_checked"),
+        # Per-server history, newest first (keyset pages in server_detail.py)
+        Index("ix_server_status_server_history", "server_id", "id"),
+        # Covers point-in-time counts: rows with valid_to > t, filtered on valid_from <= t
+        Index("ix_server_status_valid", "valid_to", "valid_from", "server_id",
+              "migration_status", "precheck_status", "postcheck_status"),
+    )
+
+class CurrentStatus(Base):
+    """One row per server mirroring its is_current ServerStatus row, for cheap reads"""
+    __tablename__ = "server_current_status"
+    server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
+    status_id = Column(Integer, ForeignKey("server_status.id"))
+    migration_status = Column(String, nullable=False, index=True)
+    precheck_status = Column(String)
+    postcheck_status = Column(String)
+    issue_summary = Column(Text)
+    last_checked = Column(DateTime)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    server = relationship("Server", back_populates="current_status")
+
+    @property
+    def is_current(self):
+        return True
 
 class ServerTag(Base):
     __tablename__ = "server_tags"
     server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
     tag = Column(String, primary_key=True)
     server = relationship("Server", back_populates="tags")
+    __table_args__ = (Index("ix_server_tags_tag", "tag", "server_id"),)
 
 class Alert(Base):
     __tablename__ = "alerts"
@@ -42,14 +81,232 @@ class Alert(Base):
     message = Column(Text)
     resolved = Column(Boolean, default=False)
     created_at = Column(DateTime)
+    # Set on alerts raised by the rule engine (alert_rules.py)
+    rule = Column(String)
+    metric = Column(String)
+    value = Column(Float)
+    resolved_at = Column(DateTime)
     server = relationship("Server", back_populates="alerts")
+    __table_args__ = (
+        Index("ix_alerts_server_history", "server_id", "id"),
+        # The newest-first alert list and stream read this instead of sorting
+        Index("ix_alerts_created", "created_at", "id"),
+        # One open alert per rule and series, however many processes evaluate it
+        Index("ux_alerts_open_rule", "server_id", "rule", "metric", unique=True,
+              sqlite_where=text("resolved = 0 AND rule IS NOT NULL")),
+    )
 
 class Migration(Base):
     __tablename__ = "migrations"
     id = Column(Integer, primary_key=True, index=True)
     server_id = Column(Integer, ForeignKey("servers.id"))
     started_at = Column(DateTime)
-    completed_at = Column(DateTime)
+    completed_at = Column(DateTime, index=True)
     status = Column(String)
     notes = Column(Text)
-    server = relationship("Server", back_populates="migrations") 
\ No newline at end of file
+    wave_id = Column(Integer, ForeignKey("migration_waves.id"), index=True)
+    server = relationship("Server", back_populates="migrations")
+    __table_args__ = (Index("ix_migrations_server_history", "server_id", "id"),)
+
+class CheckSchedule(Base):
+    __tablename__ = "check_schedules"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    environment = Column(String, nullable=False)
+    check_type = Column(String, nullable=False, default="precheck")
+    window_start = Column(String, nullable=False, default="01:00")  # HH:MM, UTC
+    window_minutes = Column(Integer, nullable=False, default=120)
+    max_concurrency = Column(Integer, nullable=False, default=4)
+    skip_recent_minutes = Column(Integer, nullable=False, default=720)
+    enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime)
+    last_run_at = Column(DateTime)
+    runs = relationship("ScheduleRun", back_populates="schedule")
+
+class ScheduleRun(Base):
+    __tablename__ = "schedule_runs"
+    id = Column(Integer, primary_key=True, index=True)
+    schedule_id = Column(Integer, ForeignKey("check_schedules.id"), index=True)
+    status = Column(String, nullable=False)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    servers_total = Column(Integer, default=0)
+    servers_checked = Column(Integer, default=0)
+    servers_skipped = Column(Integer, default=0)
+    servers_failed = Column(Integer, default=0)
+    schedule = relationship("CheckSchedule", back_populates="runs")
+
+class CheckJob(Base):
+    __tablename__ = "check_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    server_id = Column(Integer, ForeignKey("servers.id"), index=True)
+    check_type = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued, running, succeeded, failed, cancelled
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    available_at = Column(DateTime)
+    lease_owner = Column(String)
+    lease_token = Column(String, index=True)
+    lease_expires_at = Column(DateTime)
+    heartbeat_at = Column(DateTime)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    result = Column(String)
+    error = Column(Text)
+    # Set by POST /jobs/{id}/cancel on a running job; the worker polls it and kills the check
+    cancel_requested = Column(Boolean, nullable=False, default=False, server_default="0")
+    __table_args__ = (Index("ix_check_jobs_status_available", "status", "available_at"),)
+
+class CheckRun(Base):
+    """One execution of a check script with its wall time per phase, in milliseconds"""
+    __tablename__ = "check_runs"
+    id = Column(Integer, primary_key=True)
+    server_id = Column(Integer, ForeignKey("servers.id"), index=True)
+    job_id = Column(Integer, ForeignKey("check_jobs.id"), index=True)
+    check_type = Column(String, nullable=False)
+    # Copied from the server so timeouts can be derived per environment/OS without a join
+    environment = Column(String)
+    os = Column(String)
+    outcome = Column(String, nullable=False)  # completed, timeout, error, cancelled, simulated, simulated_timeout
+    queue_ms = Column(Integer)
+    start_ms = Column(Integer)
+    run_ms = Column(Integer)
+    write_ms = Column(Integer)
+    timeout_seconds = Column(Float)
+    finished_at = Column(DateTime)
+    __table_args__ = (Index("ix_check_runs_group", "environment", "os", "check_type", "id"),)
+
+class CheckMetric(Base):
+    """Append-only numeric samples from check results, one row per (server, metric, second)"""
+    __tablename__ = "check_metrics"
+    server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
+    metric = Column(String, primary_key=True)
+    ts = Column(Integer, primary_key=True)  # unix seconds, UTC
+    value = Column(Float, nullable=False)
+    # Clustered on the primary key so a per-server range scan reads contiguous pages
+    __table_args__ = {"sqlite_with_rowid": False}
+
+class LatestMetric(Base):
+    """Newest sample of every metric per server, kept next to check_metrics for fleet-wide reads"""
+    __tablename__ = "latest_metrics"
+    server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
+    metric = Column(String, primary_key=True)
+    ts = Column(Integer, nullable=False)
+    value = Column(Float, nullable=False)
+    # Covering index: a fleet-wide read of one metric never touches the table itself
+    __table_args__ = (Index("ix_latest_metrics_metric", "metric", "server_id", "value"), {"sqlite_with_rowid": False})
+
+class ReportExport(Base):
+    """A CSV export; finished files are stored under their SHA-256 and shared by identical requests"""
+    __tablename__ = "report_exports"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    window_start = Column(DateTime)
+    window_end = Column(DateTime)
+    cache_key = Column(String, nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued")  # queued, running, succeeded, failed
+    content_sha256 = Column(String)
+    rows = Column(Integer)
+    bytes = Column(Integer)
+    created_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    error = Column(Text)
+
+class MigrationWave(Base):
+    __tablename__ = "migration_waves"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)
+    group_by = Column(String, nullable=False)  # environment, owner or tag
+    group_value = Column(String)
+    max_parallel = Column(Integer, nullable=False, default=4)
+    status = Column(String, nullable=False, default="Planned")  # Planned, In Progress, Completed, Cancelled
+    servers_total = Column(Integer, default=0)
+    created_at = Column(DateTime)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    servers = relationship("WaveServer", back_populates="wave", order_by="WaveServer.position")
+
+class WaveServer(Base):
+    """A server's progress through its wave: Pending -> Precheck -> Migrating -> Postcheck -> Completed/Failed"""
+    __tablename__ = "wave_servers"
+    wave_id = Column(Integer, ForeignKey("migration_waves.id"), primary_key=True)
+    server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
+    position = Column(Integer, nullable=False)
+    stage = Column(String, nullable=False, default="Pending")
+    migration_id = Column(Integer, ForeignKey("migrations.id"))
+    # The check job of the current Precheck or Postcheck stage
+    job_id = Column(Integer)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    error = Column(Text)
+    wave = relationship("MigrationWave", back_populates="servers")
+    __table_args__ = (Index("ix_wave_servers_wave_stage", "wave_id", "stage"),)
+
+class TagChange(Base):
+    """Tag and server inserts/deletes, written by triggers (see tags.py); tag is NULL for a server row"""
+    __tablename__ = "tag_changes"
+    seq = Column(Integer, primary_key=True)
+    server_id = Column(Integer, nullable=False)
+    tag = Column(String)
+    op = Column(String(1), nullable=False)  # + or -
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class ServerInventory(Base):
+    """Hardware facts from get_server_info.ps1, cached per server (see inventory.py)"""
+    __tablename__ = "server_inventory"
+    server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
+    facts = Column(Text)  # JSON; NULL until the first successful collection
+    fetched_at = Column(DateTime)  # last successful collection
+    attempted_at = Column(DateTime)  # last claim, successful or not
+    claim_token = Column(String)
+    error = Column(Text)
+    __table_args__ = (Index("ix_server_inventory_fetched", "fetched_at"),)
+
+class InventoryChange(Base):
+    """One changed inventory field, as a JSON-encoded old and new value"""
+    __tablename__ = "inventory_changes"
+    id = Column(Integer, primary_key=True)
+    server_id = Column(Integer, ForeignKey("servers.id"), nullable=False)
+    field = Column(String, nullable=False)  # dotted path, e.g. Disks.C:.TotalGB
+    old_value = Column(Text)
+    new_value = Column(Text)
+    changed_at = Column(DateTime, nullable=False)
+    __table_args__ = (Index("ix_inventory_changes_server_history", "server_id", "id"),)
+
+class OutboxEvent(Base):
+    """A status, alert or migration change, appended by triggers in the writer's transaction (see outbox.py)"""
+    __tablename__ = "outbox_events"
+    id = Column(Integer, primary_key=True)  # the change-feed cursor
+    topic = Column(String, nullable=False)  # status, alert, migration
+    op = Column(String, nullable=False)  # insert, update
+    server_id = Column(Integer)
+    entity_id = Column(Integer)
+    payload = Column(Text, nullable=False)  # JSON
+    created_at = Column(DateTime, nullable=False)
+    # Ids are never reused, so a cursor never skips an event
+    __table_args__ = {"sqlite_autoincrement": True}
+
+class OutboxSink(Base):
+    """Delivery position and retry state of one configured sink"""
+    __tablename__ = "outbox_sinks"
+    name = Column(String, primary_key=True)
+    cursor = Column(Integer, nullable=False, default=0, server_default="0")  # last delivered event id
+    delivered = Column(Integer, nullable=False, default=0, server_default="0")
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")  # failures since the last delivery
+    next_attempt_at = Column(DateTime)
+    last_error = Column(Text)
+    last_delivered_at = Column(DateTime)
+    lease_owner = Column(String)
+    lease_expires_at = Column(DateTime)
+
+class ServerHeartbeat(Base):
+    """Latest heartbeat an agent pushed for its server (see heartbeats.py)"""
+    __tablename__ = "server_heartbeats"
+    server_id = Column(Integer, ForeignKey("servers.id"), primary_key=True)
+    received_at = Column(DateTime, nullable=False)
+    sent_at = Column(DateTime)  # agent clock
+    agent_version = Column(String)
+    metrics = Column(Text)  # JSON, metric names as in check_metrics
+    stale_since = Column(DateTime)  # set when heartbeats stop, cleared by the next one
+    __table_args__ = (Index("ix_server_heartbeats_received", "received_at"),)
@@ -0,0 +1,364 @@
+"""
+Transactional outbox and change feed.
+
+Downstream systems (CMDB, ticketing) learn about changes from the outbox
+rather than by polling /servers and /server-status. Triggers append a row to
+`outbox_events` for every status row, every alert insert or change, and every
+migration insert or status change, inside the writer's own transaction: an
+event exists exactly when its change committed, whichever code path (ORM,
+batch SQL, scripts) made it. This is the same approach as the history
+intervals in history.py.
+
+Event ids are the cursor. SQLite runs one write transaction at a time, so ids
+commit in order and a reader that has seen id N never sees a smaller id
+appear later. Ids are never reused, because the table uses AUTOINCREMENT.
+
+Two ways to consume:
+
+* Push: `OutboxRelay` drains the table in batches of OUTBOX_BATCH_SIZE into
+  each sink in OUTBOX_SINKS (JSON), e.g.
+
+      [{"name": "cmdb", "type": "http", "url": "http://cmdb.local/hooks/infra-nova"},
+       {"name": "archive", "type": "ndjson", "path": "/var/log/infra-nova/changes.ndjson"}]
+
+  A sink's cursor only moves past a batch once the whole batch is
+  acknowledged. A failed batch is retried with exponential backoff, and
+  nothing behind it is sent meanwhile. Every sink therefore sees events in id
+  order, and so each server's changes in the order they were made. Delivery
+  is at least once: a batch may be resent after a crash, and consumers dedupe
+  on `id`. Each sink is leased, so with several API processes only one
+  delivers it at a time. New sink types are added to SINK_TYPES.
+
+* Pull: `GET /outbox/events?after=<cursor>` pages through the feed; the
+  client keeps the returned `cursor` and resumes from it.
+
+Events are pruned after OUTBOX_RETENTION_HOURS once every sink has them. A
+pull consumer that falls further behind gets 410 rather than a silent gap.
+
+With shards, every database has its own feed, cursors and sink leases. The
+relay drains them one after the other, and a pull consumer reads one with
+`?environment=`. Ids are then only unique within a database, but a server's
+events are all in one, so consumers dedupe on (server_id, id).
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, or_, text
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import get_db, sessions
+from .history import NOW_SQL
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "500"))
+POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "1"))
+LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+RETRY_BACKOFF_SECONDS = float(os.getenv("OUTBOX_RETRY_BACKOFF_SECONDS", "2"))
+MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "300"))
+RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "168"))
+PRUNE_INTERVAL_SECONDS = 600
+# Batches one sink may take per tick before the others get their turn
+MAX_BATCHES_PER_TICK = 20
+
+
+def _append(topic: str, op: str, payload: str) -> str:
+    return ("INSERT INTO outbox_events (topic, op, server_id, entity_id, payload, created_at) "
+            f"VALUES ('{topic}', '{op}', new.server_id, new.id, {payload}, {NOW_SQL});")
+
+
+_STATUS = ("json_object('version', new.version, 'migration_status', new.migration_status, "
+           "'precheck_status', new.precheck_status, 'postcheck_status', new.postcheck_status, "
+           "'issue_summary', new.issue_summary, 'last_checked', new.last_checked)")
+_ALERT = ("json_object('severity', new.severity, 'message', new.message, "
+          "'resolved', json(CASE WHEN new.resolved THEN 'true' ELSE 'false' END), 'created_at', new.created_at)")
+_MIGRATION = ("json_object('status', new.status, 'wave_id', new.wave_id, 'started_at', new.started_at, "
+              "'completed_at', new.completed_at, 'notes', new.notes)")
+
+_DDL = [
+    # Status history is append-only, so each new row is one change
+    f"""CREATE TRIGGER IF NOT EXISTS outbox_status_ai AFTER INSERT ON server_status BEGIN
+        {_append('status', 'insert', _STATUS)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS outbox_alert_ai AFTER INSERT ON alerts BEGIN
+        {_append('alert', 'insert', _ALERT)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS outbox_alert_au AFTER UPDATE OF severity, message, resolved ON alerts
+        WHEN old.severity IS NOT new.severity OR old.message IS NOT new.message OR old.resolved IS NOT new.resolved
+    BEGIN
+        {_append('alert', 'update', _ALERT)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS outbox_migration_ai AFTER INSERT ON migrations BEGIN
+        {_append('migration', 'insert', _MIGRATION)}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS outbox_migration_au AFTER UPDATE OF status, completed_at, notes ON migrations
+        WHEN old.status IS NOT new.status OR old.completed_at IS NOT new.completed_at OR old.notes IS NOT new.notes
+    BEGIN
+        {_append('migration', 'update', _MIGRATION)}
+    END""",
+]
+
+
+def ensure_outbox_triggers(engine):
+    with engine.begin() as conn:
+        for ddl in _DDL:
+            conn.execute(text(ddl))
+
+
+def read_events(db: Session, after: int, limit: int, topics: List[str] = None) -> List[dict]:
+    """Events with id > after, oldest first"""
+    event = models.OutboxEvent
+    query = db.query(event.id, event.topic, event.op, event.server_id, event.entity_id, event.payload,
+                     event.created_at).filter(event.id > after)
+    if topics:
+        query = query.filter(event.topic.in_(topics))
+    return [{"id": row.id, "topic": row.topic, "op": row.op, "server_id": row.server_id,
+             "entity_id": row.entity_id, "created_at": row.created_at.isoformat(), "data": json.loads(row.payload)}
+            for row in query.order_by(event.id).limit(limit)]
+
+
+def retained_from(db: Session) -> int:
+    """The oldest event id still stored; everything before it was pruned"""
+    oldest = db.query(func.min(models.OutboxEvent.id)).scalar()
+    if oldest is not None:
+        return oldest
+    last = db.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'outbox_events'")).scalar()
+    return (last or 0) + 1
+
+
+class HttpSink:
+    """POSTs each batch as {"events": [...]}; any 2xx response acknowledges it"""
+    type = "http"
+
+    def __init__(self, name: str, url: str, timeout: float = 10, headers: dict = None):
+        self.name = name
+        self.url = url
+        self.timeout = timeout
+        self.headers = headers or {}
+
+    def deliver(self, events: List[dict]):
+        request = urllib.request.Request(
+            self.url, data=json.dumps({"events": events}).encode(), method="POST",
+            headers={"Content-Type": "application/json", **self.headers})
+        # Non-2xx responses raise HTTPError
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class NdjsonSink:
+    """Appends one JSON line per event; a batch is acknowledged once it is on disk"""
+    type = "ndjson"
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+
+    def deliver(self, events: List[dict]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+SINK_TYPES = {sink.type: sink for sink in (HttpSink, NdjsonSink)}
+
+
+def load_sinks(raw: Optional[str]) -> list:
+    """Build the sinks described by OUTBOX_SINKS"""
+    sinks = []
+    for config in json.loads(raw) if raw else []:
+        config = dict(config)
+        kind, name = config.pop("type", None), config.pop("name", None)
+        if kind not in SINK_TYPES:
+            raise ValueError(f"Unknown outbox sink type {kind!r}; expected one of {sorted(SINK_TYPES)}")
+        if not name or name in {sink.name for sink in sinks}:
+            raise ValueError(f"Outbox sinks need unique names, got {name!r}")
+        sinks.append(SINK_TYPES[kind](name, **config))
+    return sinks
+
+
+SINKS = load_sinks(os.getenv("OUTBOX_SINKS"))
+
+
+class OutboxRelay:
+    """Delivers outbox events to sinks in batches and prunes delivered events"""
+
+    def __init__(self, sinks: list = None, poll_seconds: float = POLL_SECONDS, batch_size: int = BATCH_SIZE):
+        self.sinks = SINKS if sinks is None else sinks
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._next_prune = datetime.utcnow()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="outbox-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            delivered = 0
+            try:
+                delivered = self.tick()
+            except Exception:
+                logger.exception("Outbox relay tick failed")
+            # Keep going without waiting while there is a backlog
+            if not delivered:
+                self._wake.wait(self.poll_seconds)
+
+    def tick(self) -> int:
+        """Deliver what each sink has pending in each database; returns how many events were delivered"""
+        delivered = 0
+        prune = datetime.utcnow() >= self._next_prune
+        for factory in sessions.values():
+            db = factory()
+            try:
+                delivered += sum(self.drain(db, sink) for sink in self.sinks)
+                if prune:
+                    self.prune(db)
+            finally:
+                db.close()
+        if prune:
+            self._next_prune = datetime.utcnow() + timedelta(seconds=PRUNE_INTERVAL_SECONDS)
+        return delivered
+
+    def _lease(self, db: Session, name: str) -> Optional[models.OutboxSink]:
+        now = datetime.utcnow()
+        sink = models.OutboxSink
+        db.execute(text("INSERT OR IGNORE INTO outbox_sinks (name) VALUES (:name)"), {"name": name})
+        leased = db.query(sink).filter(
+            sink.name == name,
+            or_(sink.lease_owner.is_(None), sink.lease_owner == self.owner, sink.lease_expires_at < now),
+            or_(sink.next_attempt_at.is_(None), sink.next_attempt_at <= now),
+        ).update({"lease_owner": self.owner, "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS)},
+                 synchronize_session=False)
+        db.commit()
+        return db.get(sink, name) if leased else None
+
+    def drain(self, db: Session, sink) -> int:
+        """Deliver one sink's pending events, batch by batch, until caught up or a batch fails"""
+        state = self._lease(db, sink.name)
+        if state is None:
+            return 0
+        cursor, attempts, delivered = state.cursor, state.attempts, 0
+        for _ in range(MAX_BATCHES_PER_TICK):
+            events = read_events(db, cursor, self.batch_size)
+            # Don't hold a read transaction open while the sink works
+            db.rollback()
+            if not events:
+                break
+            try:
+                sink.deliver(events)
+            except Exception as e:
+                self._failed(db, sink.name, attempts, e)
+                break
+            cursor = events[-1]["id"]
+            if not self._advance(db, sink.name, cursor, len(events)):
+                break
+            attempts = 0
+            delivered += len(events)
+            if len(events) < self.batch_size:
+                break
+        return delivered
+
+    def _advance(self, db: Session, name: str, cursor: int, count: int) -> bool:
+        now = datetime.utcnow()
+        sink = models.OutboxSink
+        advanced = db.query(sink).filter_by(name=name, lease_owner=self.owner).update({
+            "cursor": cursor, "delivered": sink.delivered + count, "attempts": 0, "next_attempt_at": None,
+            "last_error": None, "last_delivered_at": now, "lease_expires_at": now + timedelta(seconds=LEASE_SECONDS),
+        }, synchronize_session=False)
+        db.commit()
+        return advanced == 1
+
+    def _failed(self, db: Session, name: str, attempts: int, error: Exception):
+        delay = min(MAX_BACKOFF_SECONDS, RETRY_BACKOFF_SECONDS * 2 ** attempts)
+        logger.warning("Outbox sink %s failed (attempt %d), retrying in %gs: %s", name, attempts + 1, delay, error)
+        db.query(models.OutboxSink).filter_by(name=name, lease_owner=self.owner).update({
+            "attempts": attempts + 1, "last_error": str(error)[:500],
+            "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay),
+        }, synchronize_session=False)
+        db.commit()
+
+    def prune(self, db: Session) -> int:
+        """Delete events past retention that every configured sink has delivered"""
+        event = models.OutboxEvent
+        query = db.query(event).filter(event.created_at < datetime.utcnow() - timedelta(hours=RETENTION_HOURS))
+        if self.sinks:
+            names = [sink.name for sink in self.sinks]
+            cursors = dict(db.query(models.OutboxSink.name, models.OutboxSink.cursor)
+                           .filter(models.OutboxSink.name.in_(names)))
+            query = query.filter(event.id <= min(cursors.get(name, 0) for name in names))
+        pruned = query.delete(synchronize_session=False)
+        db.commit()
+        return pruned
+
+
+relay = OutboxRelay()
+
+
+router = APIRouter()
+
+@router.get("/outbox/events", response_model=schemas.OutboxPage)
+def list_outbox_events(
+    after: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    topic: Optional[List[str]] = Query(None),
+    db: Session = Depends(get_db),
+):
+    # Resume by passing the returned cursor as `after`
+    oldest = retained_from(db)
+    if after + 1 < oldest:
+        raise HTTPException(status_code=410, detail=f"Events after {after} were pruned; the feed resumes at "
+                                                    f"{oldest - 1}")
+    events = read_events(db, after, limit + 1, topic)
+    has_more = len(events) > limit
+    events = events[:limit]
+    return {"events": events, "cursor": events[-1]["id"] if events else after, "has_more": has_more}
+
+@router.get("/outbox/sinks", response_model=List[schemas.OutboxSinkState])
+def list_outbox_sinks(db: Session = Depends(get_db)):
+    latest = db.query(func.max(models.OutboxEvent.id)).scalar() or 0
+    states = {state.name: state for state in db.query(models.OutboxSink)}
+    result = []
+    for sink in relay.sinks:
+        state = states.get(sink.name)
+        cursor = state.cursor if state else 0
+        result.append({
+            "name": sink.name,
+            "type": sink.type,
+            "cursor": cursor,
+            "lag": max(0, latest - cursor),
+            "delivered": state.delivered if state else 0,
+            "attempts": state.attempts if state else 0,
+            "next_attempt_at": state.next_attempt_at if state else None,
+            "last_error": state.last_error if state else None,
+            "last_delivered_at": state.last_delivered_at if state else None,
+        })
+    return result
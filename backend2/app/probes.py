@@ -0,0 +1,173 @@
+"""
+Network probes for Linux servers.
+
+check_server.ps1 reads WMI, which only Windows hosts answer, so Linux servers
+are checked from here instead: a TCP connect to each of PROBE_PORTS, timing
+the handshake, and the SSH banner on PROBE_SSH_PORT. The result has the same shape
+as the PowerShell script's JSON (Status Passed/Warning/Failed, Issues,
+Details.Message), so `run_powershell_check` records it the same way.
+
+All probes run as coroutines on one event loop. A single check uses
+`run_probe_check`, and `probe_many` probes thousands of hosts at once. Each host
+gets at most PROBE_PER_HOST connections in flight and the run at most
+PROBE_CONCURRENCY in total. Every connection has PROBE_TIMEOUT_SECONDS, and
+every host has PROBE_HOST_DEADLINE_SECONDS for all of its ports, so an
+unreachable host costs one timeout, not one per port.
+
+`POST /probes` probes servers on demand and returns the results without
+recording them.
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import get_db
+
+SSH_PORT = int(os.getenv("PROBE_SSH_PORT", "22"))
+PORTS = [int(port) for port in os.getenv("PROBE_PORTS", str(SSH_PORT)).split(",") if port.strip()]
+TIMEOUT_SECONDS = float(os.getenv("PROBE_TIMEOUT_SECONDS", "3"))
+HOST_DEADLINE_SECONDS = float(os.getenv("PROBE_HOST_DEADLINE_SECONDS", "10"))
+CONCURRENCY = int(os.getenv("PROBE_CONCURRENCY", "1000"))
+PER_HOST = int(os.getenv("PROBE_PER_HOST", "2"))
+# Handshakes slower than this make the check a Warning
+SLOW_MS = float(os.getenv("PROBE_SLOW_MS", "250"))
+MAX_SERVERS = 10000
+
+LINUX_NAMES = ("linux", "ubuntu", "centos", "rhel", "red hat", "debian", "rocky", "alma", "suse", "fedora")
+
+
+def is_linux(os_name: Optional[str]) -> bool:
+    return any(name in (os_name or "").lower() for name in LINUX_NAMES)
+
+
+async def probe_port(host: str, port: int, timeout: float = TIMEOUT_SECONDS, read_banner: bool = False) -> dict:
+    """Connect to one port, optionally reading the first line the server sends"""
+    result = {"Port": port, "Open": False, "LatencyMs": None}
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except asyncio.TimeoutError:
+        result["Error"] = f"timed out after {timeout:g}s"
+        return result
+    except OSError as e:
+        result["Error"] = "connection refused" if isinstance(e, ConnectionRefusedError) else (
+            e.strerror or e.__class__.__name__)
+        return result
+    result["Open"] = True
+    result["LatencyMs"] = round((time.perf_counter() - started) * 1000, 2)
+    try:
+        if read_banner:
+            remaining = max(0.0, timeout - (time.perf_counter() - started))
+            try:
+                line = await asyncio.wait_for(reader.readline(), remaining)
+                result["Banner"] = line.decode("ascii", "replace").strip()[:200]
+            except (asyncio.TimeoutError, OSError):
+                result["Banner"] = None
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+    return result
+
+
+def summarize(host: str, check_type: str, ports: List[dict], deadline_hit: Optional[float] = None) -> dict:
+    """Turn port results into the check_server.ps1 JSON contract"""
+    issues = []
+    open_ports = [port for port in ports if port["Open"]]
+    for port in ports:
+        if not port["Open"]:
+            issues.append(f"Port {port['Port']} unreachable: {port.get('Error', 'no result')}")
+        elif "Banner" in port and not (port["Banner"] or "").startswith("SSH-"):
+            issues.append(f"Port {port['Port']} open but sent no SSH banner")
+        elif port["LatencyMs"] > SLOW_MS:
+            issues.append(f"Port {port['Port']} slow to connect: {port['LatencyMs']:.0f} ms")
+    if deadline_hit:
+        issues.append(f"Probe deadline of {deadline_hit:g}s reached")
+
+    if not open_ports:
+        status, message = "Failed", "Unable to connect to server"
+    elif issues:
+        status, message = "Warning", f"Found {len(issues)} issues"
+    else:
+        status, message = "Passed", "All checks passed"
+    details = {"Message": message, "Ports": ports}
+    if open_ports:
+        details["LatencyMs"] = min(port["LatencyMs"] for port in open_ports)
+    return {
+        "CheckType": check_type,
+        "ServerName": host,
+        "Status": status,
+        "Issues": issues,
+        "Details": details,
+        "CheckTime": datetime.utcnow().isoformat(),
+    }
+
+
+class ProbeRunner:
+    """Caps connections in flight overall and per host; create one per event loop"""
+
+    def __init__(self, concurrency: int = CONCURRENCY, per_host: int = PER_HOST,
+                 timeout: float = TIMEOUT_SECONDS, host_deadline: float = HOST_DEADLINE_SECONDS,
+                 ssh_port: int = SSH_PORT):
+        self.timeout = timeout
+        self.ssh_port = ssh_port
+        self.host_deadline = host_deadline
+        self.per_host = per_host
+        self._slots = asyncio.Semaphore(concurrency)
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+
+    async def _probe_port(self, host: str, port: int) -> dict:
+        host_slots = self._hosts.setdefault(host, asyncio.Semaphore(self.per_host))
+        async with host_slots, self._slots:
+            return await probe_port(host, port, self.timeout, read_banner=port == self.ssh_port)
+
+    async def probe(self, host: str, check_type: str = "precheck", ports: Iterable[int] = None) -> dict:
+        ports = list(ports or PORTS)
+        tasks = [asyncio.ensure_future(self._probe_port(host, port)) for port in ports]
+        done, pending = await asyncio.wait(tasks, timeout=self.host_deadline)
+        for task in pending:
+            task.cancel()
+        results = [task.result() if task in done else
+                   {"Port": port, "Open": False, "LatencyMs": None, "Error": "probe deadline reached"}
+                   for port, task in zip(ports, tasks)]
+        return summarize(host, check_type, results, deadline_hit=self.host_deadline if pending else None)
+
+
+async def probe_many(targets: Iterable[Tuple[str, str]], ports: Iterable[int] = None,
+                     runner: ProbeRunner = None) -> List[dict]:
+    """Probe (host, check_type) pairs concurrently; results come back in target order"""
+    runner = runner or ProbeRunner()
+    return await asyncio.gather(*[runner.probe(host, check_type, ports) for host, check_type in targets])
+
+
+def run_probe_check(host: str, check_type: str, deadline: float = HOST_DEADLINE_SECONDS) -> dict:
+    """Blocking entry point for the check path, which runs in worker threads"""
+    return asyncio.run(ProbeRunner(host_deadline=deadline).probe(host, check_type))
+
+
+router = APIRouter()
+
+@router.post("/probes", response_model=List[schemas.ProbeResult])
+def run_probes(request: schemas.ProbeRequest, db: Session = Depends(get_db)):
+    # Probe servers without recording a check result
+    query = db.query(models.Server.id, models.Server.ip_address)
+    if request.server_ids:
+        query = query.filter(models.Server.id.in_(request.server_ids))
+    elif request.environment:
+        query = query.filter(models.Server.environment == request.environment)
+    else:
+        raise HTTPException(status_code=400, detail="Give server_ids or an environment")
+    servers = query.order_by(models.Server.id).limit(MAX_SERVERS + 1).all()
+    if len(servers) > MAX_SERVERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SERVERS} servers per request")
+    results = asyncio.run(probe_many([(ip, "precheck") for _, ip in servers], request.ports or None))
+    return [{"server_id": server_id, "result": result} for (server_id, _), result in zip(servers, results)]
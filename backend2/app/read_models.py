@@ -0,0 +1,177 @@
+"""
+Read-only rows for list endpoints.
+
+Loading ORM instances only to serialize them once is the costly way to list
+rows. Each instance carries an instance state and a `__dict__`, the session
+holds it in its identity map until the request ends, and `/servers`
+lazy-loaded five relationships per server, one query each. The list
+endpoints instead select only the columns their response schema declares.
+SQLAlchemy returns those as `Row`s: tuples with attribute access that no
+session tracks. Pydantic reads them with `from_attributes` like any other
+object.
+
+`/servers` loads each related table with one query, groups the rows by
+server, and hangs them on a slotted `ServerRow`. Servers without related
+rows share one empty tuple instead of an empty list each.
+
+Validating the response is then the largest cost. FastAPI builds a pydantic
+model for every row and every nested row before it writes any JSON. For
+the lists that grow with the fleet, `json_list` validates and serializes
+CHUNK rows at a time, so only one chunk of models exists at once. Pydantic
+still does the validation and the serialization, so the JSON is unchanged.
+
+With `Accept: application/x-ndjson`, `ndjson` streams the rows instead, one
+object per line. The query is read with `yield_per`, and `/servers` reads its
+servers and their related rows CHUNK servers at a time, so memory stays flat
+however large the fleet is. The first line is sent before the query has
+finished. With shards, the stream reads every database, each in a read
+transaction of its own, and merges their rows in order.
+
+Rows are read-only and cannot lazy-load. Code that changes what it reads
+still loads ORM instances.
+"""
+
+import heapq
+from contextlib import ExitStack
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter
+from sqlalchemy import inspect, literal
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import DATABASE_PATH, read_snapshot, sessions
+
+CHUNK = 1000
+NONE = ()
+NDJSON = "application/x-ndjson"
+
+
+def columns(model, schema, **extra) -> list:
+    """The columns of `model` that `schema` has fields for, plus `extra` expressions by field name"""
+    table = inspect(model).columns
+    return [extra[name].label(name) if name in extra else table[name]
+            for name in schema.model_fields if name in extra or name in table]
+
+
+def _by_server(db: Session, model, schema, ids: Tuple[int, int] = None, **extra) -> Dict[int, List]:
+    """Rows of `model` grouped by server, for servers with an id in `ids` (inclusive) if given"""
+    grouped = {}
+    query = db.query(model.server_id.label("_server_id"), *columns(model, schema, **extra))
+    if ids is not None:
+        query = query.filter(model.server_id.between(*ids))
+    for row in query.order_by(*inspect(model).primary_key):
+        grouped.setdefault(row._server_id, []).append(row)
+    return grouped
+
+
+class ServerRow:
+    """A server with its related rows, shaped like schemas.Server"""
+    __slots__ = ("id", "name", "ip_address", "environment", "os", "owner", "created_at",
+                 "tags", "current_status", "statuses", "alerts", "migrations")
+
+    def __init__(self, row, tags, current_status, statuses, alerts, migrations):
+        self.id, self.name, self.ip_address, self.environment, self.os, self.owner, self.created_at = row
+        self.tags = tags
+        self.current_status = current_status
+        self.statuses = statuses
+        self.alerts = alerts
+        self.migrations = migrations
+
+
+def current_statuses(db: Session):
+    # server_current_status has no is_current column; every row in it is current
+    return db.query(*columns(models.CurrentStatus, schemas.ServerStatus, is_current=literal(True)),
+                    models.CurrentStatus.server_id.label("_server_id")).order_by(models.CurrentStatus.server_id)
+
+
+def _with_related(db: Session, rows: list, ids: Tuple[int, int] = None) -> List[ServerRow]:
+    current = {server_id: status[0] for server_id, status in _by_server(
+        db, models.CurrentStatus, schemas.ServerStatus, ids, is_current=literal(True)).items()}
+    tags = _by_server(db, models.ServerTag, schemas.ServerTag, ids)
+    statuses = _by_server(db, models.ServerStatus, schemas.ServerStatus, ids)
+    alerts = _by_server(db, models.Alert, schemas.Alert, ids)
+    migrations = _by_server(db, models.Migration, schemas.Migration, ids)
+    return [ServerRow(row, tags.get(row.id, NONE), current.get(row.id), statuses.get(row.id, NONE),
+                      alerts.get(row.id, NONE), migrations.get(row.id, NONE))
+            for row in rows]
+
+
+def _server_query(db: Session):
+    fields = [getattr(models.Server, name) for name in ServerRow.__slots__[:7]]
+    return db.query(*fields).order_by(models.Server.id)
+
+
+def servers(db: Session) -> List[ServerRow]:
+    return _with_related(db, _server_query(db).all())
+
+
+def iter_servers(db: Session, chunk: int = CHUNK) -> Iterator[ServerRow]:
+    """Every server in id order with its related rows, read `chunk` servers at a time"""
+    last = 0
+    while True:
+        rows = _server_query(db).filter(models.Server.id > last).limit(chunk).all()
+        if not rows:
+            return
+        last = rows[-1].id
+        yield from _with_related(db, rows, (rows[0].id, last))
+
+
+@lru_cache(maxsize=None)
+def _adapter(schema) -> TypeAdapter:
+    return TypeAdapter(List[schema])
+
+
+@lru_cache(maxsize=None)
+def _item_adapter(schema) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+
+def json_list(schema, rows: list, chunk: int = CHUNK) -> Response:
+    """The rows as a JSON array of `schema`, validated and serialized `chunk` rows at a time"""
+    adapter = _adapter(schema)
+    parts = [b"["]
+    for start in range(0, len(rows), chunk):
+        if start:
+            parts.append(b",")
+        parts.append(adapter.dump_json(adapter.validate_python(rows[start:start + chunk]))[1:-1])
+    parts.append(b"]")
+    # One join, so the body is copied once
+    return Response(b"".join(parts), media_type="application/json")
+
+
+def ndjson(schema, rows: Callable[[Session], Iterable], chunk: int = CHUNK,
+           databases: Sequence[str] = (DATABASE_PATH,), key: Callable = None, reverse: bool = False) -> StreamingResponse:
+    """Stream `rows(db)` as one `schema` object per line, written `chunk` lines at a time
+
+    The rows are read in one read transaction on a session of the stream's own,
+    which stays open until the last line is sent. Given several databases, each
+    is read that way and their rows, each sorted by `key`, are merged.
+    """
+    adapter = _item_adapter(schema)
+
+    def lines():
+        with ExitStack() as stack:
+            streams = []
+            for path in databases:
+                db = sessions[path]()
+                stack.callback(db.close)
+                stack.enter_context(read_snapshot(db))
+                streams.append(rows(db))
+            batch = []
+            for row in streams[0] if len(streams) == 1 else heapq.merge(*streams, key=key, reverse=reverse):
+                batch.append(adapter.dump_json(adapter.validate_python(row)))
+                if len(batch) == chunk:
+                    yield b"\n".join(batch) + b"\n"
+                    batch = []
+            if batch:
+                yield b"\n".join(batch) + b"\n"
+
+    return StreamingResponse(lines(), media_type=NDJSON)
@@ -0,0 +1,392 @@
+"""
+Reports for the Reports & Analytics page.
+
+`GET /reports/overview` computes the page's datasets (daily migration trends,
+per-environment outcomes, success rate, top issues and summary cards with the
+previous window for comparison) from `migrations` and `server_status` with
+aggregate queries over a day-aligned window. With shards, every database
+computes its share at once and the shares are added up.
+
+CSV exports run in a background thread and stream rows to disk in batches,
+hashing as they write. The finished file is stored under its SHA-256, and the
+export is looked up by a cache key made of the kind, the window and a cheap
+fingerprint of the source rows, so asking again for an unchanged window
+returns the existing file without querying the data again. Server edits
+count too: a trigger stamps `servers.updated_at` whenever an exported
+attribute changes, and every fingerprint includes the newest stamp.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse
+from sqlalchemy import func, case, distinct, or_, and_, text
+from sqlalchemy.orm import Session
+
+from . import models, read_models, schemas
+from .database import SHARDED, SessionLocal, get_db
+from .history import NOW_SQL
+from .shards import fan_out
+
+logger = logging.getLogger(__name__)
+
+REPORTS_DIR = os.getenv("REPORTS_DIR", "./reports")
+EXPORT_WORKERS = int(os.getenv("REPORT_EXPORT_WORKERS", "2"))
+BATCH_ROWS = 1000
+TOP_ISSUES = 5
+
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="report-export")
+
+
+def report_window(days: int, now: datetime = None) -> Tuple[datetime, datetime]:
+    """[start, end) covering the last `days` whole UTC days including today"""
+    today = (now or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days - 1), today + timedelta(days=1)
+
+
+def _migration_counts(db: Session, start: datetime, end: datetime) -> tuple:
+    """(completed, failed, hours of the timed completed ones, how many were timed), which add up across databases"""
+    m = models.Migration
+    hours = case((m.status == "completed", (func.julianday(m.completed_at) - func.julianday(m.started_at)) * 24))
+    return tuple(db.query(
+        func.count(case((m.status == "completed", 1))),
+        func.count(case((m.status == "failed", 1))),
+        func.total(hours),
+        func.count(hours),
+    ).filter(m.completed_at >= start, m.completed_at < end).one())
+
+
+def _migration_summary(counts: List[tuple]) -> dict:
+    completed, failed, hours, timed = (sum(column) for column in zip(*counts))
+    finished = completed + failed
+    return {
+        "total_migrations": finished,
+        "completed": completed,
+        "failed": failed,
+        "success_rate": round(100.0 * completed / finished, 1) if finished else None,
+        "avg_migration_hours": round(hours / timed, 2) if timed else None,
+    }
+
+
+def migration_trends(db: Session, start: datetime, end: datetime) -> List[dict]:
+    m = models.Migration
+    day = func.date(m.completed_at)
+    rows = db.query(
+        day,
+        func.count(case((m.status == "completed", 1))),
+        func.count(case((m.status == "failed", 1))),
+    ).filter(m.completed_at >= start, m.completed_at < end).group_by(day).all()
+    by_day = {d: (completed, failed) for d, completed, failed in rows}
+    data = []
+    for i in range((end - start).days):
+        date = start + timedelta(days=i)
+        completed, failed = by_day.get(date.strftime("%Y-%m-%d"), (0, 0))
+        data.append({"date": date.strftime("%b %d"), "completed": completed, "failed": failed,
+                     "total": completed + failed})
+    return data
+
+
+def check_outcomes(db: Session, start: datetime, end: datetime):
+    """Per environment: servers whose worst check in the window Passed/Warned/Failed, and servers Completed"""
+    ss = models.ServerStatus
+    checks = (ss.precheck_status, ss.postcheck_status)
+    worst = func.max(case(
+        (or_(*[c == "Failed" for c in checks]), 3),
+        (or_(*[c == "Warning" for c in checks]), 2),
+        (or_(*[c == "Passed" for c in checks]), 1),
+        else_=0,
+    )).label("worst")
+    completed = func.max(case((ss.migration_status == "Completed", 1), else_=0)).label("completed")
+    per_server = db.query(ss.server_id, worst, completed).filter(
+        ss.last_checked >= start, ss.last_checked < end,
+    ).group_by(ss.server_id).subquery()
+    return db.query(
+        models.Server.environment,
+        func.count(case((per_server.c.worst == 1, 1))),
+        func.count(case((per_server.c.worst == 2, 1))),
+        func.count(case((per_server.c.worst == 3, 1))),
+        func.sum(per_server.c.completed),
+    ).join(per_server, per_server.c.server_id == models.Server.id).group_by(
+        models.Server.environment).order_by(models.Server.environment).all()
+
+
+def top_issues(db: Session, start: datetime, end: datetime, limit: Optional[int] = TOP_ISSUES) -> List[dict]:
+    ss = models.ServerStatus
+    servers = func.count(distinct(ss.server_id))
+    rows = db.query(ss.issue_summary, servers).filter(
+        ss.last_checked >= start, ss.last_checked < end, ss.issue_summary != None, ss.issue_summary != "",
+    ).group_by(ss.issue_summary).order_by(servers.desc()).limit(limit).all()
+    return [{"issue": issue, "count": count} for issue, count in rows]
+
+
+def _overview_part(db: Session, start: datetime, end: datetime, days: int, issues: Optional[int]) -> dict:
+    """One database's share of the overview, in sums that add up across databases"""
+    return {
+        "current": _migration_counts(db, start, end),
+        "previous": _migration_counts(db, start - timedelta(days=days), start),
+        "trends": migration_trends(db, start, end),
+        "outcomes": check_outcomes(db, start, end),
+        "active_issues": db.query(func.count(models.Alert.id)).filter(models.Alert.resolved == False).scalar(),
+        "top_issues": top_issues(db, start, end, issues),
+    }
+
+
+def overview(db: Session, days: int) -> dict:
+    start, end = report_window(days)
+    # Every database holds its own servers' migrations, statuses and alerts. A server is in one
+    # database, so an issue's server counts add up; all of them are needed to pick the top ones
+    parts = fan_out(_overview_part, start, end, days, None) if SHARDED else [
+        _overview_part(db, start, end, days, TOP_ISSUES)]
+    environments = {}
+    for part in parts:
+        for env, *counts in part["outcomes"]:
+            environments[env] = [a + (b or 0) for a, b in zip(environments.get(env, [0, 0, 0, 0]), counts)]
+    totals = [sum(counts[i] for counts in environments.values()) for i in range(3)]
+    summary = _migration_summary([part["current"] for part in parts])
+    summary["active_issues"] = sum(part["active_issues"] for part in parts)
+    issues = Counter()
+    for part in parts:
+        issues.update({row["issue"]: row["count"] for row in part["top_issues"]})
+    return {
+        "window": {"start": start, "end": end, "days": days},
+        "summary": summary,
+        "previous": _migration_summary([part["previous"] for part in parts]),
+        "trends": [{"date": day["date"], **{key: sum(part["trends"][i][key] for part in parts)
+                                            for key in ("completed", "failed", "total")}}
+                   for i, day in enumerate(parts[0]["trends"])],
+        "environments": [
+            {"name": env, "completed": int(done), "passed": passed, "warning": warning, "failed": failed}
+            for env, (passed, warning, failed, done) in sorted(environments.items())
+        ],
+        "success_rate": [
+            {"name": "Successful", "value": totals[0]},
+            {"name": "Warning", "value": totals[1]},
+            {"name": "Failed", "value": totals[2]},
+        ],
+        "top_issues": [{"issue": issue, "count": count} for issue, count in issues.most_common(TOP_ISSUES)],
+    }
+
+
+# Exports: each kind is (header, row query, fingerprint query)
+
+_STAMP_DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS servers_updated_au
+        AFTER UPDATE OF name, ip_address, environment, os, owner ON servers BEGIN
+        UPDATE servers SET updated_at = {NOW_SQL} WHERE id = new.id;
+    END""",
+]
+
+
+def ensure_server_stamps(engine):
+    with engine.begin() as conn:
+        for ddl in _STAMP_DDL:
+            conn.execute(text(ddl))
+
+
+def _servers_edited(db: Session):
+    # Every export carries server names or attributes
+    return db.query(func.max(models.Server.updated_at)).scalar_subquery()
+
+
+def _migration_rows(db: Session, start: datetime, end: datetime):
+    m, s = models.Migration, models.Server
+    in_window = or_(and_(m.completed_at >= start, m.completed_at < end),
+                    and_(m.started_at >= start, m.started_at < end))
+    header = ["migration_id", "server_id", "server_name", "environment", "status", "started_at", "completed_at", "notes"]
+    rows = db.query(m.id, m.server_id, s.name, s.environment, m.status, m.started_at, m.completed_at, m.notes
+                    ).outerjoin(s, s.id == m.server_id).filter(in_window).order_by(m.id)
+    fingerprint = db.query(func.count(m.id), func.max(m.id), func.max(m.started_at), func.max(m.completed_at),
+                           func.count(m.completed_at), _servers_edited(db)).filter(in_window)
+    return header, rows, fingerprint
+
+
+def _status_history_rows(db: Session, start: datetime, end: datetime):
+    ss, s = models.ServerStatus, models.Server
+    in_window = and_(ss.last_checked >= start, ss.last_checked < end)
+    header = ["status_id", "server_id", "server_name", "environment", "version", "migration_status",
+              "precheck_status", "postcheck_status", "issue_summary", "last_checked"]
+    rows = db.query(ss.id, ss.server_id, s.name, s.environment, ss.version, ss.migration_status,
+                    ss.precheck_status, ss.postcheck_status, ss.issue_summary, ss.last_checked
+                    ).outerjoin(s, s.id == ss.server_id).filter(in_window).order_by(ss.id)
+    # History rows are append-only, so count and newest id identify the content
+    fingerprint = db.query(func.count(ss.id), func.max(ss.id), _servers_edited(db)).filter(in_window)
+    return header, rows, fingerprint
+
+
+def _server_rows(db: Session, start: datetime, end: datetime):
+    s, cs = models.Server, models.CurrentStatus
+    header = ["server_id", "name", "ip_address", "environment", "os", "owner", "migration_status",
+              "precheck_status", "postcheck_status", "issue_summary", "last_checked"]
+    rows = db.query(s.id, s.name, s.ip_address, s.environment, s.os, s.owner, cs.migration_status,
+                    cs.precheck_status, cs.postcheck_status, cs.issue_summary, cs.last_checked
+                    ).outerjoin(cs, cs.server_id == s.id).order_by(s.id)
+    # Every status change bumps its server's version, and every edit its stamp
+    fingerprint = db.query(func.count(s.id), func.max(s.id), func.sum(cs.version), func.max(s.updated_at)
+                           ).outerjoin(cs, cs.server_id == s.id)
+    return header, rows, fingerprint
+
+
+EXPORTS = {
+    "migrations": _migration_rows,
+    "status_history": _status_history_rows,
+    "servers": _server_rows,
+}
+
+
+def artifact_path(sha256: str) -> str:
+    return os.path.join(REPORTS_DIR, f"{sha256}.csv")
+
+
+def export_cache_key(db: Session, kind: str, start: datetime, end: datetime) -> str:
+    _, _, fingerprint = EXPORTS[kind](db, start, end)
+    state = [str(v) for v in fingerprint.one()]
+    window = [start.isoformat(), end.isoformat()] if kind != "servers" else []
+    return hashlib.sha256(json.dumps([kind, window, state]).encode()).hexdigest()
+
+
+def write_export(db: Session, kind: str, start: datetime, end: datetime) -> Tuple[str, int, int]:
+    """Stream the export to a temporary file, then move it to its content address"""
+    header, rows, _ = EXPORTS[kind](db, start, end)
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(REPORTS_DIR, f".export-{os.getpid()}-{id(digest)}.tmp")
+    count = size = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush(out):
+        nonlocal size
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        digest.update(data)
+        out.write(data)
+        size += len(data)
+
+    try:
+        with open(tmp_path, "wb") as out:
+            writer.writerow(header)
+            for row in rows.yield_per(BATCH_ROWS):
+                writer.writerow(row)
+                count += 1
+                if count % BATCH_ROWS == 0:
+                    flush(out)
+            flush(out)
+        sha256 = digest.hexdigest()
+        # Identical content from another export already lives at this address
+        os.replace(tmp_path, artifact_path(sha256))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return sha256, count, size
+
+
+def run_export(export_id: int):
+    db = SessionLocal()
+    try:
+        export = db.get(models.ReportExport, export_id)
+        if export is None or export.status != "queued":
+            return
+        export.status = "running"
+        db.commit()
+        try:
+            export.content_sha256, export.rows, export.bytes = write_export(
+                db, export.kind, export.window_start, export.window_end)
+            export.status = "succeeded"
+        except Exception as e:
+            logger.exception("Report export %s failed", export_id)
+            db.rollback()
+            export.status = "failed"
+            export.error = str(e)
+        export.finished_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+def find_cached_export(db: Session, cache_key: str) -> Optional[models.ReportExport]:
+    """A finished export whose file still exists, or one still being written"""
+    candidates = db.query(models.ReportExport).filter(
+        models.ReportExport.cache_key == cache_key,
+        models.ReportExport.status.in_(("queued", "running", "succeeded")),
+    ).order_by(models.ReportExport.id.desc()).all()
+    for export in candidates:
+        if export.status != "succeeded" or os.path.exists(artifact_path(export.content_sha256)):
+            return export
+    return None
+
+
+def request_export(db: Session, kind: str, days: int) -> Tuple[models.ReportExport, bool]:
+    """Return (export, cached); queues a new export only when no matching one exists"""
+    start, end = report_window(days)
+    cache_key = export_cache_key(db, kind, start, end)
+    cached = find_cached_export(db, cache_key)
+    if cached is not None:
+        return cached, True
+    export = models.ReportExport(kind=kind, window_start=start, window_end=end, cache_key=cache_key,
+                                 status="queued", created_at=datetime.utcnow())
+    db.add(export)
+    db.commit()
+    db.refresh(export)
+    _executor.submit(run_export, export.id)
+    return export, False
+
+
+def recover_interrupted_exports(db: Session):
+    """Exports cut off by a restart are failed; asking again starts a fresh one"""
+    db.query(models.ReportExport).filter(models.ReportExport.status.in_(("queued", "running"))).update(
+        {"status": "failed", "error": "interrupted by restart", "finished_at": datetime.utcnow()},
+        synchronize_session=False)
+    db.commit()
+
+
+router = APIRouter()
+
+@router.get("/reports/overview")
+def reports_overview(days: int = Query(7, ge=1, le=365), db: Session = Depends(get_db)):
+    return overview(db, days)
+
+@router.post("/reports/exports", response_model=schemas.ReportExport)
+def create_export(request: schemas.ReportExportCreate, response: Response, db: Session = Depends(get_db)):
+    export, cached = request_export(db, request.kind, request.days)
+    if export.status != "succeeded":
+        response.status_code = 202
+    return {**schemas.ReportExport.model_validate(export).model_dump(), "cached": cached}
+
+@router.get("/reports/exports", response_model=List[schemas.ReportExport])
+def list_exports(limit: int = Query(50, ge=1, le=500), db: Session = Depends(get_db)):
+    return db.query(*read_models.columns(models.ReportExport, schemas.ReportExport)).order_by(
+        models.ReportExport.id.desc()).limit(limit).all()
+
+@router.get("/reports/exports/{export_id}", response_model=schemas.ReportExport)
+def get_export(export_id: int, db: Session = Depends(get_db)):
+    export = db.get(models.ReportExport, export_id)
+    if export is None:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return export
+
+@router.get("/reports/exports/{export_id}/download")
+def download_export(export_id: int, request: Request, db: Session = Depends(get_db)):
+    export = db.get(models.ReportExport, export_id)
+    if export is None:
+        raise HTTPException(status_code=404, detail="Export not found")
+    if export.status != "succeeded":
+        raise HTTPException(status_code=409, detail=f"Export is {export.status}")
+    path = artifact_path(export.content_sha256)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=410, detail="Export file was removed; request the export again")
+    # The file never changes under its hash, so clients may keep it forever
+    headers = {"ETag": f'"{export.content_sha256}"', "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    suffix = f"-{export.window_start:%Y%m%d}-{export.window_end:%Y%m%d}" if export.kind != "servers" else ""
+    return FileResponse(path, media_type="text/csv", filename=f"{export.kind}{suffix}.csv", headers=headers)
@@ -0,0 +1,359 @@
+"""
+Scheduled fleet health sweeps.
+
+Each CheckSchedule describes a nightly window for one environment. When the
+window opens the scheduler picks the servers that were not checked recently,
+spreads them over the window with random jitter and queues a check job for
+each (see jobs.py), so sweeps get the workers' leases, retries and
+`/jobs/{id}/cancel`, and a scheduler restart leaves nothing Running. A run
+keeps at most `max_concurrency` of its environment's jobs queued or running
+and at most SCHEDULER_MAX_JOBS in total, and releases a slot when a worker
+finishes the job. Schedules are kept in the main database; with shards, the
+servers are read and their jobs queued in the database that holds them.
+"""
+
+import os
+import random
+import threading
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from . import models, read_models, schemas
+from .database import SessionLocal, get_db, sessions, session_for_environment, session_for_server, shard_of
+from .jobs import ACTIVE_STATUSES, enqueue_check
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "30"))
+# SCHEDULER_MAX_WORKERS is the older name, from when sweeps ran checks themselves
+MAX_JOBS = int(os.getenv("SCHEDULER_MAX_JOBS", os.getenv("SCHEDULER_MAX_WORKERS", "8")))
+# How often a run looks at its outstanding jobs
+WATCH_SECONDS = 1.0
+# Write run progress back to the database every N finished checks
+PROGRESS_EVERY = 10
+
+
+def window_bounds(schedule: models.CheckSchedule, now: datetime):
+    """Return the (start, end) of the most recent window that opened at or before `now`"""
+    hour, minute = map(int, schedule.window_start.split(":"))
+    start = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if start > now:
+        start -= timedelta(days=1)
+    return start, start + timedelta(minutes=schedule.window_minutes)
+
+
+def is_due(schedule: models.CheckSchedule, now: datetime) -> bool:
+    if not schedule.enabled:
+        return False
+    start, end = window_bounds(schedule, now)
+    # A zero-length window still stays open long enough for the poll loop to see it
+    end = max(end, start + timedelta(seconds=2 * POLL_SECONDS))
+    if not start <= now < end:
+        return False
+    return schedule.last_run_at is None or schedule.last_run_at < start
+
+
+def select_targets(db: Session, schedule: models.CheckSchedule, now: datetime):
+    """Split the schedule's environment into (server ids to check, number skipped)"""
+    cutoff = now - timedelta(minutes=schedule.skip_recent_minutes)
+    rows = db.query(models.Server.id, models.CurrentStatus.last_checked,
+                    models.CurrentStatus.precheck_status, models.CurrentStatus.postcheck_status).outerjoin(
+        models.CurrentStatus, models.CurrentStatus.server_id == models.Server.id
+    ).filter(models.Server.environment == schedule.environment).all()
+    targets, skipped = [], 0
+    for server_id, last_checked, precheck, postcheck in rows:
+        if 'Running' in (precheck, postcheck):
+            skipped += 1
+        elif last_checked is not None and last_checked >= cutoff:
+            skipped += 1
+        else:
+            targets.append(server_id)
+    return targets, skipped
+
+
+def claim_window(db: Session, schedule: models.CheckSchedule, now: datetime) -> bool:
+    """Take ownership of the schedule's current window; only one API worker process wins"""
+    start, _ = window_bounds(schedule, now)
+    claimed = db.query(models.CheckSchedule).filter(
+        models.CheckSchedule.id == schedule.id,
+        or_(models.CheckSchedule.last_run_at == None, models.CheckSchedule.last_run_at < start),
+    ).update({"last_run_at": now}, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+
+def recover_interrupted_runs(db: Session):
+    """Close out runs that were still 'Running' when their process died"""
+    db.query(models.ScheduleRun).filter_by(status="Running").update(
+        {"status": "Interrupted", "finished_at": datetime.utcnow()})
+    db.commit()
+
+
+def plan_offsets(server_ids: List[int], spread_seconds: float, seed: int):
+    """Assign every server a jittered start offset inside the window, in dispatch order"""
+    rng = random.Random(seed)
+    return sorted((rng.uniform(0, spread_seconds), server_id) for server_id in server_ids)
+
+
+class _Budget:
+    """Counting limiter whose size can be changed while jobs are outstanding"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_use >= self.limit:
+                return False
+            self.in_use += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_use -= 1
+
+
+def _enqueue(server_id: int, check_type: str):
+    """Queue the check in the server's database; returns (database, job id)"""
+    db = session_for_server(server_id)
+    try:
+        return shard_of(server_id), enqueue_check(db, server_id, check_type).id
+    finally:
+        db.close()
+
+
+def _finished_jobs(outstanding: dict) -> dict:
+    """{(database, job id): failed} for the outstanding jobs that have finished"""
+    by_database = {}
+    for database, job_id in outstanding:
+        by_database.setdefault(database, []).append(job_id)
+    finished = {}
+    for database, job_ids in by_database.items():
+        db = sessions[database]()
+        try:
+            rows = db.query(models.CheckJob.id, models.CheckJob.status, models.CheckJob.result).filter(
+                models.CheckJob.id.in_(job_ids), models.CheckJob.status.not_in(ACTIVE_STATUSES))
+            for job_id, status, result in rows:
+                finished[database, job_id] = status != "succeeded" or result == "Failed"
+        finally:
+            db.close()
+    return finished
+
+
+class Scheduler:
+    def __init__(self, max_jobs: int = MAX_JOBS, poll_seconds: float = POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._total = _Budget(max_jobs)
+        self._budgets = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # Jobs already queued stay in the queue for the workers
+        for thread in list(self._active.values()):
+            thread.join(timeout)
+
+    def is_active(self, schedule_id: int) -> bool:
+        with self._lock:
+            return schedule_id in self._active
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Scheduler tick failed")
+            self._stop.wait(self.poll_seconds)
+
+    def tick(self, now: datetime = None):
+        """Start a run for every enabled schedule whose window has just opened"""
+        now = now or datetime.utcnow()
+        db = SessionLocal()
+        try:
+            for schedule in db.query(models.CheckSchedule).filter_by(enabled=True).all():
+                if is_due(schedule, now) and not self.is_active(schedule.id) and claim_window(db, schedule, now):
+                    _, end = window_bounds(schedule, now)
+                    self.start_run(db, schedule, now, spread_seconds=(end - now).total_seconds())
+        finally:
+            db.close()
+
+    def start_run(self, db: Session, schedule: models.CheckSchedule, now: datetime = None,
+                  spread_seconds: float = None) -> models.ScheduleRun:
+        now = now or datetime.utcnow()
+        if spread_seconds is None:
+            spread_seconds = schedule.window_minutes * 60
+        servers_db = session_for_environment(schedule.environment)
+        try:
+            targets, skipped = select_targets(servers_db, schedule, now)
+        finally:
+            servers_db.close()
+        run = models.ScheduleRun(
+            schedule_id=schedule.id,
+            status="Running",
+            started_at=now,
+            servers_total=len(targets) + skipped,
+            servers_skipped=skipped,
+        )
+        db.add(run)
+        schedule.last_run_at = now
+        db.commit()
+        db.refresh(run)
+
+        plan = plan_offsets(targets, max(spread_seconds, 0), seed=run.id)
+        with self._lock:
+            budget = self._budgets.setdefault(schedule.environment, _Budget(schedule.max_concurrency))
+            budget.limit = schedule.max_concurrency
+            thread = threading.Thread(
+                target=self._execute_run,
+                args=(schedule.id, run.id, plan, budget, schedule.check_type),
+                name=f"sweep-run-{run.id}",
+                daemon=True,
+            )
+            self._active[schedule.id] = thread
+        thread.start()
+        return run
+
+    def _acquire(self, budget: _Budget) -> bool:
+        if not budget.try_acquire():
+            return False
+        if not self._total.try_acquire():
+            budget.release()
+            return False
+        return True
+
+    def _release(self, budget: _Budget):
+        budget.release()
+        self._total.release()
+
+    def _execute_run(self, schedule_id: int, run_id: int, plan, budget: _Budget, check_type: str):
+        """Queue the plan's jobs as their offsets come up and slots free, and count them as they finish"""
+        started = datetime.utcnow()
+        counts = {"checked": 0, "failed": 0}
+        pending = deque(plan)
+        outstanding = set()
+        status = "Completed"
+        try:
+            while pending or outstanding:
+                if self._stop.is_set():
+                    status = "Cancelled"
+                    break
+                reported = counts["checked"]
+                for key, failed in _finished_jobs(outstanding).items():
+                    outstanding.discard(key)
+                    self._release(budget)
+                    counts["checked"] += 1
+                    counts["failed"] += failed
+                while pending and started + timedelta(seconds=pending[0][0]) <= datetime.utcnow():
+                    if not self._acquire(budget):
+                        break
+                    _, server_id = pending.popleft()
+                    try:
+                        outstanding.add(_enqueue(server_id, check_type))
+                    except Exception:
+                        logger.exception("Could not queue a %s for server %s", check_type, server_id)
+                        self._release(budget)
+                        counts["checked"] += 1
+                        counts["failed"] += 1
+                if counts["checked"] // PROGRESS_EVERY != reported // PROGRESS_EVERY:
+                    self._save_progress(run_id, counts)
+                # Sleep until the next offset, but keep watching while jobs are out or slots are taken
+                next_due = (started + timedelta(seconds=pending[0][0]) - datetime.utcnow()).total_seconds() \
+                    if pending else WATCH_SECONDS
+                wait = next_due if next_due > 0 else WATCH_SECONDS
+                self._stop.wait(min(wait, WATCH_SECONDS) if outstanding else wait)
+        except Exception:
+            logger.exception("Schedule run %s failed", run_id)
+            status = "Failed"
+        finally:
+            # Jobs still outstanding are the workers' now; only the slots are given back
+            for _ in outstanding:
+                self._release(budget)
+            with self._lock:
+                self._active.pop(schedule_id, None)
+        self._save_progress(run_id, counts, status=status)
+
+    def _save_progress(self, run_id: int, counts: dict, status: str = None):
+        db = SessionLocal()
+        try:
+            values = {"servers_checked": counts["checked"], "servers_failed": counts["failed"]}
+            if status:
+                values.update({"status": status, "finished_at": datetime.utcnow()})
+            db.query(models.ScheduleRun).filter_by(id=run_id).update(values)
+            db.commit()
+        finally:
+            db.close()
+
+
+scheduler = Scheduler()
+
+router = APIRouter()
+
+@router.get("/schedules", response_model=List[schemas.CheckSchedule])
+def list_schedules(db: Session = Depends(get_db)):
+    return db.query(*read_models.columns(models.CheckSchedule, schemas.CheckSchedule)).order_by(
+        models.CheckSchedule.id).all()
+
+@router.post("/schedules", response_model=schemas.CheckSchedule)
+def create_schedule(payload: schemas.CheckScheduleCreate, db: Session = Depends(get_db)):
+    schedule = models.CheckSchedule(**payload.model_dump(), created_at=datetime.utcnow())
+    db.add(schedule)
+    db.commit()
+    db.refresh(schedule)
+    return schedule
+
+@router.put("/schedules/{schedule_id}", response_model=schemas.CheckSchedule)
+def update_schedule(schedule_id: int, payload: schemas.CheckScheduleCreate, db: Session = Depends(get_db)):
+    schedule = db.get(models.CheckSchedule, schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    for field, value in payload.model_dump().items():
+        setattr(schedule, field, value)
+    db.commit()
+    db.refresh(schedule)
+    return schedule
+
+@router.delete("/schedules/{schedule_id}")
+def delete_schedule(schedule_id: int, db: Session = Depends(get_db)):
+    schedule = db.get(models.CheckSchedule, schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    db.query(models.ScheduleRun).filter_by(schedule_id=schedule_id).delete()
+    db.delete(schedule)
+    db.commit()
+    return {"message": "Schedule deleted"}
+
+@router.post("/schedules/{schedule_id}/run", response_model=schemas.ScheduleRun)
+def run_schedule_now(schedule_id: int, spread_minutes: int = 0, db: Session = Depends(get_db)):
+    schedule = db.get(models.CheckSchedule, schedule_id)
+    if not schedule:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    if scheduler.is_active(schedule_id):
+        raise HTTPException(status_code=409, detail="Schedule is already running")
+    return scheduler.start_run(db, schedule, spread_seconds=spread_minutes * 60)
+
+@router.get("/schedules/{schedule_id}/runs", response_model=List[schemas.ScheduleRun])
+def list_schedule_runs(schedule_id: int, limit: int = 20, db: Session = Depends(get_db)):
+    return db.query(*read_models.columns(models.ScheduleRun, schemas.ScheduleRun)).filter_by(
+        schedule_id=schedule_id).order_by(
+        models.ScheduleRun.id.desc()).limit(limit).all()
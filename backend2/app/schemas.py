@@ -1,5 +1,5 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Any, Optional, List, Literal, Dict
 from datetime import datetime
 
 class ServerTag(BaseModel):
@@ -13,8 +13,38 @@ class ServerStatus(BaseModel):
     issue_summary: Optional[str]
     last_checked: Optional[datetime]
     is_current: bool
+    version: int = 1
     model_config = ConfigDict(from_attributes=True)
 
+class StatusTransition(BaseModel):
+    expected_version: Optional[int] = None
+    migration_status: Optional[str] = None
+    precheck_status: Optional[str] = None
+    postcheck_status: Optional[str] = None
+    issue_summary: Optional[str] = None
+
+class BatchStatusTransition(BaseModel):
+    # Exactly one of server_ids or a tag expression (see /tags/select)
+    server_ids: Optional[List[int]] = None
+    tags: Optional[str] = None
+    expected_versions: Dict[int, int] = {}
+    atomic: bool = False
+    migration_status: Optional[str] = None
+    precheck_status: Optional[str] = None
+    postcheck_status: Optional[str] = None
+    issue_summary: Optional[str] = None
+
+class BatchStatusOutcome(BaseModel):
+    server_id: int
+    outcome: Literal["updated", "unchanged", "invalid", "conflict", "not_found", "aborted"]
+    version: Optional[int] = None
+    detail: Optional[str] = None
+
+class BatchStatusResult(BaseModel):
+    requested: int
+    updated: int
+    outcomes: List[BatchStatusOutcome]
+
 class Alert(BaseModel):
     id: int
     server_id: int
@@ -22,8 +52,22 @@ class Alert(BaseModel):
     message: str
     resolved: bool
     created_at: datetime
+    rule: Optional[str] = None
+    metric: Optional[str] = None
+    value: Optional[float] = None
+    resolved_at: Optional[datetime] = None
     model_config = ConfigDict(from_attributes=True)
 
+class DashboardBundle(BaseModel):
+    # Sections that were not asked for are left out of the response
+    generated_at: datetime
+    as_of: Optional[datetime] = None
+    summary: Optional[dict] = None
+    migration_chart: Optional[List[dict]] = None
+    timeline: Optional[List[dict]] = None
+    alerts: Optional[List[Alert]] = None
+    recent_activity: Optional[List[dict]] = None
+
 class Migration(BaseModel):
     id: int
     server_id: int
@@ -42,7 +86,311 @@ class Server(BaseModel):
     owner: Optional[str]
     created_at: datetime
     tags: List[ServerTag] = []
+    current_status: Optional[ServerStatus] = None
     statuses: List[ServerStatus] = []
     alerts: List[Alert] = []
     migrations: List[Migration] = []
-    model_config = ConfigDict(from_attributes=True) 
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class ServerCounts(BaseModel):
+    statuses: int = 0
+    alerts: int = 0
+    open_alerts: int = 0
+    migrations: int = 0
+
+class ServerDetail(BaseModel):
+    # One server without its history; the lists are paged separately
+    id: int
+    name: str
+    ip_address: str
+    environment: str
+    os: Optional[str]
+    owner: Optional[str]
+    created_at: Optional[datetime]
+    tags: List[str] = []
+    current_status: Optional[ServerStatus] = None
+    counts: ServerCounts
+
+class StatusHistoryEntry(ServerStatus):
+    id: int
+
+class StatusHistoryPage(BaseModel):
+    items: List[StatusHistoryEntry]
+    next_before: Optional[int] = None
+
+class AlertPage(BaseModel):
+    items: List[Alert]
+    next_before: Optional[int] = None
+
+class MigrationPage(BaseModel):
+    items: List[Migration]
+    next_before: Optional[int] = None
+
+class CheckScheduleCreate(BaseModel):
+    name: str
+    environment: str
+    check_type: Literal["precheck", "postcheck"] = "precheck"
+    window_start: str = Field("01:00", pattern=r"^([01]\d|2[0-3]):[0-5]\d$")
+    window_minutes: int = Field(120, ge=0, le=1440)
+    max_concurrency: int = Field(4, ge=1, le=256)
+    skip_recent_minutes: int = Field(720, ge=0)
+    enabled: bool = True
+
+class CheckSchedule(CheckScheduleCreate):
+    id: int
+    created_at: Optional[datetime]
+    last_run_at: Optional[datetime]
+    model_config = ConfigDict(from_attributes=True)
+
+class ScheduleRun(BaseModel):
+    id: int
+    schedule_id: int
+    status: str
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    servers_total: int
+    servers_checked: int
+    servers_skipped: int
+    servers_failed: int
+    model_config = ConfigDict(from_attributes=True)
+
+class CheckJob(BaseModel):
+    id: int
+    server_id: int
+    check_type: str
+    status: str
+    attempts: int
+    max_attempts: int
+    lease_owner: Optional[str]
+    lease_expires_at: Optional[datetime]
+    created_at: Optional[datetime]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    result: Optional[str]
+    error: Optional[str]
+    cancel_requested: bool = False
+    model_config = ConfigDict(from_attributes=True)
+
+class CheckRun(BaseModel):
+    id: int
+    server_id: int
+    job_id: Optional[int]
+    check_type: str
+    environment: Optional[str]
+    os: Optional[str]
+    outcome: str
+    queue_ms: Optional[int]
+    start_ms: Optional[int]
+    run_ms: Optional[int]
+    write_ms: Optional[int]
+    timeout_seconds: Optional[float]
+    finished_at: Optional[datetime]
+    model_config = ConfigDict(from_attributes=True)
+
+class ProbeRequest(BaseModel):
+    server_ids: Optional[List[int]] = None
+    environment: Optional[str] = None
+    ports: Optional[List[int]] = None
+
+class ProbeResult(BaseModel):
+    server_id: int
+    # Same shape as check_server.ps1 output
+    result: Dict[str, Any]
+
+class SimulationRequest(BaseModel):
+    server_ids: Optional[List[int]] = None
+    environment: Optional[str] = None
+    check_type: Literal["precheck", "postcheck"] = "precheck"
+    concurrency: int = Field(10000, ge=1)
+    timeout_seconds: float = Field(30, gt=0)
+    seed: Optional[str] = None
+
+class SimulationSummary(BaseModel):
+    checks: int
+    skipped: int
+    results: Dict[str, int]
+    elapsed_ms: int
+    run_ms_p50: Optional[int]
+    run_ms_p99: Optional[int]
+
+class InventoryEntry(BaseModel):
+    server_id: int
+    name: str
+    environment: str
+    facts: Optional[Dict[str, Any]]
+    fetched_at: Optional[datetime]
+    age_seconds: Optional[int]
+    stale: bool
+    refreshing: bool
+    last_attempt_at: Optional[datetime]
+    error: Optional[str]
+
+class InventoryPage(BaseModel):
+    ttl_seconds: int
+    total: int
+    offset: int
+    items: List[InventoryEntry]
+
+class InventoryChange(BaseModel):
+    field: str
+    old_value: Any
+    new_value: Any
+    changed_at: datetime
+
+class ServerInventory(InventoryEntry):
+    changes: List[InventoryChange] = []
+
+class InventoryRefreshRequest(BaseModel):
+    server_ids: List[int] = Field(..., min_length=1, max_length=10000)
+
+class OutboxEvent(BaseModel):
+    id: int
+    topic: str
+    op: str
+    server_id: Optional[int]
+    entity_id: Optional[int]
+    created_at: datetime
+    data: Dict[str, Any]
+
+class OutboxPage(BaseModel):
+    events: List[OutboxEvent]
+    # Pass back as `after` to resume
+    cursor: int
+    has_more: bool
+
+class OutboxSinkState(BaseModel):
+    name: str
+    type: str
+    cursor: int
+    lag: int
+    delivered: int
+    attempts: int
+    next_attempt_at: Optional[datetime]
+    last_error: Optional[str]
+    last_delivered_at: Optional[datetime]
+
+class Heartbeat(BaseModel):
+    server_id: int
+    sent_at: Optional[datetime] = None
+    agent_version: Optional[str] = Field(None, max_length=64)
+    # Same names as check metrics, e.g. memory.used_pct, disk.C.used_pct
+    metrics: Dict[str, float] = Field(default_factory=dict, max_length=64)
+
+class HeartbeatEntry(BaseModel):
+    server_id: int
+    name: str
+    environment: str
+    received_at: datetime
+    age_seconds: int
+    sent_at: Optional[datetime]
+    agent_version: Optional[str]
+    metrics: Dict[str, float]
+    stale_since: Optional[datetime]
+
+class HeartbeatPage(BaseModel):
+    stale_after_seconds: int
+    total: int
+    offset: int
+    items: List[HeartbeatEntry]
+
+class MetricSummary(BaseModel):
+    metric: str
+    samples: int
+    first_ts: datetime
+    last_ts: datetime
+
+class MetricPoint(BaseModel):
+    ts: datetime
+    min: float
+    max: float
+    avg: float
+    count: int
+
+class MetricSeries(BaseModel):
+    server_id: int
+    metric: str
+    start: datetime
+    end: datetime
+    bucket_seconds: int
+    points: List[MetricPoint]
+
+class ReportExportCreate(BaseModel):
+    kind: Literal["migrations", "status_history", "servers"]
+    days: int = Field(7, ge=1, le=365)
+
+class ReportExport(BaseModel):
+    id: int
+    kind: str
+    window_start: Optional[datetime]
+    window_end: Optional[datetime]
+    status: str
+    content_sha256: Optional[str]
+    rows: Optional[int]
+    bytes: Optional[int]
+    created_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    error: Optional[str]
+    cached: bool = False
+    model_config = ConfigDict(from_attributes=True)
+
+class WavePlanRequest(BaseModel):
+    group_by: Literal["environment", "owner", "tag"] = "environment"
+    environment: Optional[str] = None
+    max_servers_per_wave: int = Field(25, ge=1, le=10000)
+    max_parallel: int = Field(4, ge=1, le=100)
+    dry_run: bool = False
+
+class WaveProgress(BaseModel):
+    pending: int = 0
+    in_flight: int = 0
+    completed: int = 0
+    failed: int = 0
+    throughput_per_hour: Optional[float] = None
+    eta: Optional[datetime] = None
+
+class WaveServer(BaseModel):
+    server_id: int
+    position: int
+    stage: str
+    migration_id: Optional[int]
+    job_id: Optional[int] = None
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+    error: Optional[str]
+    model_config = ConfigDict(from_attributes=True)
+
+class MigrationWave(BaseModel):
+    id: Optional[int] = None
+    name: str
+    group_by: str
+    group_value: Optional[str]
+    max_parallel: int
+    status: str
+    servers_total: int
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    progress: Optional[WaveProgress] = None
+    model_config = ConfigDict(from_attributes=True)
+
+class MigrationWaveDetail(MigrationWave):
+    servers: List[WaveServer] = []
+
+class ServerSearchHit(BaseModel):
+    id: int
+    name: str
+    ip_address: str
+    environment: str
+    os: Optional[str]
+    owner: Optional[str]
+    tags: List[str] = []
+    migration_status: Optional[str] = None
+
+class ServerSearchPage(BaseModel):
+    query: str
+    mode: Literal["fts", "fallback", "ip", "all"]
+    total: int
+    total_capped: bool = False
+    limit: int
+    offset: int
+    items: List[ServerSearchHit]
@@ -0,0 +1,281 @@
+"""
+Server search.
+
+Name, owner, OS, environment and tags are indexed in the FTS5 table
+`server_search` (rowid = server id). SQL triggers on `servers` and
+`server_tags` keep it in sync whoever writes, and results are ranked with
+bm25, weighting name matches highest. Every query word is a prefix match, so
+"web pro" finds "web-prod-01". When the SQLite build has no FTS5 the same
+endpoint falls back to LIKE matching.
+
+Queries that look like an IPv4 address or prefix ("10.1.", "10.1.0.0/16",
+"192.168.1.10") are answered from `servers.ip_int` with an index range scan.
+
+With shards and no environment, every database is searched at once for the
+first offset + limit hits, which are merged in the same order each database
+used; FTS hits, whose bm25 scores are per database, alternate by rank.
+"""
+
+import ipaddress
+import logging
+import re
+from itertools import zip_longest
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import SHARDED, get_db
+from .shards import fan_out, merge
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "server_search"
+# bm25 weights for name, owner, os, environment, tags
+WEIGHTS = "10.0, 2.0, 1.0, 1.0, 4.0"
+# Broad queries stop counting matches here, and rank by name hits instead of bm25
+MAX_COUNT = 1000
+IP_QUERY = re.compile(r"(\d{1,3}(?:\.\d{1,3}){0,3})\.?(?:/(\d{1,2}))?")
+
+# None until known: set by ensure_search_index or on the first search in this process
+fts_available = None
+
+_TAGS = "(SELECT group_concat(tag, ' ') FROM server_tags WHERE server_id = {id})"
+_FTS_DDL = [
+    # Prefix indexes let "prod"* be read as one posting list instead of merging every
+    # token that starts with it, which keeps multi-word prefix queries incremental
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "name, owner, os, environment, tags, tokenize = 'unicode61', prefix = '2 3 4 5 6')",
+    f"""CREATE TRIGGER IF NOT EXISTS server_search_ai AFTER INSERT ON servers BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, name, owner, os, environment, tags)
+        VALUES (new.id, new.name, new.owner, new.os, new.environment, {_TAGS.format(id="new.id")});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS server_search_au AFTER UPDATE OF name, owner, os, environment ON servers BEGIN
+        UPDATE {FTS_TABLE} SET name = new.name, owner = new.owner, os = new.os, environment = new.environment
+        WHERE rowid = new.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS server_search_ad AFTER DELETE ON servers BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS server_search_tag_ai AFTER INSERT ON server_tags BEGIN
+        UPDATE {FTS_TABLE} SET tags = {_TAGS.format(id="new.server_id")} WHERE rowid = new.server_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS server_search_tag_ad AFTER DELETE ON server_tags BEGIN
+        UPDATE {FTS_TABLE} SET tags = {_TAGS.format(id="old.server_id")} WHERE rowid = old.server_id;
+    END""",
+]
+
+
+def ip_to_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(ipaddress.IPv4Address((value or "").strip()))
+    except ValueError:
+        return None
+
+
+@event.listens_for(models.Server, "before_insert")
+@event.listens_for(models.Server, "before_update")
+def _set_ip_int(mapper, connection, server):
+    server.ip_int = ip_to_int(server.ip_address)
+
+
+def parse_ip_query(q: str) -> Optional[Tuple[int, int]]:
+    """Return the inclusive ip_int range for an IPv4 address, octet prefix or CIDR, else None"""
+    q = q.strip()
+    match = IP_QUERY.fullmatch(q)
+    if not match or ("." not in q and "/" not in q):
+        return None
+    octets = [int(part) for part in match.group(1).split(".")]
+    prefix = int(match.group(2)) if match.group(2) else 8 * len(octets)
+    if any(octet > 255 for octet in octets) or prefix > 32:
+        return None
+    base = int(ipaddress.IPv4Address(".".join(map(str, octets + [0] * (4 - len(octets))))))
+    size = 1 << (32 - prefix)
+    low = base & ~(size - 1) & 0xFFFFFFFF
+    return low, low + size - 1
+
+
+def fts_query(q: str) -> Optional[str]:
+    words = re.findall(r"\w+", q.lower())
+    return " AND ".join(f'"{word}"*' for word in words) if words else None
+
+
+def ensure_search_index(engine):
+    """Create the FTS table and triggers, backfill ip_int, and rebuild the index if it drifted"""
+    global fts_available
+    with engine.begin() as conn:
+        rows = conn.execute(text("SELECT id, ip_address FROM servers WHERE ip_int IS NULL")).all()
+        updates = [{"id": server_id, "ip_int": ip_to_int(ip)} for server_id, ip in rows]
+        updates = [row for row in updates if row["ip_int"] is not None]
+        if updates:
+            conn.execute(text("UPDATE servers SET ip_int = :ip_int WHERE id = :id"), updates)
+    try:
+        with engine.begin() as conn:
+            for ddl in _FTS_DDL:
+                conn.execute(text(ddl))
+            indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+            servers = conn.execute(text("SELECT count(*) FROM servers")).scalar()
+            if indexed != servers:
+                rebuild_search_index(conn)
+        fts_available = True
+    except OperationalError:
+        logger.warning("SQLite has no FTS5; server search falls back to LIKE matching")
+        fts_available = False
+
+
+def rebuild_search_index(conn):
+    conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    conn.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, owner, os, environment, tags) "
+        f"SELECT s.id, s.name, s.owner, s.os, s.environment, {_TAGS.format(id='s.id')} FROM servers s"
+    ))
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
+
+
+def _fts_ready(db: Session) -> bool:
+    global fts_available
+    if fts_available is None:
+        fts_available = db.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                   {"name": FTS_TABLE}).first() is not None
+    return fts_available
+
+
+def _count(db: Session, sql: str, params: dict) -> Tuple[int, bool]:
+    total = db.execute(text(f"SELECT count(*) FROM ({sql} LIMIT {MAX_COUNT + 1})"), params).scalar()
+    return min(total, MAX_COUNT), total > MAX_COUNT
+
+
+def _ids(db: Session, sql: str, params: dict) -> List[int]:
+    return [row[0] for row in db.execute(text(sql), params)]
+
+
+def _fts_search(db: Session, match: str, limit: int, offset: int):
+    fts = f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+    # Every MATCH evaluation reads the terms' full posting lists, so use as few as possible
+    head = _ids(db, f"SELECT rowid {fts} LIMIT {MAX_COUNT + 1}", {"match": match})
+    if len(head) <= MAX_COUNT:
+        ranked = _ids(db, f"SELECT rowid {fts} ORDER BY bm25({FTS_TABLE}, {WEIGHTS}), rowid "
+                          "LIMIT :limit OFFSET :offset", {"match": match, "limit": limit, "offset": offset})
+        return len(head), False, ranked
+
+    # bm25 over tens of thousands of hits costs more than the rest of the search and
+    # barely orders them; list the servers whose name matches first, then the rest
+    name_match = f"{{name}} : ({match})"
+    ids = _ids(db, f"SELECT rowid {fts} ORDER BY rowid LIMIT :limit OFFSET :offset",
+               {"match": name_match, "limit": limit, "offset": offset})
+    if len(ids) == limit:
+        return MAX_COUNT, True, ids
+    if offset == 0:
+        # All name hits are on this page, and `head` holds the first others in rowid order
+        named = set(ids)
+        rest = [server_id for server_id in head if server_id not in named]
+        if len(rest) >= limit - len(ids):
+            return MAX_COUNT, True, ids + rest[:limit - len(ids)]
+    name_total = db.execute(text(f"SELECT count(*) {fts}"), {"match": name_match}).scalar()
+    ids += _ids(db, f"SELECT rowid {fts} ORDER BY rowid LIMIT :limit OFFSET :offset", {
+        "match": f"({match}) NOT {name_match}", "limit": limit - len(ids), "offset": max(0, offset - name_total)})
+    return MAX_COUNT, True, ids
+
+
+def search_server_ids(db: Session, q: str, environment: str = None, limit: int = 20, offset: int = 0):
+    """Return (mode, total, capped, ids in rank order); totals above MAX_COUNT are capped"""
+    params = {"limit": limit, "offset": offset, "environment": environment}
+    env_filter = "AND s.environment = :environment" if environment else ""
+    ip_range = parse_ip_query(q)
+    words = fts_query(q)
+    if ip_range:
+        mode = "ip"
+        params.update(low=ip_range[0], high=ip_range[1])
+        where = f"FROM servers s WHERE s.ip_int BETWEEN :low AND :high {env_filter}"
+        order = "s.ip_int"
+    elif not words:
+        mode, where, order = "all", f"FROM servers s WHERE 1 {env_filter}", "s.id"
+    elif _fts_ready(db):
+        if environment:
+            # Whole-word match on the indexed environment keeps the search inside the FTS index
+            words = f'({words}) AND {{environment}} : "{environment.replace(chr(34), chr(34) * 2)}"'
+        return ("fts", *_fts_search(db, words, limit, offset))
+    else:
+        mode = "fallback"
+        conditions = []
+        for i, word in enumerate(re.findall(r"\w+", q.lower())):
+            params[f"w{i}"] = f"%{word}%"
+            conditions.append(
+                f"(lower(s.name) LIKE :w{i} OR lower(s.owner) LIKE :w{i} OR lower(s.os) LIKE :w{i} "
+                f"OR lower(s.environment) LIKE :w{i} OR EXISTS (SELECT 1 FROM server_tags t "
+                f"WHERE t.server_id = s.id AND lower(t.tag) LIKE :w{i}))")
+        where = f"FROM servers s WHERE {' AND '.join(conditions)} {env_filter}"
+        # Name hits first, then alphabetical
+        params["name_prefix"] = f"{q.strip().lower()}%"
+        order = "lower(s.name) LIKE :name_prefix DESC, s.name"
+    total, capped = _count(db, f"SELECT 1 {where}", params)
+    return mode, total, capped, _ids(db, f"SELECT s.id {where} ORDER BY {order} LIMIT :limit OFFSET :offset", params)
+
+
+def load_hits(db: Session, ids: List[int]) -> List[dict]:
+    if not ids:
+        return []
+    rows = db.execute(text(
+        "SELECT s.id, s.name, s.ip_address, s.environment, s.os, s.owner, cs.migration_status, "
+        "(SELECT group_concat(tag, ',') FROM server_tags WHERE server_id = s.id) "
+        "FROM servers s LEFT JOIN server_current_status cs ON cs.server_id = s.id "
+        f"WHERE s.id IN ({', '.join(str(int(i)) for i in ids)})"
+    )).all()
+    by_id = {row[0]: row for row in rows}
+    hits = []
+    for server_id in ids:
+        sid, name, ip, env, os_name, owner, status, tags = by_id[server_id]
+        hits.append({"id": sid, "name": name, "ip_address": ip, "environment": env, "os": os_name,
+                     "owner": owner, "migration_status": status, "tags": sorted(tags.split(",")) if tags else []})
+    return hits
+
+
+def _shard_search(db: Session, q: str, limit: int):
+    mode, total, capped, ids = search_server_ids(db, q, limit=limit)
+    return mode, total, capped, load_hits(db, ids)
+
+
+_MERGE_KEYS = {
+    "all": lambda hit: hit["id"],
+    "ip": lambda hit: int(ipaddress.ip_address(hit["ip_address"])),
+}
+
+
+def fleet_search(q: str, limit: int, offset: int):
+    """search_server_ids + load_hits over every database; returns (mode, total, capped, hits)"""
+    parts = fan_out(_shard_search, q, offset + limit)
+    modes = {mode for mode, _, _, _ in parts}
+    mode = modes.pop() if len(modes) == 1 else "fts"
+    hit_lists = [hits for _, _, _, hits in parts]
+    if mode in _MERGE_KEYS:
+        hits = merge(hit_lists, key=_MERGE_KEYS[mode])
+    elif mode == "fallback":
+        prefix = q.strip().lower()
+        hits = merge(hit_lists, key=lambda hit: (not hit["name"].lower().startswith(prefix), hit["name"]))
+    else:
+        hits = [hit for rank in zip_longest(*hit_lists) for hit in rank if hit is not None]
+    return (mode, sum(total for _, total, _, _ in parts), any(capped for _, _, capped, _ in parts),
+            hits[offset:offset + limit])
+
+
+router = APIRouter()
+
+@router.get("/search/servers", response_model=schemas.ServerSearchPage)
+def search_servers(
+    q: str = "",
+    environment: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    # An environment is in one database, which get_db has picked
+    if SHARDED and not environment:
+        mode, total, capped, hits = fleet_search(q, limit, offset)
+    else:
+        mode, total, capped, ids = search_server_ids(db, q, environment, limit, offset)
+        hits = load_hits(db, ids)
+    return {"query": q, "mode": mode, "total": total, "total_capped": capped, "limit": limit,
+            "offset": offset, "items": hits}
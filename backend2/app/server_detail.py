@@ -0,0 +1,107 @@
+"""
+Per-server detail.
+
+`GET /servers/{id}` returns one server with its tags, current status and
+the size of each history list, all from a single query. The lists
+themselves are separate resources, paged newest first with a keyset cursor:
+each page carries `next_before`, the smallest id on it, and the next request
+passes it back as `before`. Every page is then an index range scan on
+(server_id, id), however deep into the history the client has scrolled,
+where OFFSET would re-read every row it skips. A client that wants the whole
+history at once asks for NDJSON and gets it streamed in one response.
+"""
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import models, read_models, schemas
+from .database import get_db, shard_for_request
+
+def _count(model, *conditions):
+    return select(func.count()).where(model.server_id == models.Server.id, *conditions).scalar_subquery()
+
+
+def _history(db: Session, server_id: int, model, schema, before: Optional[int], *filters):
+    query = db.query(*read_models.columns(model, schema)).filter(model.server_id == server_id, *filters)
+    if before is not None:
+        query = query.filter(model.id < before)
+    return query.order_by(model.id.desc())
+
+
+def _page(db: Session, request: Request, server_id: int, model, schema, limit: int, before: Optional[int], *filters):
+    """Newest-first page of `model` rows for a server, plus the cursor for the next one
+
+    With Accept: application/x-ndjson, streams every row older than `before` instead of one page.
+    """
+    if read_models.wants_ndjson(request):
+        if db.get(models.Server, server_id) is None:
+            raise HTTPException(status_code=404, detail="Server not found")
+        return read_models.ndjson(schema, lambda stream: _history(
+            stream, server_id, model, schema, before, *filters).yield_per(read_models.CHUNK),
+            databases=[shard_for_request(request)])
+    rows = _history(db, server_id, model, schema, before, *filters).limit(limit + 1).all()
+    if not rows and db.get(models.Server, server_id) is None:
+        raise HTTPException(status_code=404, detail="Server not found")
+    items = rows[:limit]
+    return {"items": items, "next_before": items[-1].id if len(rows) > limit else None}
+
+
+router = APIRouter()
+
+@router.get("/servers/{server_id}", response_model=schemas.ServerDetail)
+def get_server(server_id: int, db: Session = Depends(get_db)):
+    row = db.query(
+        models.Server,
+        models.CurrentStatus,
+        select(func.group_concat(models.ServerTag.tag, ",")).where(
+            models.ServerTag.server_id == models.Server.id).scalar_subquery(),
+        _count(models.ServerStatus),
+        _count(models.Alert),
+        _count(models.Alert, models.Alert.resolved.isnot(True)),
+        _count(models.Migration),
+    ).outerjoin(models.CurrentStatus, models.CurrentStatus.server_id == models.Server.id).filter(
+        models.Server.id == server_id).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Server not found")
+    server, current, tags, statuses, alerts, open_alerts, migrations = row
+    return {
+        **{key: getattr(server, key) for key in ("id", "name", "ip_address", "environment", "os", "owner", "created_at")},
+        "tags": sorted(tags.split(",")) if tags else [],
+        "current_status": current,
+        "counts": {"statuses": statuses, "alerts": alerts, "open_alerts": open_alerts, "migrations": migrations},
+    }
+
+@router.get("/servers/{server_id}/statuses", response_model=schemas.StatusHistoryPage)
+def list_server_statuses(
+    server_id: int,
+    request: Request,
+    limit: int = Query(20, ge=1, le=200),
+    before: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    return _page(db, request, server_id, models.ServerStatus, schemas.StatusHistoryEntry, limit, before)
+
+@router.get("/servers/{server_id}/alerts", response_model=schemas.AlertPage)
+def list_server_alerts(
+    server_id: int,
+    request: Request,
+    limit: int = Query(20, ge=1, le=200),
+    before: Optional[int] = None,
+    resolved: Optional[bool] = None,
+    db: Session = Depends(get_db),
+):
+    filters = [models.Alert.resolved == resolved] if resolved is not None else []
+    return _page(db, request, server_id, models.Alert, schemas.Alert, limit, before, *filters)
+
+@router.get("/servers/{server_id}/migrations", response_model=schemas.MigrationPage)
+def list_server_migrations(
+    server_id: int,
+    request: Request,
+    limit: int = Query(20, ge=1, le=200),
+    before: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    return _page(db, request, server_id, models.Migration, schemas.Migration, limit, before)
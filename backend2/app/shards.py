@@ -0,0 +1,93 @@
+"""
+Per-environment database shards.
+
+Every write to SQLite waits for the one write lock of its file, so a single
+file caps the whole fleet at one writer. With INFRA_NOVA_SHARDS set, the
+servers of the listed environments live in database files of their own,
+with everything that belongs to them: status history, alerts, migrations,
+tags, checks, metrics, inventory, heartbeats and outbox events. Each file
+has the full schema and takes its own writes, so a Production check does not
+wait for a UAT one. Servers of environments not listed stay in the main
+file, which also keeps schedules, waves and report exports.
+
+A request goes to one database (see `database.get_db`): the one holding the
+`{server_id}` in its path, else the one for its `?environment=`, else the
+main one. Server ids are unique across the databases, and `database.directory`
+maps them to their file. Other ids (jobs, alerts, outbox events) are only
+unique within one database, so address those with `?environment=`.
+
+Fleet-wide reads run on every database at once with `fan_out` and merge the
+results: the dashboard, `/servers`, `/server-status`, `/alerts`, tags, the
+reports overview and open alerts per rule, and search, capacity analytics
+and `/heartbeats` when no environment is given. Each database answers from its own
+snapshot. Batch status changes are split by database and are atomic within
+each one.
+
+Job workers run one per database. The heartbeat writer, outbox relay and
+inventory refresher go through every database in turn, and scheduled sweeps
+check their environment's database. Waves and simulations take servers from
+every database and run each one's checks and migration in its own; exports
+cover the servers of the main database.
+
+`python shard.py` creates the shard files and moves servers into the
+database their environment maps to.
+"""
+
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+from fastapi import APIRouter
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import SHARDS, sessions, shard_for_environment, shard_of
+
+_executor = ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix="shard")
+
+
+def fan_out(fn: Callable, *args) -> list:
+    """`fn(db, *args)` on every database at once, each on a session of its own; results in database order"""
+    def run(factory):
+        db = factory()
+        try:
+            return fn(db, *args)
+        finally:
+            db.close()
+
+    return list(_executor.map(run, sessions.values()))
+
+
+def merge(parts: Iterable[Iterable], key: Callable, reverse: bool = False) -> list:
+    """One list from lists that are each sorted by `key`"""
+    return list(heapq.merge(*parts, key=key, reverse=reverse))
+
+
+def group_by_shard(server_ids: Iterable[int]) -> Dict[str, List[int]]:
+    groups = {}
+    for server_id in server_ids:
+        groups.setdefault(shard_of(server_id), []).append(server_id)
+    return groups
+
+
+def _environments(db: Session) -> dict:
+    return dict(db.query(models.Server.environment, func.count()).group_by(models.Server.environment))
+
+
+router = APIRouter()
+
+@router.get("/shards")
+def list_shards():
+    # `misplaced` counts servers whose environment maps to another database; shard.py moves them
+    shards = []
+    for path, counts in zip(sessions, fan_out(_environments)):
+        shards.append({
+            "path": path,
+            "environments": sorted(environment for environment, target in SHARDS.items() if target == path),
+            "servers": sum(counts.values()),
+            "servers_by_environment": counts,
+            "misplaced": sum(count for environment, count in counts.items()
+                             if shard_for_environment(environment) != path),
+        })
+    return shards
@@ -0,0 +1,301 @@
+"""
+Simulated checks.
+
+Used when PowerShell is not installed (development) and for load-testing the
+check pipeline. How long a simulated check takes and how it ends is drawn
+from a profile per environment, set as JSON in SIMULATION_PROFILES:
+
+    {"default": {"latency_ms": 2000, "jitter": 0.25, "outcomes": {"Passed": 0.5, "Failed": 0.5}},
+     "Production": {"latency_ms": 800, "tail_rate": 0.02, "tail_factor": 20, "timeout_rate": 0.01,
+                    "outcomes": {"Passed": 0.9, "Warning": 0.07, "Failed": 0.03}}}
+
+Latency is log-normal around `latency_ms` (`jitter` is the sigma); a
+`tail_rate` share of checks take `tail_factor` times longer, and a
+`timeout_rate` share hang until the check's timeout. The defaults match the
+old simulator: two seconds, then Passed or Failed at even odds.
+
+With SIMULATION_SEED set, each draw comes from its own generator seeded with
+(seed, server, check type, status version), so a run gives the same results
+however the checks interleave, and re-running from the same database state
+reproduces it.
+
+`simulate` is a coroutine, so `run_simulated_checks` can keep thousands of
+checks in flight on one event loop. It starts them with one batch transition
+per database and records results through a writer that batches them as they
+finish.
+`POST /simulations` drives it, when SIMULATION_API_ENABLED=1. Simulated checks
+from the job queue wait on `simulation_loop` the same way, so a job worker
+thread is free again as soon as the check has started.
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import sessions
+from .shards import fan_out, group_by_shard, merge
+from .transitions import MIGRATION_TRANSITIONS, StatusConflict, complete_check, transition_many
+
+DEFAULT_PROFILE = {
+    "latency_ms": 2000.0,
+    "jitter": 0.0,
+    "tail_rate": 0.0,
+    "tail_factor": 10.0,
+    "timeout_rate": 0.0,
+    "outcomes": {"Passed": 0.5, "Failed": 0.5},
+}
+SEED = os.getenv("SIMULATION_SEED")
+API_ENABLED = os.getenv("SIMULATION_API_ENABLED", "0") == "1"
+DEFAULT_TIMEOUT_SECONDS = float(os.getenv("CHECK_TIMEOUT_SECONDS", "30"))
+WRITE_BATCH = 500
+WRITE_INTERVAL_SECONDS = 0.2
+MAX_SERVERS = 20000
+# CheckRun.outcome per way a simulated check ends; kept apart from real runs' adaptive timeout samples
+RUN_OUTCOMES = {"completed": "simulated", "timeout": "simulated_timeout", "cancelled": "cancelled"}
+# How often a waiting check looks at its cancel flag
+CANCEL_POLL_SECONDS = 0.2
+
+
+def load_profiles(raw: Optional[str]) -> Dict[str, dict]:
+    """Parse SIMULATION_PROFILES; every profile is filled in from "default", then DEFAULT_PROFILE"""
+    profiles = json.loads(raw) if raw else {}
+    base = {**DEFAULT_PROFILE, **profiles.pop("default", {})}
+    resolved = {"default": base}
+    for environment, profile in profiles.items():
+        resolved[environment] = {**base, **profile}
+    for profile in resolved.values():
+        if not profile["outcomes"] or any(weight < 0 for weight in profile["outcomes"].values()):
+            raise ValueError("outcomes needs at least one non-negative weight")
+    return resolved
+
+
+PROFILES = load_profiles(os.getenv("SIMULATION_PROFILES"))
+
+
+def draw(server_id: int, check_type: str, sequence: int, environment: Optional[str] = None,
+         seed: Optional[str] = SEED, profiles: Dict[str, dict] = None) -> dict:
+    """Latency and result of one simulated check; deterministic per (seed, server, check, sequence)"""
+    profiles = profiles or PROFILES
+    profile = profiles.get(environment) or profiles["default"]
+    rng = random.Random(f"{seed}:{server_id}:{check_type}:{sequence}") if seed is not None else random.Random()
+    # Always draw the same numbers in the same order so one choice never shifts the others
+    spread, tail, hang, pick = rng.gauss(0, 1), rng.random(), rng.random(), rng.random()
+    latency = profile["latency_ms"] * math.exp(profile["jitter"] * spread)
+    if tail < profile["tail_rate"]:
+        latency *= profile["tail_factor"]
+    outcomes = profile["outcomes"]
+    threshold = pick * sum(outcomes.values())
+    for result, weight in outcomes.items():
+        threshold -= weight
+        if threshold < 0:
+            break
+    return {"latency_ms": latency, "timed_out": hang < profile["timeout_rate"], "result": result}
+
+
+def hold_seconds(sample: dict, timeout: float) -> float:
+    """How long the drawn check runs before it finishes or hits the timeout"""
+    return timeout if sample["timed_out"] else min(sample["latency_ms"] / 1000, timeout)
+
+
+def ended(sample: dict, timeout: float) -> str:
+    return "timeout" if sample["timed_out"] or sample["latency_ms"] / 1000 > timeout else "completed"
+
+
+async def simulate(sample: dict, timeout: float, cancel: threading.Event = None) -> str:
+    """Wait out a drawn check without holding a thread; returns completed, timeout or cancelled"""
+    hold = hold_seconds(sample, timeout)
+    if cancel is None:
+        await asyncio.sleep(hold)
+        return ended(sample, timeout)
+    loop = asyncio.get_running_loop()
+    end = loop.time() + hold
+    while (remaining := end - loop.time()) > 0:
+        if cancel.is_set():
+            return "cancelled"
+        await asyncio.sleep(min(remaining, CANCEL_POLL_SECONDS))
+    return ended(sample, timeout)
+
+
+class SimulationLoop:
+    """An event loop on a thread of its own, started on first use, for simulated checks from other threads"""
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def submit(self, coro) -> Future:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="simulation-loop", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+
+simulation_loop = SimulationLoop()
+
+
+def check_result(outcome: str, sample: dict, timeout: float):
+    """The (result, issue_summary) a simulated check records"""
+    if outcome == "cancelled":
+        return "Cancelled", "Cancelled by operator"
+    if outcome == "timeout":
+        return "Failed", f"Check timed out after {timeout:g}s"
+    return sample["result"], f"Simulated {sample['result'].lower()} check"
+
+
+def _write_results(check_type: str, finished: List[dict]) -> int:
+    """Record a batch of finished checks in the databases that hold their servers"""
+    by_shard = defaultdict(list)
+    for check in finished:
+        by_shard[check["shard"]].append(check)
+    return sum(_write_shard_results(path, check_type, checks) for path, checks in by_shard.items())
+
+
+def _write_shard_results(path: str, check_type: str, finished: List[dict]) -> int:
+    """Record one database's finished checks, grouped into one transition per distinct result"""
+    field = f"{check_type}_status"
+    target = "Migrated" if check_type == "precheck" else "Completed"
+    db = sessions[path]()
+    try:
+        groups = defaultdict(list)
+        for check in finished:
+            groups[(check["result"], check["issue_summary"])].append(check)
+        outcomes = []
+        for (result, issue_summary), checks in groups.items():
+            versions = {check["server_id"]: check["version"] for check in checks}
+            changes = {field: result, "issue_summary": issue_summary}
+            moving = set()
+            if result == "Passed":
+                # A passed check also moves the server on where the lifecycle allows, as in complete_check
+                moving = {check["server_id"] for check in checks
+                          if target in MIGRATION_TRANSITIONS.get(check["migration_status"], set())}
+                if moving:
+                    outcomes += transition_many(db, sorted(moving), {**changes, "migration_status": target}, versions)
+            staying = [server_id for server_id in versions if server_id not in moving]
+            if staying:
+                outcomes += transition_many(db, staying, changes, versions)
+        conflicts = [o["server_id"] for o in outcomes if o["outcome"] == "conflict"]
+        # The status moved on while the check ran; complete_check re-applies it if still Running
+        by_id = {check["server_id"]: check for check in finished}
+        for server_id in conflicts:
+            try:
+                complete_check(db, server_id, check_type, by_id[server_id]["result"], by_id[server_id]["issue_summary"])
+            except StatusConflict:
+                pass
+        now = datetime.utcnow()
+        db.execute(insert(models.CheckRun), [{
+            "server_id": check["server_id"], "check_type": check_type, "environment": check["environment"],
+            "os": check["os"], "outcome": RUN_OUTCOMES[check["outcome"]],
+            "run_ms": check["run_ms"], "timeout_seconds": check["timeout"], "finished_at": now,
+        } for check in finished])
+        db.commit()
+        return len(finished)
+    finally:
+        db.close()
+
+
+def _begin(server_ids: List[int], check_type: str):
+    """Start the checks with one batch transition per database; returns the started checks and the
+    number skipped"""
+    started = []
+    for path, ids in group_by_shard(server_ids).items():
+        db = sessions[path]()
+        try:
+            servers = {row.id: row for row in db.query(models.Server.id, models.Server.environment, models.Server.os)
+                       .filter(models.Server.id.in_(ids))}
+            outcomes = transition_many(db, list(servers), {f"{check_type}_status": "Running", "issue_summary": None})
+            statuses = dict(db.query(models.CurrentStatus.server_id, models.CurrentStatus.migration_status)
+                            .filter(models.CurrentStatus.server_id.in_(list(servers))))
+            started += [{"server_id": o["server_id"], "version": o["version"], "shard": path,
+                         "environment": servers[o["server_id"]].environment, "os": servers[o["server_id"]].os,
+                         "migration_status": statuses.get(o["server_id"])}
+                        for o in outcomes if o["outcome"] in ("updated", "unchanged")]
+        finally:
+            db.close()
+    return started, len(server_ids) - len(started)
+
+
+async def run_simulated_checks(server_ids: List[int], check_type: str = "precheck", concurrency: int = 10000,
+                               timeout: float = DEFAULT_TIMEOUT_SECONDS, seed: Optional[str] = SEED,
+                               profiles: Dict[str, dict] = None) -> dict:
+    """Run simulated checks for many servers on this event loop and record their results"""
+    t0 = time.perf_counter()
+    started, skipped = await asyncio.to_thread(_begin, list(server_ids), check_type)
+    slots = asyncio.Semaphore(concurrency)
+    done = asyncio.Queue()
+    latencies = []
+
+    async def one(check: dict):
+        async with slots:
+            sample = draw(check["server_id"], check_type, check["version"], check["environment"], seed, profiles)
+            began = time.perf_counter()
+            outcome = await simulate(sample, timeout)
+            check["run_ms"] = int((time.perf_counter() - began) * 1000)
+            check["result"], check["issue_summary"] = check_result(outcome, sample, timeout)
+            check.update(outcome=outcome, timeout=timeout)
+            latencies.append(check["run_ms"])
+            await done.put(check)
+
+    async def writer():
+        written = 0
+        while written < len(started):
+            batch = [await done.get()]
+            deadline = time.perf_counter() + WRITE_INTERVAL_SECONDS
+            while len(batch) < WRITE_BATCH and time.perf_counter() < deadline:
+                try:
+                    batch.append(await asyncio.wait_for(done.get(), deadline - time.perf_counter()))
+                except asyncio.TimeoutError:
+                    break
+            written += await asyncio.to_thread(_write_results, check_type, batch)
+
+    await asyncio.gather(writer(), *[one(check) for check in started])
+    latencies.sort()
+    results = defaultdict(int)
+    for check in started:
+        results[check["result"]] += 1
+    return {
+        "checks": len(started),
+        "skipped": skipped,
+        "results": dict(sorted(results.items())),
+        "elapsed_ms": int((time.perf_counter() - t0) * 1000),
+        "run_ms_p50": latencies[len(latencies) // 2] if latencies else None,
+        "run_ms_p99": latencies[int(len(latencies) * 0.99)] if latencies else None,
+    }
+
+
+def _selected_servers(db: Session, request: schemas.SimulationRequest) -> List[int]:
+    query = db.query(models.Server.id)
+    if request.server_ids:
+        query = query.filter(models.Server.id.in_(request.server_ids))
+    elif request.environment:
+        query = query.filter(models.Server.environment == request.environment)
+    return [server_id for (server_id,) in query.order_by(models.Server.id).limit(MAX_SERVERS + 1)]
+
+
+router = APIRouter()
+
+@router.post("/simulations", response_model=schemas.SimulationSummary)
+def run_simulation(request: schemas.SimulationRequest):
+    # Writes simulated results over real statuses, so it is off unless enabled
+    if not API_ENABLED:
+        raise HTTPException(status_code=403, detail="Simulations are disabled (SIMULATION_API_ENABLED=0)")
+    # The selection may span databases; the run opens sessions of its own on each
+    server_ids = merge(fan_out(_selected_servers, request), key=lambda server_id: server_id)[:MAX_SERVERS + 1]
+    if len(server_ids) > MAX_SERVERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SERVERS} servers per simulation")
+    return asyncio.run(run_simulated_checks(
+        server_ids, request.check_type, request.concurrency, request.timeout_seconds,
+        request.seed if request.seed is not None else SEED))
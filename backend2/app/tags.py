@@ -0,0 +1,242 @@
+"""
+Tag selection with set algebra.
+
+`GET /tags/select?q=production AND database AND NOT legacy` evaluates an
+AND/OR/NOT expression (with parentheses; adjacent tags mean AND) over an
+in-memory index that holds one bitmap per tag, with bit N set for server N,
+plus a bitmap of all servers for NOT. Python integers are the bitmaps, so
+each operator is a single big-int &, | or & ~ over the whole fleet.
+
+The index follows the database through `tag_changes`, a log that SQL
+triggers on `server_tags` and `servers` append to. Before answering, each
+process reads the newest sequence number and applies only the changes it has
+not seen, so writes from other processes or plain SQL are picked up without
+a rebuild. A full rebuild only happens on first use or after the log was
+pruned past the index's position.
+
+With shards, each database has an index of its own. Server ids are unique
+across databases, so a fleet-wide selection is the union of theirs.
+"""
+
+import re
+import threading
+from collections import Counter
+from functools import reduce
+from operator import or_
+from typing import Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import DATABASE_PATH, SHARDED, get_db, sessions
+from .shards import fan_out
+
+_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS tag_changes_tag_ai AFTER INSERT ON server_tags BEGIN
+        INSERT INTO tag_changes (server_id, tag, op) VALUES (new.server_id, new.tag, '+');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tag_changes_tag_ad AFTER DELETE ON server_tags BEGIN
+        INSERT INTO tag_changes (server_id, tag, op) VALUES (old.server_id, old.tag, '-');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tag_changes_tag_au AFTER UPDATE ON server_tags BEGIN
+        INSERT INTO tag_changes (server_id, tag, op) VALUES (old.server_id, old.tag, '-');
+        INSERT INTO tag_changes (server_id, tag, op) VALUES (new.server_id, new.tag, '+');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tag_changes_server_ai AFTER INSERT ON servers BEGIN
+        INSERT INTO tag_changes (server_id, tag, op) VALUES (new.id, NULL, '+');
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tag_changes_server_ad AFTER DELETE ON servers BEGIN
+        INSERT INTO tag_changes (server_id, tag, op) VALUES (old.id, NULL, '-');
+    END""",
+]
+
+TOKEN = re.compile(r"\(|\)|[^\s()]+")
+
+
+def ensure_tag_index(engine):
+    """Create the change-log triggers and drop the log; running indexes rebuild when they see the gap"""
+    with engine.begin() as conn:
+        for ddl in _TRIGGERS:
+            conn.execute(text(ddl))
+        conn.execute(text("DELETE FROM tag_changes WHERE seq < (SELECT max(seq) FROM tag_changes)"))
+
+
+def parse(expression: str):
+    """Parse into nested ('tag', name) / ('not', x) / ('and', [..]) / ('or', [..]) tuples"""
+    tokens = TOKEN.findall(expression)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        terms = [parse_and()]
+        while peek() is not None and peek().upper() == "OR":
+            take()
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else ("or", terms)
+
+    def parse_and():
+        factors = [parse_not()]
+        while peek() is not None and peek() != ")" and peek().upper() != "OR":
+            if peek().upper() == "AND":
+                take()
+            factors.append(parse_not())
+        return factors[0] if len(factors) == 1 else ("and", factors)
+
+    def parse_not():
+        token = peek()
+        if token is None:
+            raise ValueError("expression ends unexpectedly")
+        if token.upper() == "NOT":
+            take()
+            return ("not", parse_not())
+        if token == "(":
+            take()
+            node = parse_or()
+            if peek() != ")":
+                raise ValueError("missing closing parenthesis")
+            take()
+            return node
+        if token == ")" or token.upper() in ("AND", "OR"):
+            raise ValueError(f"unexpected {token!r}")
+        return ("tag", take())
+
+    if not tokens:
+        raise ValueError("empty expression")
+    node = parse_or()
+    if position != len(tokens):
+        raise ValueError(f"unexpected {tokens[position]!r}")
+    return node
+
+
+def _to_bitmap(ids) -> int:
+    ids = np.asarray(ids, dtype=np.int64)
+    if ids.size == 0:
+        return 0
+    bits = np.zeros(int(ids.max()) + 1, dtype=bool)
+    bits[ids] = True
+    return int.from_bytes(np.packbits(bits, bitorder="little").tobytes(), "little")
+
+
+def bitmap_ids(bitmap: int) -> np.ndarray:
+    """Set bits of a bitmap as a sorted array of server ids"""
+    if bitmap <= 0:
+        return np.array([], dtype=np.int64)
+    raw = np.frombuffer(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder="little"))
+
+
+class TagIndex:
+    def __init__(self):
+        self.seq = None
+        self.bitmaps = {}
+        self.universe = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, db: Session):
+        """Catch up with tag_changes; rebuilds from the tables on first use or after a gap"""
+        latest = db.query(func.max(models.TagChange.seq)).scalar() or 0
+        with self._lock:
+            if latest == self.seq:
+                return
+            oldest = db.query(func.min(models.TagChange.seq)).scalar()
+            if self.seq is None or (oldest is not None and oldest > self.seq + 1) or latest < self.seq:
+                self._rebuild(db, latest)
+                return
+            for server_id, tag, op in db.query(models.TagChange.server_id, models.TagChange.tag, models.TagChange.op).filter(
+                    models.TagChange.seq > self.seq, models.TagChange.seq <= latest).order_by(models.TagChange.seq):
+                bit = 1 << server_id
+                if tag is None:
+                    self.universe = self.universe | bit if op == "+" else self.universe & ~bit
+                else:
+                    current = self.bitmaps.get(tag, 0)
+                    self.bitmaps[tag] = current | bit if op == "+" else current & ~bit
+            self.seq = latest
+
+    def _rebuild(self, db: Session, latest: int):
+        # Plain DBAPI cursor, as in analytics: the whole table is read on a rebuild
+        cursor = db.connection().connection.driver_connection.cursor()
+        try:
+            by_tag = {}
+            for tag, server_id in cursor.execute("SELECT tag, server_id FROM server_tags"):
+                by_tag.setdefault(tag, []).append(server_id)
+            self.bitmaps = {tag: _to_bitmap(ids) for tag, ids in by_tag.items()}
+            self.universe = _to_bitmap([server_id for (server_id,) in cursor.execute("SELECT id FROM servers")])
+        finally:
+            cursor.close()
+        self.seq = latest
+
+    def evaluate(self, node) -> int:
+        kind, value = node
+        if kind == "tag":
+            # Matching is case-sensitive, like the stored tags
+            return self.bitmaps.get(value, 0) & self.universe
+        if kind == "not":
+            return self.universe & ~self.evaluate(value)
+        results = [self.evaluate(child) for child in value]
+        combined = results[0]
+        for result in results[1:]:
+            combined = combined & result if kind == "and" else combined | result
+        return combined
+
+    def counts(self) -> dict:
+        return {tag: (bitmap & self.universe).bit_count() for tag, bitmap in sorted(self.bitmaps.items())
+                if bitmap & self.universe}
+
+
+# One index per database, by file path
+tag_indexes = {path: TagIndex() for path in sessions}
+tag_index = tag_indexes[DATABASE_PATH]
+
+
+def index_for(db: Session) -> TagIndex:
+    index = tag_indexes[db.get_bind().url.database]
+    index.refresh(db)
+    return index
+
+
+def _evaluate(db: Session, node) -> int:
+    return index_for(db).evaluate(node)
+
+
+def select_server_ids(db: Session, expression: str) -> np.ndarray:
+    """Server ids matching a tag expression; raises ValueError for a malformed one"""
+    node = parse(expression)
+    if SHARDED:
+        return bitmap_ids(reduce(or_, fan_out(_evaluate, node)))
+    return bitmap_ids(_evaluate(db, node))
+
+
+def _counts(db: Session) -> dict:
+    return index_for(db).counts()
+
+
+router = APIRouter()
+
+@router.get("/tags")
+def list_tags(db: Session = Depends(get_db)):
+    counts = sum(map(Counter, fan_out(_counts)), Counter()) if SHARDED else _counts(db)
+    return [{"tag": tag, "servers": count} for tag, count in sorted(counts.items())]
+
+@router.get("/tags/select")
+def select_by_tags(
+    q: str,
+    limit: Optional[int] = Query(None, ge=1),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+):
+    try:
+        ids = select_server_ids(db, q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid tag expression: {e}")
+    page = ids[offset:offset + limit] if limit else ids[offset:]
+    return {"query": q, "total": int(ids.size), "offset": offset, "server_ids": page.tolist()}
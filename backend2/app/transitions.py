@@ -0,0 +1,261 @@
+"""
+Status transitions with optimistic concurrency.
+
+Every change to a server's status goes through `transition_status`, which
+appends a new history row instead of editing the current one in place. The
+swap is a compare-and-swap on the current row's `version`: the old row is
+only retired if it is still current and still at the version the writer read,
+so two concurrent writers can never both win, and a partial unique index
+guarantees at most one `is_current` row per server. Allowed moves follow the
+migration lifecycle:
+
+    Ready -> Running -> Passed/Failed -> Migrated -> Completed
+
+`transition_many` applies one change to a whole selection with the same
+rules, but as a fixed handful of set-based statements in a single
+transaction, so 10,000 servers cost about as much as ten.
+"""
+
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from . import models
+from .crud import upsert_current_status
+
+STATUS_FIELDS = ("migration_status", "precheck_status", "postcheck_status", "issue_summary")
+
+# Check fields (precheck_status/postcheck_status)
+NOT_RUN = (None, "Not Started", "N/A")
+CHECK_RESULTS = ("Passed", "Failed", "Warning", "Cancelled")
+CHECK_TRANSITIONS = {
+    **{state: {"Running"} for state in NOT_RUN},
+    "Running": set(CHECK_RESULTS),
+    **{state: {"Running"} for state in CHECK_RESULTS},
+}
+
+MIGRATION_TRANSITIONS = {
+    "Ready": {"Migrated", "Blocked"},
+    "Blocked": {"Ready"},
+    "Migrated": {"Completed", "Failed"},
+    "Failed": {"Ready"},
+    "Completed": set(),
+}
+
+
+class StatusConflict(Exception):
+    """The current status changed since the writer read it"""
+
+
+class InvalidTransition(Exception):
+    """The requested change is not allowed by the lifecycle"""
+
+
+def can_transition(field: str, old: Optional[str], new: Optional[str]) -> bool:
+    if old == new:
+        return True
+    if field == "migration_status":
+        return new in MIGRATION_TRANSITIONS.get(old, set())
+    # A finished (or never run) check can be reset, a running one can only finish
+    if new in NOT_RUN:
+        return old != "Running"
+    return new in CHECK_TRANSITIONS.get(old, set())
+
+
+def validate_transition(current: Optional[models.ServerStatus], changes: dict):
+    for field in ("migration_status", "precheck_status", "postcheck_status"):
+        if field not in changes:
+            continue
+        old = getattr(current, field) if current is not None else None
+        if current is None and field == "migration_status":
+            continue
+        if not can_transition(field, old, changes[field]):
+            raise InvalidTransition(f"{field} cannot move from {old!r} to {changes[field]!r}")
+
+
+def get_current(db: Session, server_id: int) -> Optional[models.ServerStatus]:
+    return db.query(models.ServerStatus).filter_by(server_id=server_id, is_current=True).first()
+
+
+def transition_status(db: Session, server_id: int, changes: dict, expected_version: int = None,
+                      commit: bool = True) -> models.ServerStatus:
+    """Append a new current status row for the server with `changes` applied.
+
+    Raises StatusConflict when `expected_version` is stale or another writer
+    won the race, and InvalidTransition when the lifecycle forbids the change.
+    """
+    current = get_current(db, server_id)
+    if expected_version is not None and (current is None or current.version != expected_version):
+        raise StatusConflict(f"Server {server_id} status is at version "
+                             f"{current.version if current else None}, expected {expected_version}")
+    validate_transition(current, changes)
+
+    values = {field: getattr(current, field) if current is not None else None for field in STATUS_FIELDS}
+    values.update({field: changes[field] for field in STATUS_FIELDS if field in changes})
+    values["migration_status"] = values["migration_status"] or "Ready"
+    try:
+        if current is not None:
+            # The compare-and-swap: retire the row only if nobody else has
+            retired = db.query(models.ServerStatus).filter_by(
+                id=current.id, version=current.version, is_current=True
+            ).update({"is_current": False}, synchronize_session=False)
+            if retired != 1:
+                raise StatusConflict(f"Server {server_id} status changed concurrently")
+        new_status = models.ServerStatus(
+            server_id=server_id,
+            last_checked=changes.get("last_checked") or datetime.utcnow(),
+            version=(current.version if current is not None else 0) + 1,
+            is_current=True,
+            **values,
+        )
+        db.add(new_status)
+        upsert_current_status(db, new_status)
+        if commit:
+            db.commit()
+    except StatusConflict:
+        db.rollback()
+        raise
+    except (IntegrityError, OperationalError) as e:
+        # Unique current-row index or a write lock lost to a concurrent writer
+        db.rollback()
+        raise StatusConflict(f"Server {server_id} status changed concurrently") from e
+    return new_status
+
+
+def begin_check(db: Session, server_id: int, check_type: str) -> Optional[models.ServerStatus]:
+    """Move the server's check to Running; a check that is already Running is left as is"""
+    field = f"{check_type}_status"
+    current = get_current(db, server_id)
+    if current is not None and getattr(current, field) == "Running":
+        return current
+    return transition_status(db, server_id, {field: "Running", "issue_summary": None},
+                             expected_version=current.version if current is not None else None)
+
+
+def complete_check(db: Session, server_id: int, check_type: str, result: str, issue_summary: str = None,
+                   retries: int = 3) -> Optional[models.ServerStatus]:
+    """Record a check result; a passed precheck marks the server Migrated, a passed postcheck Completed.
+
+    If the status moved on while the check ran (for example an operator blocked
+    the server), the result is re-applied on top of the newer version as long as
+    the check is still Running, otherwise it is dropped and None is returned.
+    """
+    field = f"{check_type}_status"
+    for _ in range(retries):
+        current = get_current(db, server_id)
+        if current is None or getattr(current, field) != "Running":
+            return None
+        changes = {field: result, "issue_summary": issue_summary}
+        target = "Migrated" if check_type == "precheck" else "Completed"
+        if result == "Passed" and can_transition("migration_status", current.migration_status, target):
+            changes["migration_status"] = target
+        try:
+            return transition_status(db, server_id, changes, expected_version=current.version)
+        except StatusConflict:
+            db.expire_all()
+    raise StatusConflict(f"Server {server_id}: could not record {check_type} result after {retries} attempts")
+
+
+def _plan_batch(db: Session, server_ids: List[int], changes: dict, expected_versions: Dict[int, int]):
+    """Validate every server against its current row; returns (outcomes, rows to write)"""
+    # One row per existing server; the status columns are NULL when it has no status yet
+    rows = {row.server_id: row for row in db.execute(text(
+        f"SELECT sv.id AS server_id, s.id, s.version, {', '.join('s.' + f for f in STATUS_FIELDS)} "
+        "FROM servers sv LEFT JOIN server_status s ON s.server_id = sv.id AND s.is_current = 1 "
+        "WHERE sv.id IN (SELECT value FROM json_each(:ids))"), {"ids": json.dumps(server_ids)})}
+
+    outcomes, targets = [], []
+    for server_id in server_ids:
+        outcome = {"server_id": server_id, "outcome": "updated", "version": None, "detail": None}
+        outcomes.append(outcome)
+        if server_id not in rows:
+            outcome.update(outcome="not_found", detail="No such server")
+            continue
+        row = rows[server_id] if rows[server_id].id is not None else None
+        version = outcome["version"] = row.version if row is not None else None
+        expected = expected_versions.get(server_id)
+        if expected is not None and version != expected:
+            outcome.update(outcome="conflict", detail=f"Status is at version {version}, expected {expected}")
+            continue
+        try:
+            validate_transition(row, changes)
+        except InvalidTransition as e:
+            outcome.update(outcome="invalid", detail=str(e))
+            continue
+        if row is not None and all(getattr(row, field) == value for field, value in changes.items()):
+            outcome["outcome"] = "unchanged"
+            continue
+        targets.append([server_id, row.id if row is not None else None])
+    return outcomes, targets
+
+
+def _apply_batch(db: Session, targets: List[list], changes: dict, now: datetime):
+    retiring = [status_id for _, status_id in targets if status_id is not None]
+    if retiring:
+        # Same compare-and-swap as transition_status: history rows never change, so a
+        # row that is still current is still at the version that was validated
+        retired = db.execute(text(
+            "UPDATE server_status SET is_current = 0 "
+            "WHERE is_current = 1 AND id IN (SELECT value FROM json_each(:ids))"
+        ), {"ids": json.dumps(retiring)}).rowcount
+        if retired != len(retiring):
+            raise StatusConflict("Status changed concurrently for part of the batch")
+
+    selected = [f":{field}" if field in changes else f"s.{field}" for field in STATUS_FIELDS]
+    selected[0] = f"COALESCE({selected[0]}, 'Ready')"
+    params = {field: changes[field] for field in STATUS_FIELDS if field in changes}
+    db.execute(text(
+        f"INSERT INTO server_status (server_id, {', '.join(STATUS_FIELDS)}, last_checked, version, is_current) "
+        f"SELECT t.server_id, {', '.join(selected)}, :now, COALESCE(s.version, 0) + 1, 1 "
+        "FROM (SELECT json_extract(value, '$[0]') AS server_id, json_extract(value, '$[1]') AS status_id "
+        "      FROM json_each(:targets)) t "
+        "LEFT JOIN server_status s ON s.id = t.status_id"
+    ).bindparams(bindparam("now", type_=DateTime)), {**params, "now": now, "targets": json.dumps(targets)})
+
+    # Mirror into the read model, as upsert_current_status does for one server
+    mirrored = ("migration_status", "precheck_status", "postcheck_status", "issue_summary", "last_checked", "version")
+    db.execute(text(
+        f"INSERT INTO server_current_status (server_id, status_id, {', '.join(mirrored)}) "
+        f"SELECT server_id, id, {', '.join(mirrored)} FROM server_status "
+        "WHERE is_current = 1 AND server_id IN (SELECT value FROM json_each(:ids)) "
+        "ON CONFLICT (server_id) DO UPDATE SET status_id = excluded.status_id, "
+        + ", ".join(f"{field} = excluded.{field}" for field in mirrored)
+    ), {"ids": json.dumps([server_id for server_id, _ in targets])})
+
+
+def transition_many(db: Session, server_ids: Iterable[int], changes: dict,
+                    expected_versions: Dict[int, int] = None, atomic: bool = False,
+                    retries: int = 3) -> List[dict]:
+    """Apply `changes` to every server in one transaction; returns one outcome per server.
+
+    Outcomes are updated, unchanged, invalid (lifecycle), conflict (stale
+    expected version) or not_found. Servers that cannot move are reported and
+    the rest are still written, unless `atomic` is set, in which case nothing
+    is written and the would-be updates are reported as aborted.
+    """
+    server_ids = list(dict.fromkeys(int(server_id) for server_id in server_ids))
+    for _ in range(retries):
+        outcomes, targets = _plan_batch(db, server_ids, changes, expected_versions or {})
+        failed = any(o["outcome"] not in ("updated", "unchanged") for o in outcomes)
+        if not targets or (atomic and failed):
+            db.rollback()
+            for outcome in outcomes:
+                if outcome["outcome"] == "updated":
+                    outcome["outcome"] = "aborted"
+            return outcomes
+        try:
+            _apply_batch(db, targets, changes, changes.get("last_checked") or datetime.utcnow())
+            db.commit()
+        except (StatusConflict, IntegrityError, OperationalError):
+            # A concurrent writer got in between; plan again against the new state
+            db.rollback()
+            continue
+        for outcome in outcomes:
+            if outcome["outcome"] == "updated":
+                outcome["version"] = (outcome["version"] or 0) + 1
+        return outcomes
+    raise StatusConflict(f"Could not apply the batch after {retries} attempts")
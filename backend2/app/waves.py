@@ -0,0 +1,441 @@
+"""
+Migration waves.
+
+The planner splits the Ready servers into waves, one group per environment,
+owner or tag value, with at most `max_servers_per_wave` servers each. Once a
+wave is started, the runner drives every server through
+
+    Precheck -> Migrating -> Postcheck -> Completed (or Failed at any step)
+
+queueing its checks as jobs (see jobs.py) and recording a `Migration` row
+with started_at/completed_at. Waves and their servers live in the main
+database; the checks, jobs and migrations of a server go to the database
+that holds it (see shards.py). The checks run on the job workers, so they can
+be cancelled with `/jobs/{id}/cancel` (the server then fails its wave) and
+outlive a restart: an interrupted precheck goes back to Pending and picks up
+its job again, and a postcheck is settled from its job by whichever process
+sees it finish. At most `max_parallel` servers of a wave are in flight at a
+time: a server is admitted with one conditional UPDATE that also counts the
+wave's in-flight servers, so the cap holds across API processes, and a
+finished server immediately frees its slot for the next one.
+"""
+
+import os
+import shlex
+import subprocess
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, or_, and_, text
+from sqlalchemy.orm import Session
+
+from . import models, schemas
+from .database import SHARDED, SessionLocal, get_db, session_for_server, sessions, shard_of
+from .jobs import ACTIVE_STATUSES, enqueue_check
+from .shards import fan_out, merge
+from .transitions import transition_status
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = float(os.getenv("WAVE_POLL_SECONDS", "5"))
+MAX_WORKERS = int(os.getenv("WAVE_MAX_WORKERS", "8"))
+# Shell command that performs the migration, e.g. "moveme migrate --host {ip_address}";
+# without one the migration step is simulated
+MIGRATION_COMMAND = os.getenv("MIGRATION_COMMAND")
+MIGRATION_TIMEOUT_SECONDS = int(os.getenv("MIGRATION_TIMEOUT_SECONDS", "7200"))
+SIMULATED_MIGRATION_SECONDS = float(os.getenv("SIMULATED_MIGRATION_SECONDS", "5"))
+# How often a server's driver looks at its check job
+JOB_WATCH_SECONDS = 1.0
+# Throughput is measured over this trailing window
+THROUGHPUT_WINDOW = timedelta(hours=1)
+
+IN_FLIGHT = ("Precheck", "Migrating", "Postcheck")
+FINISHED = ("Completed", "Failed")
+NO_GROUP = "(none)"
+
+
+def unchecked_references(db: Session) -> Session:
+    """With shards, wave rows and migrations refer to servers, migrations and waves in other
+    databases, which SQLite cannot check; turn its foreign key checks off for this session"""
+    if SHARDED:
+        db.execute(text("PRAGMA foreign_keys = OFF"))
+    return db
+
+
+def _ready_servers(db: Session, request: schemas.WavePlanRequest) -> List[tuple]:
+    """(server id, group) of one database's Ready servers, by id"""
+    cs = models.CurrentStatus
+    query = db.query(models.Server).outerjoin(cs, cs.server_id == models.Server.id).filter(
+        or_(cs.migration_status == "Ready", cs.server_id == None),
+    )
+    if request.environment:
+        query = query.filter(models.Server.environment == request.environment)
+    servers = query.order_by(models.Server.id).all()
+    if request.group_by == "tag":
+        tags = {}
+        for server_id, tag in db.query(models.ServerTag.server_id, models.ServerTag.tag).order_by(models.ServerTag.tag):
+            # A server with several tags goes with its first tag alphabetically
+            tags.setdefault(server_id, tag)
+        return [(server.id, tags.get(server.id, NO_GROUP)) for server in servers]
+    return [(server.id, getattr(server, request.group_by) or NO_GROUP) for server in servers]
+
+
+def plan_waves(db: Session, request: schemas.WavePlanRequest) -> List[models.MigrationWave]:
+    """Partition the Ready servers of every database that are not already in an unfinished wave"""
+    unchecked_references(db)
+    busy = {server_id for (server_id,) in db.query(models.WaveServer.server_id).join(models.MigrationWave).filter(
+        models.MigrationWave.status.in_(("Planned", "In Progress")),
+        models.WaveServer.stage.notin_(FINISHED),
+    )}
+    groups = {}
+    for server_id, key in merge(fan_out(_ready_servers, request), key=lambda server: server[0]):
+        if server_id not in busy:
+            groups.setdefault(key, []).append(server_id)
+
+    now = datetime.utcnow()
+    waves = []
+    for key in sorted(groups):
+        ids = groups[key]
+        chunks = [ids[i:i + request.max_servers_per_wave] for i in range(0, len(ids), request.max_servers_per_wave)]
+        for n, chunk in enumerate(chunks, start=1):
+            wave = models.MigrationWave(
+                name=f"{key} Wave {n}" if len(chunks) > 1 else f"{key} Wave",
+                group_by=request.group_by,
+                group_value=key,
+                max_parallel=request.max_parallel,
+                status="Planned",
+                servers_total=len(chunk),
+                created_at=now,
+            )
+            wave.servers = [models.WaveServer(server_id=server_id, position=i, stage="Pending")
+                            for i, server_id in enumerate(chunk)]
+            waves.append(wave)
+    if not request.dry_run:
+        db.add_all(waves)
+        db.commit()
+    return waves
+
+
+def wave_progress(db: Session, wave: models.MigrationWave, now: datetime = None) -> dict:
+    """Stage counts, servers finished per hour over the trailing window, and the resulting ETA"""
+    now = now or datetime.utcnow()
+    ws = models.WaveServer
+    counts = dict(db.query(ws.stage, func.count()).filter(ws.wave_id == wave.id).group_by(ws.stage).all())
+    progress = {
+        "pending": counts.get("Pending", 0),
+        "in_flight": sum(counts.get(stage, 0) for stage in IN_FLIGHT),
+        "completed": counts.get("Completed", 0),
+        "failed": counts.get("Failed", 0),
+        "throughput_per_hour": None,
+        "eta": None,
+    }
+    if wave.started_at is None:
+        return progress
+    since = max(wave.started_at, now - THROUGHPUT_WINDOW)
+    elapsed_hours = (now - since).total_seconds() / 3600
+    finished = db.query(func.count()).filter(
+        ws.wave_id == wave.id, ws.stage.in_(FINISHED), ws.finished_at >= since).scalar()
+    if elapsed_hours > 0 and finished:
+        rate = finished / elapsed_hours
+        progress["throughput_per_hour"] = round(rate, 2)
+        remaining = progress["pending"] + progress["in_flight"]
+        if wave.status == "In Progress" and remaining:
+            progress["eta"] = now + timedelta(hours=remaining / rate)
+    return progress
+
+
+def claim_next_server(db: Session, wave: models.MigrationWave) -> Optional[int]:
+    """Move the wave's next Pending server to Precheck if the wave is under its parallelism cap"""
+    ws = models.WaveServer
+    while True:
+        candidate = db.query(ws.server_id).filter(ws.wave_id == wave.id, ws.stage == "Pending").order_by(
+            ws.position).limit(1).scalar()
+        if candidate is None:
+            return None
+        in_flight = db.query(func.count()).select_from(ws).filter(
+            ws.wave_id == wave.id, ws.stage.in_(IN_FLIGHT)).scalar_subquery()
+        claimed = db.query(ws).filter(
+            ws.wave_id == wave.id, ws.server_id == candidate, ws.stage == "Pending", in_flight < wave.max_parallel,
+        ).update({"stage": "Precheck", "started_at": datetime.utcnow()}, synchronize_session=False)
+        db.commit()
+        if claimed == 1:
+            return candidate
+        # Either another process took this server (try the next one) or the wave is full
+        if db.query(ws.stage).filter(ws.wave_id == wave.id, ws.server_id == candidate).scalar() == "Pending":
+            return None
+
+
+def finish_wave_if_done(db: Session, wave: models.MigrationWave) -> bool:
+    ws = models.WaveServer
+    open_servers = db.query(func.count()).filter(ws.wave_id == wave.id, ws.stage.notin_(FINISHED)).scalar()
+    if open_servers:
+        return False
+    db.query(models.MigrationWave).filter_by(id=wave.id, status="In Progress").update(
+        {"status": "Completed", "finished_at": datetime.utcnow()})
+    db.commit()
+    return True
+
+
+def recover_interrupted_waves(db: Session):
+    """Servers cut off mid-wave: prechecks start over (reusing a job still queued), postchecks with a
+    job are settled when it finishes, and a server cut off mid-migration fails"""
+    ws = models.WaveServer
+    db.query(ws).filter(ws.stage == "Precheck").update({"stage": "Pending", "started_at": None, "job_id": None})
+    interrupted = db.query(ws).filter(or_(ws.stage == "Migrating", and_(ws.stage == "Postcheck", ws.job_id == None))).all()
+    now = datetime.utcnow()
+    for entry in interrupted:
+        entry.stage, entry.finished_at, entry.error = "Failed", now, "interrupted by restart"
+        if entry.migration_id:
+            server_db = session_for_server(entry.server_id)
+            try:
+                server_db.query(models.Migration).filter_by(id=entry.migration_id, status="running").update(
+                    {"status": "failed", "completed_at": now, "notes": "interrupted by restart"})
+                server_db.commit()
+            finally:
+                server_db.close()
+    db.commit()
+
+
+def migrate_server(server: models.Server):
+    """Perform the migration itself; raises on failure"""
+    if not MIGRATION_COMMAND:
+        time.sleep(SIMULATED_MIGRATION_SECONDS)
+        return
+    command = MIGRATION_COMMAND.format(name=shlex.quote(server.name), ip_address=shlex.quote(server.ip_address))
+    result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=MIGRATION_TIMEOUT_SECONDS)
+    if result.returncode != 0:
+        raise RuntimeError((result.stderr or result.stdout).strip()[-500:] or f"exit code {result.returncode}")
+
+
+def job_outcome(db: Session, job_id: int) -> Optional[str]:
+    """None while the job is queued or running, else the check result ("did not run" when it failed)"""
+    status, result = db.query(models.CheckJob.status, models.CheckJob.result).filter_by(id=job_id).one()
+    # Ends the read transaction, so a long wait does not hold on to one snapshot
+    db.rollback()
+    if status in ACTIVE_STATUSES:
+        return None
+    if status == "cancelled":
+        return "Cancelled"
+    return result if status == "succeeded" and result else "did not run"
+
+
+def _run_check(db: Session, server_db: Session, wave_id: int, server_id: int, check_type: str) -> str:
+    """Queue the check in the server's database, note its job on the wave server and wait for a worker
+    to finish it"""
+    job_id = enqueue_check(server_db, server_id, check_type).id
+    db.query(models.WaveServer).filter_by(wave_id=wave_id, server_id=server_id).update({"job_id": job_id})
+    db.commit()
+    while True:
+        outcome = job_outcome(server_db, job_id)
+        if outcome is not None:
+            return outcome
+        time.sleep(JOB_WATCH_SECONDS)
+
+
+def settle_postcheck(db: Session, server_db: Session, wave_id: int, server_id: int, migration_id: Optional[int],
+                     postcheck: str):
+    """Finish a server from its postcheck result; only the first caller for a server does anything.
+    The migration (in the server's database) is settled before the wave server, so a settle cut
+    short in between is finished by the next caller."""
+    ws = models.WaveServer
+    now = datetime.utcnow()
+    passed = postcheck == "Passed"
+    values = {"stage": "Completed" if passed else "Failed", "finished_at": now}
+    if not passed:
+        values["error"] = f"postcheck {postcheck}"
+    if migration_id is not None:
+        server_db.query(models.Migration).filter_by(id=migration_id, status="running").update(
+            {"status": "completed", "completed_at": now} if passed else
+            {"status": "failed", "completed_at": now, "notes": values["error"]})
+        server_db.commit()
+    settled = db.query(ws).filter_by(wave_id=wave_id, server_id=server_id, stage="Postcheck").update(values)
+    db.commit()
+    if settled == 1 and not passed:
+        transition_status(server_db, server_id, {"migration_status": "Failed"})
+
+
+def settle_orphaned_postchecks(db: Session):
+    """Postchecks whose driver went away with a restart, settled from their finished jobs (a live
+    driver settling the same server at the same time is harmless)"""
+    ws = models.WaveServer
+    rows = db.query(ws.wave_id, ws.server_id, ws.migration_id, ws.job_id).filter(
+        ws.stage == "Postcheck", ws.job_id != None).all()
+    server_dbs = {}
+    try:
+        for wave_id, server_id, migration_id, job_id in rows:
+            path = shard_of(server_id)
+            if path not in server_dbs:
+                server_dbs[path] = sessions[path]()
+            outcome = job_outcome(server_dbs[path], job_id)
+            if outcome is not None:
+                settle_postcheck(db, server_dbs[path], wave_id, server_id, migration_id, outcome)
+    finally:
+        for server_db in server_dbs.values():
+            server_db.close()
+
+
+def drive_server(wave_id: int, server_id: int):
+    """Take one claimed server through precheck, migration and postcheck"""
+    db = unchecked_references(SessionLocal())
+    server_db = unchecked_references(session_for_server(server_id))
+    ws = models.WaveServer
+
+    def set_stage(stage: str, **values):
+        if stage in FINISHED:
+            values["finished_at"] = datetime.utcnow()
+        db.query(ws).filter_by(wave_id=wave_id, server_id=server_id).update({"stage": stage, **values})
+        db.commit()
+
+    migration = None
+    try:
+        precheck = _run_check(db, server_db, wave_id, server_id, "precheck")
+        if precheck != "Passed":
+            set_stage("Failed", error=f"precheck {precheck}")
+            return
+
+        migration = models.Migration(server_id=server_id, wave_id=wave_id, started_at=datetime.utcnow(),
+                                     status="running")
+        server_db.add(migration)
+        server_db.commit()
+        set_stage("Migrating", migration_id=migration.id)
+        migrate_server(server_db.get(models.Server, server_id))
+
+        set_stage("Postcheck", job_id=None)
+        postcheck = _run_check(db, server_db, wave_id, server_id, "postcheck")
+        settle_postcheck(db, server_db, wave_id, server_id, migration.id, postcheck)
+    except Exception as e:
+        logger.exception("Wave %s: server %s failed", wave_id, server_id)
+        db.rollback()
+        server_db.rollback()
+        if migration is not None and migration.id is not None:
+            server_db.query(models.Migration).filter_by(id=migration.id).update(
+                {"status": "failed", "completed_at": datetime.utcnow(), "notes": str(e)[:500]})
+            server_db.commit()
+        set_stage("Failed", error=str(e)[:500])
+    finally:
+        server_db.close()
+        db.close()
+
+
+class WaveRunner:
+    def __init__(self, max_workers: int = MAX_WORKERS, poll_seconds: float = POLL_SECONDS):
+        self.poll_seconds = poll_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="wave")
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="wave-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.tick()
+            except Exception:
+                logger.exception("Wave runner tick failed")
+            self._wake.wait(self.poll_seconds)
+
+    def tick(self):
+        """Fill every running wave up to its parallelism cap and close finished ones"""
+        db = SessionLocal()
+        try:
+            # Cancelled waves too: their servers in flight still finish
+            settle_orphaned_postchecks(db)
+            for wave in db.query(models.MigrationWave).filter_by(status="In Progress").all():
+                if finish_wave_if_done(db, wave):
+                    continue
+                while not self._stop.is_set():
+                    server_id = claim_next_server(db, wave)
+                    if server_id is None:
+                        break
+                    future = self._executor.submit(drive_server, wave.id, server_id)
+                    future.add_done_callback(lambda _: self.wake())
+        finally:
+            db.close()
+
+
+wave_runner = WaveRunner()
+
+
+def _with_progress(db: Session, wave: models.MigrationWave, model=schemas.MigrationWave) -> dict:
+    return {**model.model_validate(wave).model_dump(), "progress": wave_progress(db, wave)}
+
+
+def _get_wave(db: Session, wave_id: int) -> models.MigrationWave:
+    wave = db.get(models.MigrationWave, wave_id)
+    if not wave:
+        raise HTTPException(status_code=404, detail="Wave not found")
+    return wave
+
+
+router = APIRouter()
+
+@router.post("/waves/plan", response_model=List[schemas.MigrationWave])
+def plan(request: schemas.WavePlanRequest, db: Session = Depends(get_db)):
+    return plan_waves(db, request)
+
+@router.get("/waves", response_model=List[schemas.MigrationWave])
+def list_waves(db: Session = Depends(get_db)):
+    waves = db.query(models.MigrationWave).order_by(models.MigrationWave.id.desc()).all()
+    return [_with_progress(db, wave) for wave in waves]
+
+@router.get("/waves/{wave_id}", response_model=schemas.MigrationWaveDetail)
+def get_wave(wave_id: int, db: Session = Depends(get_db)):
+    return _with_progress(db, _get_wave(db, wave_id), schemas.MigrationWaveDetail)
+
+@router.post("/waves/{wave_id}/start", response_model=schemas.MigrationWave)
+def start_wave(wave_id: int, db: Session = Depends(get_db)):
+    wave = _get_wave(db, wave_id)
+    started = db.query(models.MigrationWave).filter_by(id=wave_id, status="Planned").update(
+        {"status": "In Progress", "started_at": datetime.utcnow()})
+    db.commit()
+    if started != 1:
+        raise HTTPException(status_code=409, detail=f"Wave is {wave.status}")
+    wave_runner.wake()
+    db.refresh(wave)
+    return _with_progress(db, wave)
+
+@router.post("/waves/{wave_id}/cancel", response_model=schemas.MigrationWave)
+def cancel_wave(wave_id: int, db: Session = Depends(get_db)):
+    """Stop admitting servers; the ones already in flight finish their pipeline"""
+    wave = _get_wave(db, wave_id)
+    cancelled = db.query(models.MigrationWave).filter(
+        models.MigrationWave.id == wave_id, models.MigrationWave.status.in_(("Planned", "In Progress")),
+    ).update({"status": "Cancelled", "finished_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    if cancelled != 1:
+        raise HTTPException(status_code=409, detail=f"Wave is {wave.status}")
+    db.refresh(wave)
+    return _with_progress(db, wave)
+
+@router.delete("/waves/{wave_id}")
+def delete_wave(wave_id: int, db: Session = Depends(get_db)):
+    wave = _get_wave(db, wave_id)
+    if wave.status != "Planned":
+        raise HTTPException(status_code=409, detail="Only planned waves can be deleted")
+    db.query(models.WaveServer).filter_by(wave_id=wave_id).delete()
+    db.delete(wave)
+    db.commit()
+    return {"message": "Wave deleted"}
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Batch status update benchmark
+Marks selections of 10 to 10,000 servers Blocked and back to Ready with
+transition_many, and times the same change done one transition_status call
+per server for comparison (the per-server loop is skipped above 1,000).
+
+    python benchmarks/batch_status.py --servers 20000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def seed(engine, servers: int):
+    now = datetime.utcnow()
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, created_at) VALUES (?, ?, ?, 'Production', ?)",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", now) for i in range(1, servers + 1)),
+        )
+        cur.executemany(
+            "INSERT INTO server_status (server_id, migration_status, last_checked, version, is_current) "
+            "VALUES (?, 'Ready', ?, 1, 1)", ((i, now) for i in range(1, servers + 1)))
+        cur.execute(
+            "INSERT INTO server_current_status (server_id, status_id, migration_status, last_checked, version) "
+            "SELECT server_id, id, migration_status, last_checked, version FROM server_status")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=20_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["INFRA_NOVA_DB"] = os.path.join(tmp, "bench.db")
+        from app.database import Base, SessionLocal, engine
+        from app.transitions import transition_many, transition_status
+
+        Base.metadata.create_all(bind=engine)
+        seed(engine, args.servers)
+
+        db = SessionLocal()
+        try:
+            for size in (10, 100, 1000, 10_000):
+                ids = range(1, min(size, args.servers) + 1)
+                t0 = time.perf_counter()
+                outcomes = transition_many(db, ids, {"migration_status": "Blocked", "issue_summary": "change freeze"})
+                batch = (time.perf_counter() - t0) * 1000
+                assert all(o["outcome"] == "updated" for o in outcomes)
+                transition_many(db, ids, {"migration_status": "Ready", "issue_summary": None})
+
+                loop = "skipped"
+                if size <= 1000:
+                    t0 = time.perf_counter()
+                    for server_id in ids:
+                        transition_status(db, server_id, {"migration_status": "Blocked", "issue_summary": "change freeze"})
+                    loop = f"{(time.perf_counter() - t0) * 1000:8.1f} ms"
+                    transition_many(db, ids, {"migration_status": "Ready", "issue_summary": None})
+                print(f"{size:>6} servers: batch {batch:7.1f} ms, one call per server {loop}")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
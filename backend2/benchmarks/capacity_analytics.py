@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Fleet capacity analytics benchmark
+Seeds a scratch database with N servers (two tags each, memory and two disk
+series) and times /analytics/capacity's report for each grouping. The report
+should stay well under a second at 100k servers.
+
+    python benchmarks/capacity_analytics.py --servers 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+ENVIRONMENTS = ["Production", "UAT", "Development"]
+OWNERS = [f"Team {i}" for i in range(20)]
+TAGS = ["web", "database", "cache", "batch", "legacy", "production", "linux", "windows"]
+
+
+def seed(engine, servers: int):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    ts = int(time.time())
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, os, owner, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", rng.choice(ENVIRONMENTS),
+              "Ubuntu 22.04", rng.choice(OWNERS), now) for i in range(1, servers + 1)),
+        )
+        cur.executemany(
+            "INSERT OR IGNORE INTO server_tags (server_id, tag) VALUES (?, ?)",
+            ((i, tag) for i in range(1, servers + 1) for tag in rng.sample(TAGS, 2)),
+        )
+        cur.executemany(
+            "INSERT INTO latest_metrics (server_id, metric, ts, value) VALUES (?, ?, ?, ?)",
+            ((i, metric, ts, round(min(100.0, max(0.0, rng.gauss(mu, 15))), 2))
+             for i in range(1, servers + 1)
+             for metric, mu in (("memory.used_pct", 60), ("disk.C.used_pct", 70), ("disk.D.used_pct", 50))),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ["INFRA_NOVA_DB"] = os.path.join(tempfile.mkdtemp(prefix="capacity-"), "bench.db")
+    from app.database import engine, SessionLocal, Base
+    from app import models  # noqa: F401 - registers the tables
+    from app.analytics import capacity_report
+
+    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    seed(engine, args.servers)
+    print(f"seeded {args.servers} servers in {time.perf_counter() - started:.1f}s")
+
+    db = SessionLocal()
+    worst = 0.0
+    for metric in ("memory.used_pct", "disk.*.used_pct"):
+        for group_by in ("environment", "owner", "tag"):
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                report = capacity_report(db, metric, group_by, 85.0, [50, 90, 95, 99], 10)
+                timings.append(time.perf_counter() - started)
+            median = float(np.median(timings))
+            worst = max(worst, median)
+            print(f"{metric:<18} by {group_by:<11} {len(report['groups']):>3} groups, "
+                  f"{report['servers']:>6} rows: median {median * 1000:.0f} ms")
+    db.close()
+    if worst >= 1.0:
+        print("slower than 1s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Heartbeat ingestion benchmark
+Starts the API with uvicorn against a scratch database of 40,000 servers and
+sends POST /api/heartbeats at a fixed rate (2,000/s by default) over
+keep-alive connections. Latency is measured from each request's scheduled send
+time, so a server that falls behind shows up in the percentiles. After a
+graceful shutdown, which flushes the buffer, it checks that every server's
+stored reading is the last one it sent. For comparison it times the naive
+approach, one upsert and commit per heartbeat.
+
+    python benchmarks/heartbeat_ingest.py --rate 2000 --seconds 15
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKEND = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, BACKEND)
+
+
+def seed(engine, servers: int):
+    now = datetime.utcnow()
+    conn = engine.raw_connection()
+    try:
+        conn.cursor().executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, created_at) VALUES (?, ?, ?, 'Production', ?)",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", now) for i in range(1, servers + 1)),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+async def post(reader, writer, port: int, body: bytes) -> int:
+    writer.write(b"POST /api/heartbeats HTTP/1.1\r\nHost: 127.0.0.1:%d\r\nContent-Type: application/json\r\n"
+                 b"Content-Length: %d\r\n\r\n%s" % (port, len(body), body))
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            await reader.readexactly(int(line.split(b":")[1]))
+    return status
+
+
+async def send(port: int, rate: float, seconds: float, servers: int, connections: int):
+    """Open-loop load: heartbeat k is due at k / rate seconds and goes to server k % servers + 1"""
+    total = int(rate * seconds)
+    latencies, failures, last_sent = [], 0, {}
+    start = time.perf_counter() + 0.5
+
+    async def connection(offset: int):
+        nonlocal failures
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        for k in range(offset, total, connections):
+            due = start + k / rate
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            server_id = k % servers + 1
+            body = json.dumps({"server_id": server_id, "agent_version": "bench",
+                               "metrics": {"memory.used_pct": k % 100, "agent.seq": k}}).encode()
+            if await post(reader, writer, port, body) == 204:
+                last_sent[server_id] = max(k, last_sent.get(server_id, -1))
+            else:
+                failures += 1
+            latencies.append(time.perf_counter() - due)
+        writer.close()
+
+    await asyncio.gather(*[connection(offset) for offset in range(connections)])
+    elapsed = time.perf_counter() - start
+    return total, elapsed, sorted(latencies), failures, last_sent
+
+
+def naive_rate(engine, servers: int, seconds: float = 3) -> float:
+    """Heartbeats per second when each one is its own upsert and commit"""
+    from sqlalchemy.dialects.sqlite import insert
+    from app import models
+    from app.database import SessionLocal
+
+    upsert = insert(models.ServerHeartbeat)
+    statement = upsert.on_conflict_do_update(
+        index_elements=["server_id"],
+        set_={column: upsert.excluded[column] for column in ("received_at", "metrics")})
+    db = SessionLocal()
+    try:
+        done, deadline = 0, time.perf_counter() + seconds
+        t0 = time.perf_counter()
+        while time.perf_counter() < deadline:
+            db.execute(statement, {"server_id": done % servers + 1, "received_at": datetime.utcnow(),
+                                   "metrics": json.dumps({"agent.seq": done})})
+            db.commit()
+            done += 1
+        return done / (time.perf_counter() - t0)
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=40_000)
+    parser.add_argument("--rate", type=float, default=2000)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--connections", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        os.environ["INFRA_NOVA_DB"] = db_path
+        from app.database import Base, engine
+        from app.main import prepare_database
+
+        Base.metadata.create_all(bind=engine)
+        seed(engine, args.servers)
+        prepare_database()
+
+        port = free_port()
+        env = dict(os.environ, INFRA_NOVA_SCHEMA_READY="1", SCHEDULER_ENABLED="0", JOB_WORKERS="0",
+                   INVENTORY_REFRESH_ENABLED="0", OUTBOX_RELAY_ENABLED="0")
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BACKEND, env=env)
+        try:
+            wait_until_ready(f"http://127.0.0.1:{port}/readyz")
+            sent, elapsed, latencies, failures, last_sent = asyncio.run(
+                send(port, args.rate, args.seconds, args.servers, args.connections))
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/heartbeats/writer") as response:
+                stats = json.load(response)
+        finally:
+            # SIGINT is a graceful shutdown, which flushes the buffered heartbeats
+            server.send_signal(signal.SIGINT)
+            server.wait(timeout=30)
+
+        stored = {server_id: json.loads(metrics)["agent.seq"] for server_id, metrics in engine.connect().exec_driver_sql(
+            "SELECT server_id, metrics FROM server_heartbeats")}
+        lost = sum(1 for server_id, k in last_sent.items() if stored.get(server_id) != k)
+        pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+        print(f"{sent} heartbeats in {elapsed:.1f}s ({sent / elapsed:,.0f}/s offered {args.rate:,.0f}/s), "
+              f"{failures} failed")
+        print(f"latency p50 {pct(0.5):.1f} ms, p99 {pct(0.99):.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+        print(f"{stats['received']} received, {stats['written']} rows written in {stats['flushes']} flushes "
+              f"(avg {stats['flush_ms_total'] / max(1, stats['flushes']):.1f} ms, max {stats['flush_ms_max']:.1f} ms)")
+        print(f"{len(stored)} servers stored, {lost} without their last reading")
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            print(f"server CPU {(usage.ru_utime + usage.ru_stime) / sent * 1e6:.0f} us per heartbeat "
+                  f"(including startup) on {os.cpu_count()} CPU(s) shared with this load generator")
+        print(f"naive per-heartbeat commit: {naive_rate(engine, args.servers):,.0f}/s on this disk, "
+              f"one write transaction each")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Job queue throughput check
+Starts several worker processes against a scratch SQLite database, drains a
+batch of queued jobs and verifies that no job was processed twice. With
+--kill-one a worker is killed mid-run to show its leased jobs being re-queued.
+
+    python benchmarks/job_queue_throughput.py --jobs 2000 --processes 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def handle(db, job, cancel=None):
+    # Stand-in for a real check: hold the job briefly and log who ran it
+    time.sleep(float(os.environ["BENCH_JOB_MS"]) / 1000)
+    with open(os.path.join(os.environ["BENCH_LOG_DIR"], f"{os.getpid()}.log"), "a") as log:
+        log.write(f"{job.id}\n")
+    return "Passed"
+
+
+def run_worker(concurrency: int, lease_seconds: int):
+    from app.jobs import Worker
+    worker = Worker(concurrency=concurrency, poll_seconds=0.05, lease_seconds=lease_seconds, handler=handle)
+    worker.run_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--job-ms", type=float, default=5)
+    parser.add_argument("--lease-seconds", type=int, default=3)
+    parser.add_argument("--kill-one", action="store_true", help="SIGKILL one worker half way through")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="jobq-")
+    os.environ["INFRA_NOVA_DB"] = os.path.join(workdir, "bench.db")
+    os.environ["BENCH_LOG_DIR"] = workdir
+    os.environ["BENCH_JOB_MS"] = str(args.job_ms)
+
+    from app.database import engine, SessionLocal, Base
+    from app import models
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    now = datetime.utcnow()
+    db.add(models.Server(id=1, name="bench", ip_address="127.0.0.1", environment="UAT", created_at=now))
+    db.bulk_insert_mappings(models.CheckJob, [
+        {"server_id": 1, "check_type": "precheck", "status": "queued", "attempts": 0,
+         "max_attempts": 5, "available_at": now, "created_at": now}
+        for _ in range(args.jobs)
+    ])
+    db.commit()
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=run_worker, args=(args.concurrency, args.lease_seconds), daemon=True)
+                 for _ in range(args.processes)]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    killed = False
+    while True:
+        remaining = db.query(models.CheckJob).filter(models.CheckJob.status.in_(("queued", "running"))).count()
+        if remaining == 0:
+            break
+        if args.kill_one and not killed and remaining < args.jobs / 2:
+            processes[0].kill()
+            killed = True
+            print(f"killed worker pid {processes[0].pid} with {remaining} jobs left")
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.kill()
+
+    runs = Counter()
+    for name in os.listdir(workdir):
+        if name.endswith(".log"):
+            with open(os.path.join(workdir, name)) as log:
+                runs.update(int(line) for line in log if line.strip())
+    retried = {job_id for (job_id,) in db.query(models.CheckJob.id).filter(models.CheckJob.attempts > 1)}
+    duplicates = [job_id for job_id, n in runs.items() if n > 1 and job_id not in retried]
+    succeeded = db.query(models.CheckJob).filter_by(status="succeeded").count()
+
+    print(f"{succeeded}/{args.jobs} jobs succeeded in {elapsed:.2f}s "
+          f"({succeeded / elapsed:.0f} jobs/s, {args.processes} processes x {args.concurrency} threads)")
+    print(f"re-queued after lease expiry: {len(retried)}, processed twice without a re-queue: {len(duplicates)}")
+    if duplicates or succeeded != args.jobs:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+List endpoint memory benchmark
+Seeds a scratch database (per server: two tags, three status rows, one alert,
+one migration and a check job) and measures the tracemalloc peak of one
+request to each list endpoint, from routing through the serialized body, and
+its time to first byte. Requests go straight to the ASGI app, which drops
+body chunks as they arrive, as a client reading them would. A JSON body is
+built in full, so it is part of the peak and is reported alongside; an
+NDJSON stream is not. With --check, exits non-zero when /servers or
+/server-status needs more bytes per server on top of its JSON body than
+BUDGETS allows, or when a stream peaks above STREAM_BUDGET_MIB. Loading ORM
+instances again, validating a whole list at once, or buffering a stream
+would go over the budget.
+
+    python benchmarks/list_memory.py --servers 10000 100000 --check
+"""
+
+import argparse
+import asyncio
+import gc
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+MODES = {"json": {}, "ndjson": {"Accept": "application/x-ndjson"}, "json+gzip": {"Accept-Encoding": "gzip"}}
+REQUESTS = [("/api/servers", "json"), ("/api/servers", "ndjson"), ("/api/servers", "json+gzip"),
+            ("/api/server-status", "json"), ("/api/server-status", "ndjson"), ("/api/alerts", "json"),
+            ("/api/alerts", "ndjson"), ("/api/jobs?limit=1000", "json"), ("/api/schedules", "json"),
+            ("/api/reports/exports", "json")]
+# JSON: bytes per server over the body; ORM instances took about 24,000 and 2,300
+BUDGETS = {"/api/servers": 7000, "/api/server-status": 1000}
+# NDJSON: peak in MiB, whatever the fleet size
+STREAM_BUDGET_MIB = 16
+
+
+def seed(engine, servers: int):
+    now = datetime.utcnow()
+    ids = range(1, servers + 1)
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, os, owner, created_at) "
+            "VALUES (?, ?, ?, 'Production', 'Windows Server 2019', 'infra', ?)",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", now) for i in ids))
+        cur.executemany("INSERT INTO server_tags (server_id, tag) VALUES (?, ?)",
+                        ((i, tag) for i in ids for tag in ("role:web", f"site:dc{i % 4}")))
+        cur.executemany(
+            "INSERT INTO server_status (server_id, migration_status, precheck_status, issue_summary, last_checked, "
+            "version, is_current) VALUES (?, ?, 'Passed', ?, ?, ?, ?)",
+            ((i, status, summary, now - timedelta(days=3 - version), version, version == 3) for i in ids
+             for version, status, summary in ((1, "Ready", None), (2, "Blocked", "Disk usage at 91%"),
+                                              (3, "Ready", None))))
+        cur.execute(
+            "INSERT INTO server_current_status (server_id, status_id, migration_status, precheck_status, "
+            "postcheck_status, issue_summary, last_checked, version) SELECT server_id, id, migration_status, "
+            "precheck_status, postcheck_status, issue_summary, last_checked, version FROM server_status "
+            "WHERE is_current = 1")
+        cur.executemany("INSERT INTO alerts (server_id, severity, message, resolved, created_at) "
+                        "VALUES (?, 'Warning', 'Disk usage at 91%', 1, ?)", ((i, now) for i in ids))
+        cur.executemany("INSERT INTO migrations (server_id, started_at, status, notes) "
+                        "VALUES (?, ?, 'Planned', NULL)", ((i, now) for i in ids))
+        cur.executemany("INSERT INTO check_jobs (server_id, check_type, status, attempts, max_attempts, created_at, "
+                        "finished_at, result) VALUES (?, 'precheck', 'succeeded', 1, 3, ?, ?, 'Passed')",
+                        ((i, now, now) for i in ids))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def get(app, path: str, headers: dict):
+    """One GET through the ASGI app; the body is counted and dropped, as a client reading it would"""
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+             "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+             "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8000)}
+    received, status, size, first_byte = False, None, 0, None
+    t0 = time.perf_counter()
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        nonlocal status, size, first_byte
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            first_byte = first_byte or time.perf_counter() - t0
+            size += len(message["body"])
+
+    await app(scope, receive, send)
+    assert status == 200, (path, status)
+    return size, first_byte, time.perf_counter() - t0
+
+
+def measure(app, path: str, headers: dict):
+    gc.collect()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    size, first_byte, elapsed = asyncio.run(get(app, path, headers))
+    return tracemalloc.get_traced_memory()[1] - base, size, first_byte, elapsed
+
+
+def run(servers: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["INFRA_NOVA_DB"] = os.path.join(tmp, "bench.db")
+        from app.database import Base, engine
+        from app.main import app
+
+        Base.metadata.create_all(bind=engine)
+        seed(engine, servers)
+        results = {}
+        asyncio.run(get(app, "/api/alerts", {}))  # warm up imports and caches outside the measurement
+        tracemalloc.start()
+        try:
+            for path, mode in REQUESTS:
+                results[path, mode] = measure(app, path, MODES[mode])
+        finally:
+            tracemalloc.stop()
+            engine.dispose()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--check", action="store_true", help="exit non-zero when an endpoint is over its budget")
+    args = parser.parse_args()
+    os.environ.update(SCHEDULER_ENABLED="0", JOB_WORKERS="0", INVENTORY_REFRESH_ENABLED="0",
+                      OUTBOX_RELAY_ENABLED="0")
+
+    if len(args.servers) > 1:
+        # One process per fleet size, as the database engine is bound on import
+        check = ["--check"] if args.check else []
+        codes = [subprocess.call([sys.executable, __file__, "--servers", str(servers), *check])
+                 for servers in args.servers]
+        sys.exit(max(codes))
+
+    servers, over = args.servers[0], []
+    print(f"{servers:,} servers")
+    for (path, mode), (peak, body, first_byte, elapsed) in run(servers).items():
+        per_server = (peak - body) / servers
+        print(f"  {path:22} {mode:9} peak {peak / 2**20:7.1f} MiB  body {body / 2**20:6.1f} MiB  "
+              f"first byte {first_byte * 1000:6.0f} ms  total {elapsed * 1000:6.0f} ms")
+        if not args.check:
+            continue
+        if mode == "json" and per_server > BUDGETS.get(path, float("inf")):
+            over.append(f"{path} at {servers:,} servers: {per_server:.0f} B/server over the body > {BUDGETS[path]}")
+        if mode == "ndjson" and peak > STREAM_BUDGET_MIB * 2**20:
+            over.append(f"{path} streamed at {servers:,} servers: {peak / 2**20:.1f} MiB > {STREAM_BUDGET_MIB}")
+    if over:
+        print("over budget:\n  " + "\n  ".join(over))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Probe runner benchmark
+Starts local listeners on 0.0.0.0 (one sending an SSH banner, one that never
+answers, plus a port nobody listens on) and probes N distinct loopback
+addresses (127.x.y.z) across those ports from one event loop. It checks that
+no host ever had more than --per-host connections open at once and that every
+host got the expected status, and estimates from a sample how long probing
+the hosts one at a time would take.
+
+    python benchmarks/probe_runner.py --hosts 5000
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app import probes  # noqa: E402
+from app.probes import ProbeRunner, probe_many  # noqa: E402
+
+
+class InFlight:
+    """Wraps probe_port to count the connections open to each host at once"""
+
+    def __init__(self):
+        self.open = Counter()
+        self.peak = 0
+        self._probe_port = probes.probe_port
+        probes.probe_port = self.probe_port
+
+    async def probe_port(self, host, *args, **kwargs):
+        self.open[host] += 1
+        self.peak = max(self.peak, self.open[host])
+        try:
+            return await self._probe_port(host, *args, **kwargs)
+        finally:
+            self.open[host] -= 1
+
+
+async def _ssh(reader, writer):
+    writer.write(b"SSH-2.0-OpenSSH_8.9p1 Ubuntu-3\r\n")
+    await _silent(reader, writer)
+
+
+async def _silent(reader, writer):
+    try:
+        await reader.read(1)
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+async def start_listeners():
+    servers = [await asyncio.start_server(handler, "0.0.0.0", 0, backlog=4096) for handler in (_ssh, _silent)]
+    ssh, silent = (server.sockets[0].getsockname()[1] for server in servers)
+    # A port nobody listens on: bind it, then give it back
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        closed = sock.getsockname()[1]
+    return servers, ssh, silent, closed
+
+
+def hosts(count: int):
+    return [f"127.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(1, count + 1)]
+
+
+async def sequential_seconds(hosts, ports, runner_args) -> float:
+    t0 = time.perf_counter()
+    for host in hosts:
+        await ProbeRunner(**runner_args).probe(host, "precheck", ports)
+    return (time.perf_counter() - t0) / len(hosts)
+
+
+async def run(args):
+    servers, ssh, silent, closed = await start_listeners()
+    in_flight = InFlight()
+    targets = hosts(args.hosts)
+    # Every tenth host is degraded: its "SSH" port never sends a banner and another port refuses
+    degraded_hosts, healthy_hosts = targets[:args.hosts // 10], targets[args.hosts // 10:]
+    limits = {"per_host": args.per_host, "timeout": args.timeout, "host_deadline": args.timeout * 2}
+    healthy_args, degraded_args = {**limits, "ssh_port": ssh}, {**limits, "ssh_port": silent}
+
+    t0 = time.perf_counter()
+    healthy, degraded = await asyncio.gather(
+        probe_many([(host, "precheck") for host in healthy_hosts], [ssh],
+                   ProbeRunner(concurrency=args.concurrency, **healthy_args)),
+        probe_many([(host, "precheck") for host in degraded_hosts], [ssh, silent, closed],
+                   ProbeRunner(concurrency=args.concurrency, **degraded_args)))
+    elapsed = time.perf_counter() - t0
+    connections = len(healthy) + 3 * len(degraded)
+    print(f"{args.hosts} hosts, {connections} connections on one event loop: {elapsed:.2f} s")
+    print("statuses:", dict(Counter(result["Status"] for result in healthy + degraded)))
+    latencies = sorted(result["Details"]["LatencyMs"] for result in healthy)
+    print(f"handshake latency p50 {latencies[len(latencies) // 2]:.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)]:.2f} ms (listeners share the loop)")
+    print(f"peak connections to one host: {in_flight.peak} (cap {args.per_host})")
+    assert in_flight.peak <= args.per_host, "per-host cap exceeded"
+    assert all(result["Status"] == "Passed" for result in healthy), "healthy host not Passed"
+    assert all(result["Status"] == "Warning" for result in degraded), "degraded host not Warning"
+
+    # One host at a time, as a worker thread per check would go through them
+    per_healthy = await sequential_seconds(healthy_hosts[:200], [ssh], healthy_args)
+    per_degraded = await sequential_seconds(degraded_hosts[:5], [ssh, silent, closed], degraded_args)
+    estimate = per_healthy * len(healthy_hosts) + per_degraded * len(degraded_hosts)
+    print(f"one host at a time: {per_healthy * 1000:.2f} ms per healthy host, {per_degraded:.2f} s per "
+          f"degraded host, ~{estimate:.0f} s for all {args.hosts}")
+    for server in servers:
+        server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--per-host", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=1.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Schema upgrade check
+Builds a scratch database with the original schema (servers and server_status
+only, no read model, intervals or versions) holding N servers with a few
+status rows each, where some servers have two current rows and some none.
+Times the startup preparation that upgrades it in place, then checks that
+no drift is left and that every server has exactly one open interval, on its
+current row.
+
+    python benchmarks/schema_upgrade.py --servers 20000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+BASELINE_SCHEMA = """
+CREATE TABLE servers (
+    id INTEGER PRIMARY KEY, name VARCHAR NOT NULL, ip_address VARCHAR NOT NULL, environment VARCHAR NOT NULL,
+    os VARCHAR, owner VARCHAR, created_at DATETIME);
+CREATE TABLE server_status (
+    id INTEGER PRIMARY KEY, server_id INTEGER REFERENCES servers (id), migration_status VARCHAR NOT NULL,
+    precheck_status VARCHAR, postcheck_status VARCHAR, issue_summary TEXT, last_checked DATETIME,
+    is_current BOOLEAN);
+"""
+
+
+def seed(path: str, servers: int, history: int, drift_rate: float):
+    rng = random.Random(5)
+    start = datetime(2024, 1, 1)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(BASELINE_SCHEMA)
+        conn.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment) VALUES (?, ?, ?, 'Production')",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}") for i in range(1, servers + 1)))
+        rows = []
+        for server_id in range(1, servers + 1):
+            times = sorted(start + timedelta(seconds=rng.uniform(0, 30 * 86400)) for _ in range(history))
+            drift = rng.random()
+            for n, when in enumerate(times):
+                last = n == len(times) - 1
+                if drift < drift_rate / 2:
+                    # The last two rows both current
+                    current = n >= len(times) - 2
+                elif drift < drift_rate:
+                    current = False
+                else:
+                    current = last
+                rows.append((server_id, "Ready", when.strftime("%Y-%m-%d %H:%M:%S.%f"), int(current)))
+        conn.executemany(
+            "INSERT INTO server_status (server_id, migration_status, last_checked, is_current) VALUES (?, ?, ?, ?)",
+            rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=20_000)
+    parser.add_argument("--history", type=int, default=3)
+    parser.add_argument("--drift-rate", type=float, default=0.1, help="share of servers with two or no current rows")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "upgrade.db")
+        os.environ["INFRA_NOVA_DB"] = path
+        os.environ.pop("INFRA_NOVA_SHARDS", None)
+        seed(path, args.servers, args.history, args.drift_rate)
+        from app.consistency import find_drift
+        from app.database import SessionLocal
+        from app.history import OPEN_END
+        from app.main import prepare_database
+
+        t0 = time.perf_counter()
+        prepare_database()
+        print(f"upgraded {args.servers} servers x {args.history} status rows in {time.perf_counter() - t0:.2f} s")
+
+        db = SessionLocal()
+        try:
+            drift = find_drift(db)
+            conn = db.connection()
+            bad = conn.exec_driver_sql(
+                "SELECT count(*) FROM servers s WHERE (SELECT count(*) FROM server_status ss "
+                "WHERE ss.server_id = s.id AND ss.valid_to = ?) != 1 OR NOT EXISTS (SELECT 1 FROM server_status ss "
+                "WHERE ss.server_id = s.id AND ss.valid_to = ? AND ss.is_current)",
+                (OPEN_END.strftime("%Y-%m-%d %H:%M:%S.%f"),) * 2).scalar()
+            unstarted = conn.exec_driver_sql("SELECT count(*) FROM server_status WHERE valid_from IS NULL").scalar()
+        finally:
+            db.close()
+        print(f"drift left: {not drift['consistent']}, servers without one open current row: {bad}, "
+              f"rows without valid_from: {unstarted}")
+        assert drift["consistent"] and bad == 0 and unstarted == 0, "upgrade left the history inconsistent"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Server search benchmark
+Seeds a scratch database with N servers (two tags each), builds the search
+index and times /search/servers for name, owner, tag, multi-word and IP/CIDR
+queries. Each should answer in under 10 ms at 100k servers.
+
+    python benchmarks/server_search.py --servers 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+ENVIRONMENTS = ["Production", "UAT", "Development"]
+OWNERS = [f"Team {name}" for name in ("Apollo", "Borealis", "Cobalt", "Delta", "Ember", "Falcon", "Granite", "Harbor")]
+OSES = ["Windows Server 2019", "Windows Server 2022", "Ubuntu 22.04", "RHEL 8"]
+ROLES = ["web", "db", "cache", "batch", "app", "file"]
+TAGS = ["web", "database", "cache", "batch", "legacy", "production", "linux", "windows"]
+QUERIES = ["", "web-0421", "granite", "legacy", "db prod", "ubuntu cache", "10.1.", "10.1.2.0/24", "10.0.200.17", "zzz"]
+
+
+def seed(engine, servers: int):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, os, owner, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((i, f"{rng.choice(ROLES)}-{rng.choice(['prod', 'uat', 'dev'])}-{i:05d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}",
+              rng.choice(ENVIRONMENTS), rng.choice(OSES), rng.choice(OWNERS), now) for i in range(1, servers + 1)),
+        )
+        cur.executemany(
+            "INSERT OR IGNORE INTO server_tags (server_id, tag) VALUES (?, ?)",
+            ((i, tag) for i in range(1, servers + 1) for tag in rng.sample(TAGS, 2)),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["INFRA_NOVA_DB"] = os.path.join(tmp, "bench.db")
+        from app.database import Base, SessionLocal, engine
+        from app.search import ensure_search_index, search_server_ids, load_hits
+
+        Base.metadata.create_all(bind=engine)
+        started = time.perf_counter()
+        seed(engine, args.servers)
+        ensure_search_index(engine)
+        print(f"seeded and indexed {args.servers} servers in {time.perf_counter() - started:.1f}s")
+
+        db = SessionLocal()
+        slowest = 0.0
+        try:
+            for q, environment, offset in [(q, None, 0) for q in QUERIES] + [
+                    ("legacy", "UAT", 0), ("db prod", None, 200), ("10.1.", "Production", 0)]:
+                timings = []
+                for _ in range(args.repeat):
+                    t0 = time.perf_counter()
+                    mode, total, capped, ids = search_server_ids(db, q, environment, limit=20, offset=offset)
+                    load_hits(db, ids)
+                    timings.append((time.perf_counter() - t0) * 1000)
+                median = statistics.median(timings)
+                slowest = max(slowest, median)
+                label = q + (f" env={environment}" if environment else "") + (f" offset={offset}" if offset else "")
+                print(f"{label!r:<28} {mode:<5} {total:>5}{'+' if capped else ' '} hits: median {median:6.2f} ms")
+        finally:
+            db.close()
+        if slowest >= 10:
+            print("❌ slower than 10 ms")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
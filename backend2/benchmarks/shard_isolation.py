@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Shard isolation benchmark
+Runs a UAT write storm (threads marking every UAT server Blocked and back
+with transition_many) and meanwhile times single Production status changes
+and the fleet dashboard, once with every environment in one database and
+once with UAT and Development in shards of their own (split with shard.py).
+In one file the Production writes queue behind the storm for the write lock;
+sharded, they only share the CPU.
+
+    python benchmarks/shard_isolation.py --servers 30000 --seconds 10
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+ENVIRONMENTS = ("Production", "UAT", "Development")
+
+
+def seed(engine, servers: int):
+    now = datetime.utcnow()
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, created_at) VALUES (?, ?, ?, ?, ?)",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", ENVIRONMENTS[i % 3], now)
+             for i in range(1, servers + 1)))
+        cur.executemany(
+            "INSERT INTO server_status (server_id, migration_status, last_checked, version, is_current) "
+            "VALUES (?, 'Ready', ?, 1, 1)", ((i, now) for i in range(1, servers + 1)))
+        cur.execute(
+            "INSERT INTO server_current_status (server_id, status_id, migration_status, last_checked, version) "
+            "SELECT server_id, id, migration_status, last_checked, version FROM server_status")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def percentiles(samples: list) -> str:
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return f"p50 {cuts[49]:7.1f} ms  p99 {cuts[98]:7.1f} ms  max {max(samples):7.1f} ms"
+
+
+def run(servers: int, seconds: float, storm_threads: int) -> dict:
+    from app.database import Base, engine, session_for_environment, session_for_server
+    from app.dashboard import fleet_bundle
+    from app.transitions import transition_many, transition_status
+
+    Base.metadata.create_all(bind=engine)
+    seed(engine, servers)
+    import shard
+    with contextlib.redirect_stdout(io.StringIO()):
+        shard.prepare_database()
+        shard.rebalance(batch=5000, dry_run=False)
+
+    uat_ids = [i for i in range(1, servers + 1) if i % 3 == 1]
+    stop = threading.Event()
+    batches = [0]
+
+    def storm():
+        db = session_for_environment("UAT")
+        try:
+            blocked = False
+            while not stop.is_set():
+                blocked = not blocked
+                transition_many(db, uat_ids, {"migration_status": "Blocked" if blocked else "Ready"})
+                batches[0] += 1
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=storm) for _ in range(storm_threads)]
+    for thread in threads:
+        thread.start()
+    writes, reads = [], []
+    production_id = 3
+    deadline = time.perf_counter() + seconds
+    try:
+        while time.perf_counter() < deadline:
+            db = session_for_server(production_id)
+            try:
+                t0 = time.perf_counter()
+                status = transition_status(db, production_id, {"issue_summary": f"probe {len(writes)}"})
+                writes.append((time.perf_counter() - t0) * 1000)
+                assert status is not None
+                t0 = time.perf_counter()
+                fleet_bundle(db, ["summary", "migration_chart"])
+                reads.append((time.perf_counter() - t0) * 1000)
+            finally:
+                db.close()
+            time.sleep(0.02)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    return {"writes": writes, "reads": reads, "batches": batches[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=30_000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--storm-threads", type=int, default=2)
+    parser.add_argument("--mode", choices=["single", "sharded"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is None:
+        # One process per mode, as the database engines are bound on import
+        for mode in ("single", "sharded"):
+            subprocess.check_call([sys.executable, __file__, "--servers", str(args.servers), "--seconds",
+                                   str(args.seconds), "--storm-threads", str(args.storm_threads), "--mode", mode])
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(INFRA_NOVA_DB=os.path.join(tmp, "bench.db"), SCHEDULER_ENABLED="0", JOB_WORKERS="0",
+                          INVENTORY_REFRESH_ENABLED="0", OUTBOX_RELAY_ENABLED="0")
+        if args.mode == "sharded":
+            os.environ["INFRA_NOVA_SHARDS"] = json.dumps({"UAT": os.path.join(tmp, "uat.db"),
+                                                          "Development": os.path.join(tmp, "development.db")})
+        result = run(args.servers, args.seconds, args.storm_threads)
+    print(f"{args.mode:8} {args.servers:,} servers, {result['batches']} UAT batches of {args.servers // 3:,}")
+    print(f"  Production write  {percentiles(result['writes'])}  ({len(result['writes'])} writes)")
+    print(f"  fleet summary     {percentiles(result['reads'])}")
+
+
+if __name__ == "__main__":
+    main()
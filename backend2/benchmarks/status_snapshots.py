@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Point-in-time status benchmark
+Seeds a scratch database with N servers and H status rows each, then times
+the dashboard counts live, as_of a recent, middle and early time, and the
+same as_of counts done the old way (newest row per server at or before t,
+found with a correlated subquery).
+
+    python benchmarks/status_snapshots.py --servers 20000 --history 20
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+STATUSES = ["Ready", "Blocked", "Ready", "Migrated", "Completed", "Failed"]
+CORRELATED = """
+    SELECT migration_status, count(*) FROM server_status s
+    WHERE s.id = (SELECT max(id) FROM server_status p WHERE p.server_id = s.server_id AND p.last_checked <= :t)
+    GROUP BY migration_status
+"""
+
+
+def seed(engine, servers: int, history: int, start: datetime):
+    rng = random.Random(3)
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, created_at) VALUES (?, ?, ?, 'Production', ?)",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", start) for i in range(1, servers + 1)),
+        )
+        # Changes spread over 30 days, appended in time order like the application does
+        changes = sorted((start + timedelta(seconds=rng.uniform(0, 30 * 86400)), server_id)
+                         for server_id in range(1, servers + 1) for _ in range(history))
+        versions = {}
+        rows = []
+        for when, server_id in changes:
+            versions[server_id] = versions.get(server_id, 0) + 1
+            rows.append((server_id, rng.choice(STATUSES), when.strftime("%Y-%m-%d %H:%M:%S.%f"), versions[server_id]))
+        cur.executemany(
+            "INSERT INTO server_status (server_id, migration_status, last_checked, version, is_current) "
+            "VALUES (?, ?, ?, ?, 0)", rows)
+        cur.execute("UPDATE server_status SET is_current = 1 WHERE id IN (SELECT max(id) FROM server_status GROUP BY server_id)")
+        cur.execute(
+            "INSERT INTO server_current_status (server_id, status_id, migration_status, last_checked, version) "
+            "SELECT server_id, id, migration_status, last_checked, version FROM server_status WHERE is_current = 1")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def median_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=20_000)
+    parser.add_argument("--history", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["INFRA_NOVA_DB"] = os.path.join(tmp, "bench.db")
+        from sqlalchemy import text
+        from app.crud import count_current_statuses
+        from app.database import Base, SessionLocal, engine
+        from app.history import ensure_status_intervals
+
+        Base.metadata.create_all(bind=engine)
+        start = datetime(2025, 1, 1)
+        seed(engine, args.servers, args.history, start)
+        t0 = time.perf_counter()
+        ensure_status_intervals(engine)
+        print(f"{args.servers * args.history} history rows; interval backfill {time.perf_counter() - t0:.1f} s")
+
+        db = SessionLocal()
+        try:
+            print(f"live                 {median_ms(lambda: count_current_statuses(db), args.repeat):8.1f} ms")
+            for label, days in (("day 29", 29), ("day 15", 15), ("day 1", 1)):
+                as_of = start + timedelta(days=days)
+                live = count_current_statuses(db, as_of)
+                assert live.ready == sum(n for status, n in db.execute(text(CORRELATED), {"t": as_of})
+                                         if status == "Ready"), "interval counts disagree"
+                intervals = median_ms(lambda: count_current_statuses(db, as_of), args.repeat)
+                correlated = median_ms(lambda: db.execute(text(CORRELATED), {"t": as_of}).all(), 1)
+                print(f"as_of {label:<8}       {intervals:8.1f} ms   (correlated scan {correlated:8.1f} ms)")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
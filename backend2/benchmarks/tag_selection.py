@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tag selection benchmark
+Seeds a scratch database with N servers carrying two or three of eight tags
+and times tag expressions against the in-memory bitmap index: the first
+(cold) build, warm queries, and catching up after a batch of tag writes.
+Compound SELECTs over the tag index are timed alongside for comparison.
+
+    python benchmarks/tag_selection.py --servers 100000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+TAGS = ["web", "database", "cache", "batch", "legacy", "production", "linux", "windows"]
+EXPRESSIONS = [
+    ("production AND database AND NOT legacy",
+     "SELECT server_id FROM server_tags WHERE tag = 'production' INTERSECT "
+     "SELECT server_id FROM server_tags WHERE tag = 'database' EXCEPT "
+     "SELECT server_id FROM server_tags WHERE tag = 'legacy'"),
+    ("(web OR cache) AND linux",
+     "SELECT server_id FROM server_tags WHERE tag IN ('web', 'cache') INTERSECT "
+     "SELECT server_id FROM server_tags WHERE tag = 'linux'"),
+    ("NOT windows",
+     "SELECT id FROM servers EXCEPT SELECT server_id FROM server_tags WHERE tag = 'windows'"),
+]
+
+
+def seed(engine, servers: int):
+    rng = random.Random(7)
+    now = datetime.utcnow()
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        cur.executemany(
+            "INSERT INTO servers (id, name, ip_address, environment, created_at) VALUES (?, ?, ?, 'Production', ?)",
+            ((i, f"srv-{i:06d}", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", now) for i in range(1, servers + 1)),
+        )
+        cur.executemany(
+            "INSERT INTO server_tags (server_id, tag) VALUES (?, ?)",
+            ((i, tag) for i in range(1, servers + 1) for tag in rng.sample(TAGS, rng.choice((2, 3)))),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def median_ms(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--servers", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["INFRA_NOVA_DB"] = os.path.join(tmp, "bench.db")
+        from sqlalchemy import text
+        from app.database import Base, SessionLocal, engine
+        from app.tags import ensure_tag_index, select_server_ids, tag_index
+
+        Base.metadata.create_all(bind=engine)
+        ensure_tag_index(engine)
+        seed(engine, args.servers)
+
+        db = SessionLocal()
+        try:
+            t0 = time.perf_counter()
+            tag_index.refresh(db)
+            print(f"cold index build: {(time.perf_counter() - t0) * 1000:.1f} ms for {args.servers} servers")
+            for expression, sql in EXPRESSIONS:
+                ids = select_server_ids(db, expression)
+                bitmap = median_ms(lambda: select_server_ids(db, expression), args.repeat)
+                compound = median_ms(lambda: db.execute(text(sql)).all(), max(3, args.repeat // 4))
+                print(f"{expression:<42} {ids.size:>6} servers: bitmap {bitmap:6.2f} ms, SQL {compound:7.2f} ms")
+
+            rng = random.Random(1)
+            db.execute(text("DELETE FROM server_tags WHERE rowid IN (SELECT rowid FROM server_tags ORDER BY random() LIMIT 500)"))
+            db.execute(text("INSERT OR IGNORE INTO server_tags (server_id, tag) VALUES (:s, :t)"),
+                       [{"s": rng.randint(1, args.servers), "t": rng.choice(TAGS)} for _ in range(500)])
+            db.commit()
+            t0 = time.perf_counter()
+            tag_index.refresh(db)
+            print(f"catch-up after ~1000 tag writes: {(time.perf_counter() - t0) * 1000:.1f} ms")
+            db.commit()
+            expected = {server_id for (server_id,) in db.execute(text(EXPRESSIONS[0][1]))}
+            assert set(select_server_ids(db, EXPRESSIONS[0][0]).tolist()) == expected, "index out of sync"
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -32,8 +32,13 @@ function Test-ServerHealth {
         # Check disk space
         $disks = Get-WmiObject -Class Win32_LogicalDisk -ComputerName $Server -ErrorAction Stop | Where-Object {$_.DriveType -eq 3}
         $diskIssues = @()
+        $diskUsage = @()
         foreach ($disk in $disks) {
             $usagePercent = [math]::Round((($disk.Size - $disk.FreeSpace) / $disk.Size) * 100, 2)
+            $diskUsage += @{
+                Drive = $disk.DeviceID
+                UsagePercent = $usagePercent
+            }
             if ($usagePercent -gt 85) {
                 $diskIssues += "Drive $($disk.DeviceID) usage: $usagePercent%"
             }
@@ -72,6 +77,7 @@ function Test-ServerHealth {
         $results.Details.AvailableMemoryGB = [math]::Round($availableMemory / 1GB, 2)
         $results.Details.MemoryUsagePercent = $memoryUsagePercent
         $results.Details.UptimeDays = $uptime.Days
+        $results.Details.Disks = $diskUsage
         
     }
     catch {
@@ -43,6 +43,16 @@ function Get-ServerInfo {
             }
         }
         
+        # Enabled network adapters
+        $nicInfo = @()
+        foreach ($nic in $networkAdapters) {
+            $nicInfo += @{
+                Name = $nic.Name
+                MACAddress = $nic.MACAddress
+                SpeedMbps = if ($nic.Speed) { [math]::Round($nic.Speed / 1000000) } else { $null }
+            }
+        }
+        
         # Calculate total memory
         $totalMemoryGB = [math]::Round(($memory | Measure-Object -Property Capacity -Sum).Sum / 1GB, 2)
         $availableMemoryGB = [math]::Round($operatingSystem.FreePhysicalMemory / 1MB, 2)
@@ -63,6 +73,7 @@ function Get-ServerInfo {
             AvailableMemoryGB = $availableMemoryGB
             MemoryUsagePercent = $memoryUsagePercent
             Disks = $diskInfo
+            NetworkAdapters = $nicInfo
             LastBootTime = $operatingSystem.ConvertToDateTime($operatingSystem.LastBootUpTime)
             Uptime = (Get-Date) - $operatingSystem.ConvertToDateTime($operatingSystem.LastBootUpTime)
             CheckTime = Get-Date
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Database shard tool
+Moves every server into the database its environment maps to in
+INFRA_NOVA_SHARDS (see app/shards.py). Run it to split the main database
+after adding an environment to INFRA_NOVA_SHARDS, and again after changing
+the mapping or a server's environment. Stop the API and the workers first.
+
+    python shard.py status               # servers per database, and how many are misplaced
+    python shard.py rebalance --dry-run  # what would move
+    python shard.py rebalance            # create the shard files and move the servers
+
+A server moves with every row that has its server_id, --batch servers per
+step. The rows are first written to the target in one transaction and then
+deleted from the source in another, so a move that is cut short leaves the
+rows in both places and the next run finishes it. Ids that the target
+already uses for other rows are shifted past its largest id, together with
+the references to them. Tag changes and outbox events stay where they were
+recorded, and servers in a planned or running wave stay until it finishes.
+"""
+
+import argparse
+import sys
+
+from sqlalchemy import Integer
+
+from app import models
+from app.database import Base, SessionLocal, engines, sessions, shard_for_environment
+from app.main import prepare_database
+from app.outbox import ensure_outbox_triggers
+from app.shards import list_shards
+
+# Logs that belong to the database that wrote them, and wave rows that belong to their wave
+STAYS = {"tag_changes", "outbox_events", "wave_servers"}
+ACTIVE_WAVES = ("Planned", "In Progress")
+
+
+def moved_tables():
+    """Tables whose rows follow their server, parents first"""
+    return [table for table in Base.metadata.sorted_tables
+            if table.name == "servers" or ("server_id" in table.columns and table.name not in STAYS)]
+
+
+def _surrogate(table) -> bool:
+    # A rowid alias that other databases hand out too; servers.id is unique across them
+    keys = list(table.primary_key.columns)
+    return table.name != "servers" and len(keys) == 1 and keys[0].name == "id" and isinstance(keys[0].type, Integer)
+
+
+def _key(table) -> str:
+    return "id" if table.name == "servers" else "server_id"
+
+
+def held_by_waves(db) -> set:
+    """Servers in a planned or running wave; the wave rows are all in the main database"""
+    return {server_id for (server_id,) in db.query(models.WaveServer.server_id).join(
+        models.MigrationWave, models.MigrationWave.id == models.WaveServer.wave_id).filter(
+        models.MigrationWave.status.in_(ACTIVE_WAVES))}
+
+
+def misplaced(db, path: str, held: set) -> dict:
+    """{target database: [server ids]} for servers in `path` that belong elsewhere and may move now"""
+    targets = {}
+    for server_id, environment in db.query(models.Server.id, models.Server.environment).order_by(models.Server.id):
+        target = shard_for_environment(environment)
+        if target != path and server_id not in held:
+            targets.setdefault(target, []).append(server_id)
+    return targets
+
+
+def move(source: str, target: str, server_ids: list):
+    """Copy the servers and their rows from `source` to `target`, then delete them from `source`"""
+    tables = moved_tables()
+    conn = engines[source].raw_connection()
+    cur = conn.cursor()
+    cur.execute("ATTACH DATABASE ? AS target", (target,))
+    try:
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS moving (id INTEGER PRIMARY KEY)")
+        cur.execute("DELETE FROM temp.moving")
+        cur.executemany("INSERT INTO temp.moving (id) VALUES (?)", [(server_id,) for server_id in server_ids])
+        conn.commit()
+        # The events of these rows were published where they were first written
+        outbox_triggers = [name for (name,) in cur.execute(
+            "SELECT name FROM target.sqlite_master WHERE type = 'trigger' AND name LIKE 'outbox%'")]
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+            for name in outbox_triggers:
+                cur.execute(f"DROP TRIGGER target.{name}")
+            for table in reversed(tables):
+                # Leftovers of a move that was cut short
+                cur.execute(f"DELETE FROM target.{table.name} WHERE {_key(table)} IN (SELECT id FROM temp.moving)")
+            shifts = {}
+            for table in tables:
+                if _surrogate(table):
+                    collides = cur.execute(
+                        f"SELECT EXISTS (SELECT 1 FROM main.{table.name} s JOIN target.{table.name} t ON t.id = s.id "
+                        f"WHERE s.server_id IN (SELECT id FROM temp.moving))").fetchone()[0]
+                    if collides:
+                        shifts[table.name] = cur.execute(f"SELECT max(id) FROM target.{table.name}").fetchone()[0]
+                values = []
+                for column in table.columns:
+                    shift = shifts.get(table.name) if column.name == "id" else next(
+                        (shifts[fk.column.table.name] for fk in column.foreign_keys
+                         if fk.column.table.name in shifts and fk.column.name == "id"), None)
+                    values.append(f"{column.name} + {shift}" if shift else column.name)
+                names = ", ".join(column.name for column in table.columns)
+                order = ", ".join(column.name for column in table.primary_key.columns)
+                cur.execute(f"INSERT INTO target.{table.name} ({names}) SELECT {', '.join(values)} "
+                            f"FROM main.{table.name} WHERE {_key(table)} IN (SELECT id FROM temp.moving) "
+                            f"ORDER BY {order}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            # Recreated whether or not the copy went through
+            ensure_outbox_triggers(engines[target])
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for table in reversed(tables):
+                cur.execute(f"DELETE FROM main.{table.name} WHERE {_key(table)} IN (SELECT id FROM temp.moving)")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        # The connection goes back to the pool
+        conn.cursor().execute("DETACH DATABASE target")
+        conn.close()
+
+
+def status():
+    for shard in list_shards():
+        environments = ", ".join(f"{environment} {count}" for environment, count in
+                                 sorted(shard["servers_by_environment"].items())) or "-"
+        print(f"{shard['path']}: {shard['servers']} servers ({environments}), {shard['misplaced']} misplaced")
+
+
+def rebalance(batch: int, dry_run: bool):
+    db = SessionLocal()
+    try:
+        held = held_by_waves(db)
+    finally:
+        db.close()
+    for source, factory in sessions.items():
+        db = factory()
+        try:
+            targets = misplaced(db, source, held)
+        finally:
+            db.close()
+        for target, server_ids in targets.items():
+            print(f"{source} -> {target}: {len(server_ids)} servers")
+            if dry_run:
+                continue
+            for start in range(0, len(server_ids), batch):
+                move(source, target, server_ids[start:start + batch])
+    if not dry_run:
+        status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move servers into the database their environment maps to")
+    parser.add_argument("command", choices=["status", "rebalance"])
+    parser.add_argument("--batch", type=int, default=500, help="servers moved per step")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would move")
+    args = parser.parse_args()
+    if len(engines) == 1:
+        print("INFRA_NOVA_SHARDS maps no environment to a database of its own; everything is in the main one")
+    # Creates missing shard files with the full schema, indexes and triggers, as the API would on startup
+    prepare_database()
+    if args.command == "status":
+        status()
+    else:
+        rebalance(args.batch, args.dry_run)
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
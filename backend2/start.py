@@ -2,49 +2,123 @@
 """
 Startup script for the FastAPI backend
 Initializes database and starts the server
+
+    python start.py                    # development: one process with --reload
+    python start.py --prod             # production: one worker per core
+    python start.py --measure-startup  # time from launch until /readyz answers
 """
 
+import argparse
 import os
-import sys
 import subprocess
-from pathlib import Path
+import sys
+import time
+import urllib.request
+
+
+def default_workers() -> int:
+    # SQLite has a single writer, so more processes than cores only adds lock contention
+    return max(1, min(os.cpu_count() or 1, 8))
+
+
+def prepare_database():
+    """Create/upgrade the schema and run crash recovery once, before any worker starts"""
+    started = time.perf_counter()
+    from init_db import init_db
+    from app.main import prepare_database as prepare_app_database
+    init_db()
+    prepare_app_database()
+    print(f"✅ Database ready in {time.perf_counter() - started:.2f}s")
+
+
+def wait_until_ready(url: str, timeout: float) -> float:
+    """Poll the readiness endpoint; returns seconds until it answered 200"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return time.perf_counter() - started
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+
+def measure_startup(port: int, runs: int):
+    """Launch a single worker repeatedly and report cold-start time to readiness"""
+    env = dict(os.environ, INFRA_NOVA_SCHEMA_READY="1", SCHEDULER_ENABLED="0")
+    timings = []
+    for _ in range(runs):
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+            env=env,
+        )
+        try:
+            timings.append(wait_until_ready(f"http://127.0.0.1:{port}/readyz", timeout=60))
+        finally:
+            process.terminate()
+            process.wait()
+    timings.sort()
+    print(f"⏱️  Cold start to ready over {runs} runs: "
+          f"min {timings[0]:.2f}s, median {timings[len(timings) // 2]:.2f}s, max {timings[-1]:.2f}s")
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Start the Infra Nova backend")
+    parser.add_argument("--prod", action="store_true", help="multi-worker mode without auto-reload")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core, max 8)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--measure-startup", action="store_true", help="report cold-start time and exit")
+    parser.add_argument("--runs", type=int, default=5, help="startup measurement runs")
+    args = parser.parse_args()
+
     print("🚀 Starting Infra Nova Dashboard Backend (SQLite)")
     print("=" * 50)
-    
-    # Check if database exists
-    db_file = Path("infra_nova.db")
-    if not db_file.exists():
-        print("📊 Database not found. Initializing...")
-        try:
-            subprocess.run([sys.executable, "init_db.py"], check=True)
-            print("✅ Database initialized successfully!")
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Failed to initialize database: {e}")
-            return
-    else:
-        print("✅ Database already exists")
-    
+
+    try:
+        prepare_database()
+    except Exception as e:
+        print(f"❌ Failed to initialize database: {e}")
+        return
+
+    if args.measure_startup:
+        measure_startup(args.port, args.runs)
+        return
+
+    # Workers skip schema setup and recovery; the supervisor has just done it
+    os.environ["INFRA_NOVA_SCHEMA_READY"] = "1"
+    workers = args.workers or default_workers()
+
     print("\n🌐 Starting FastAPI server...")
-    print("📱 API will be available at: http://localhost:8000")
-    print("📖 API documentation at: http://localhost:8000/docs")
+    print(f"📱 API will be available at: http://localhost:{args.port}")
+    print(f"📖 API documentation at: http://localhost:{args.port}/docs")
+    if args.prod:
+        print(f"🏭 Production mode: {workers} workers, readiness at /readyz, liveness at /healthz")
     print("🔄 Press Ctrl+C to stop the server")
     print("=" * 50)
-    
-    # Start the FastAPI server
+
+    import uvicorn
     try:
-        subprocess.run([
-            sys.executable, "-m", "uvicorn", 
-            "app.main:app", 
-            "--reload", 
-            "--host", "0.0.0.0", 
-            "--port", "8000"
-        ])
+        if args.prod:
+            # On SIGTERM/Ctrl+C each worker stops accepting requests, finishes open
+            # ones and then drains its in-flight checks (DRAIN_SECONDS) before exiting
+            uvicorn.run(
+                "app.main:app",
+                host=args.host,
+                port=args.port,
+                workers=workers,
+                timeout_graceful_shutdown=int(os.getenv("DRAIN_SECONDS", "30")),
+                proxy_headers=True,
+            )
+        else:
+            uvicorn.run("app.main:app", host=args.host, port=args.port, reload=True)
     except KeyboardInterrupt:
         print("\n👋 Server stopped by user")
     except Exception as e:
         print(f"❌ Failed to start server: {e}")
 
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Standalone check worker
+Pulls queued checks from the database so they can be processed outside the API
+process. Run several of these (or use --processes) to share the load. With
+database shards, a worker serves the queue of one database, picked with
+--environment.
+"""
+
+import argparse
+import multiprocessing
+import signal
+import sys
+
+from app.database import sessions, shard_for_environment
+from app.jobs import Worker
+
+
+def run_worker(concurrency: int, poll_seconds: float, environment: str = None):
+    database = shard_for_environment(environment)
+    worker = Worker(concurrency=concurrency, poll_seconds=poll_seconds, session_factory=sessions[database])
+    # Finish the checks in flight on SIGTERM instead of dropping them
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    print(f"👷 Worker {worker.worker_id} started on {database} ({concurrency} threads)")
+    worker.run_forever()
+    print(f"👋 Worker {worker.worker_id} stopped after {worker.processed} jobs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run check workers against the job queue")
+    parser.add_argument("--processes", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--concurrency", type=int, default=4, help="checks per process")
+    parser.add_argument("--poll-seconds", type=float, default=1.0, help="idle poll interval")
+    parser.add_argument("--environment", help="serve the database holding this environment (default: the main one)")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker(args.concurrency, args.poll_seconds, args.environment)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.concurrency, args.poll_seconds, args.environment))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "../ui/card";
 import { Button } from "../ui/button";
 import { Input } from "../ui/input";
@@ -22,16 +22,32 @@ type User = {
   active: boolean;
 };
 
+type WaveProgress = {
+  pending: number;
+  in_flight: number;
+  completed: number;
+  failed: number;
+  throughput_per_hour: number | null;
+  eta: string | null;
+};
+
 type MigrationWave = {
-  id: string;
+  id: number;
   name: string;
-  environment: string;
-  startDate: string;
-  endDate: string;
-  serverCount: number;
+  group_by: string;
+  group_value: string;
+  max_parallel: number;
   status: string;
+  servers_total: number;
+  started_at: string | null;
+  finished_at: string | null;
+  progress: WaveProgress;
 };
 
+const API = "http://localhost:8000/api";
+
+const formatDate = (value: string | null) => (value ? new Date(value + "Z").toLocaleString() : "-");
+
 const mockUsers: User[] = [
   {
     id: "1",
@@ -62,45 +78,39 @@ const mockUsers: User[] = [
   },
 ];
 
-const mockWaves: MigrationWave[] = [
-  {
-    id: "1",
-    name: "Production Wave 1",
-    environment: "Production",
-    startDate: "2024-01-15",
-    endDate: "2024-01-22",
-    serverCount: 25,
-    status: "Planned",
-  },
-  {
-    id: "2",
-    name: "UAT Migration",
-    environment: "UAT",
-    startDate: "2024-01-08",
-    endDate: "2024-01-12",
-    serverCount: 18,
-    status: "In Progress",
-  },
-  {
-    id: "3",
-    name: "Dev Environment",
-    environment: "Development",
-    startDate: "2024-01-01",
-    endDate: "2024-01-05",
-    serverCount: 12,
-    status: "Completed",
-  },
-];
-
 export function AdminSettings() {
   const [users] = useState<User[]>(mockUsers);
-  const [waves] = useState<MigrationWave[]>(mockWaves);
+  const [waves, setWaves] = useState<MigrationWave[]>([]);
   const [apiKeys, setApiKeys] = useState({
     moveme: "••••••••••••••••",
     firewall: "••••••••••••••••",
     loadBalancer: "••••••••••••••••",
   });
 
+  const loadWaves = () => {
+    fetch(`${API}/waves`)
+      .then(res => res.json())
+      .then(data => setWaves(data));
+  };
+
+  useEffect(() => {
+    loadWaves();
+    const timer = setInterval(loadWaves, 10000);
+    return () => clearInterval(timer);
+  }, []);
+
+  const planWaves = () => {
+    fetch(`${API}/waves/plan`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ group_by: "environment" }),
+    }).then(loadWaves);
+  };
+
+  const waveAction = (id: number, action: "start" | "cancel") => {
+    fetch(`${API}/waves/${id}/${action}`, { method: "POST" }).then(loadWaves);
+  };
+
   const getRoleColor = (role: string) => {
     switch (role.toLowerCase()) {
       case "admin": return "bg-red-100 text-red-800 border-red-200";
@@ -208,9 +218,9 @@ export function AdminSettings() {
                   <Filter className="h-5 w-5" />
                   Migration Waves ({waves.length})
                 </CardTitle>
-                <Button>
+                <Button onClick={planWaves}>
                   <Plus className="h-4 w-4 mr-2" />
-                  Create Wave
+                  Plan Waves
                 </Button>
               </div>
             </CardHeader>
@@ -220,10 +230,11 @@ export function AdminSettings() {
                   <TableHeader>
                     <TableRow>
                       <TableHead>Wave Name</TableHead>
-                      <TableHead>Environment</TableHead>
-                      <TableHead>Start Date</TableHead>
-                      <TableHead>End Date</TableHead>
-                      <TableHead>Server Count</TableHead>
+                      <TableHead>Group</TableHead>
+                      <TableHead>Started</TableHead>
+                      <TableHead>Finished / ETA</TableHead>
+                      <TableHead>Servers</TableHead>
+                      <TableHead>Throughput</TableHead>
                       <TableHead>Status</TableHead>
                       <TableHead>Actions</TableHead>
                     </TableRow>
@@ -233,11 +244,17 @@ export function AdminSettings() {
                       <TableRow key={wave.id} className="hover:bg-gray-50">
                         <TableCell className="font-medium">{wave.name}</TableCell>
                         <TableCell>
-                          <Badge variant="outline">{wave.environment}</Badge>
+                          <Badge variant="outline">{wave.group_value}</Badge>
+                        </TableCell>
+                        <TableCell>{formatDate(wave.started_at)}</TableCell>
+                        <TableCell>{wave.finished_at ? formatDate(wave.finished_at) : formatDate(wave.progress.eta)}</TableCell>
+                        <TableCell>
+                          {wave.progress.completed}/{wave.servers_total}
+                          {wave.progress.failed > 0 && <span className="text-red-600"> ({wave.progress.failed} failed)</span>}
+                        </TableCell>
+                        <TableCell>
+                          {wave.progress.throughput_per_hour != null ? `${wave.progress.throughput_per_hour}/h` : "-"}
                         </TableCell>
-                        <TableCell>{wave.startDate}</TableCell>
-                        <TableCell>{wave.endDate}</TableCell>
-                        <TableCell>{wave.serverCount}</TableCell>
                         <TableCell>
                           <Badge variant="outline" className={getStatusColor(wave.status)}>
                             {wave.status}
@@ -245,8 +262,12 @@ export function AdminSettings() {
                         </TableCell>
                         <TableCell>
                           <div className="flex gap-2">
-                            <Button size="sm" variant="outline">Edit</Button>
-                            <Button size="sm" variant="outline">View</Button>
+                            {wave.status === "Planned" && (
+                              <Button size="sm" variant="outline" onClick={() => waveAction(wave.id, "start")}>Start</Button>
+                            )}
+                            {(wave.status === "Planned" || wave.status === "In Progress") && (
+                              <Button size="sm" variant="outline" onClick={() => waveAction(wave.id, "cancel")}>Cancel</Button>
+                            )}
                           </div>
                         </TableCell>
                       </TableRow>
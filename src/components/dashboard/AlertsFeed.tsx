@@ -1,9 +1,8 @@
 import { Card, CardContent, CardHeader, CardTitle } from "../ui/card";
 import { Badge } from "../ui/badge";
 import { AlertTriangle, Clock } from "lucide-react";
-import { useEffect, useState } from "react";
 
-type Alert = {
+export type Alert = {
   id: number;
   server_id: number;
   severity: string;
@@ -12,14 +11,7 @@ type Alert = {
   created_at: string;
 };
 
-export function AlertsFeed() {
-  const [alerts, setAlerts] = useState<Alert[]>([]);
-
-  useEffect(() => {
-    fetch("http://localhost:8000/api/alerts")
-      .then(res => res.json())
-      .then(data => setAlerts(data));
-  }, []);
+export function AlertsFeed({ alerts = [] }: { alerts?: Alert[] }) {
 
   const getSeverityColor = (severity: string) => {
     switch (severity) {
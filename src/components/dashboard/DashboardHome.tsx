@@ -3,17 +3,27 @@ import { Badge } from "../ui/badge";
 import { SummaryCards } from "./SummaryCards";
 import { MigrationChart } from "./MigrationChart";
 import { TimelineChart } from "./TimelineChart";
-import { AlertsFeed } from "./AlertsFeed";
+import { AlertsFeed, Alert } from "./AlertsFeed";
 import { Users, CheckCircle, XCircle, Clock } from "lucide-react";
 import { useEffect, useState } from "react";
 
+type DashboardBundle = {
+  summary?: any;
+  migration_chart?: any[];
+  timeline?: any[];
+  alerts?: Alert[];
+  recent_activity?: any[];
+};
+
 export function DashboardHome() {
-  const [activity, setActivity] = useState<any[]>([]);
+  const [bundle, setBundle] = useState<DashboardBundle>({});
+  const activity = bundle.recent_activity ?? [];
 
   useEffect(() => {
-    fetch("http://localhost:8000/api/recent-activity")
+    // Every dashboard section in one request, read from the same snapshot
+    fetch("http://localhost:8000/api/dashboard")
       .then(res => res.json())
-      .then(data => setActivity(data));
+      .then(data => setBundle(data));
   }, []);
 
   return (
@@ -28,11 +38,11 @@ export function DashboardHome() {
         </Badge>
       </div>
 
-      <SummaryCards />
+      <SummaryCards summary={bundle.summary} />
 
       <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
-        <MigrationChart />
-        <TimelineChart />
+        <MigrationChart data={bundle.migration_chart} />
+        <TimelineChart data={bundle.timeline} />
       </div>
 
       <div className="grid grid-cols-1 lg:grid-cols-3 gap-6">
@@ -64,7 +74,7 @@ export function DashboardHome() {
             </CardContent>
           </Card>
         </div>
-        <AlertsFeed />
+        <AlertsFeed alerts={bundle.alerts} />
       </div>
     </div>
   );
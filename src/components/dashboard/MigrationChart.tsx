@@ -1,17 +1,9 @@
-import { useEffect, useState } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "../ui/card";
 import { PieChart, Pie, Cell, ResponsiveContainer, Legend, Tooltip } from "recharts";
 
 const COLORS = ["#10b981", "#ef4444", "#6366f1", "#f59e0b"];
 
-export function MigrationChart() {
-  const [data, setData] = useState<any[]>([]);
-
-  useEffect(() => {
-    fetch("http://localhost:8000/api/migration-chart")
-      .then(res => res.json())
-      .then(data => setData(data));
-  }, []);
+export function MigrationChart({ data = [] }: { data?: any[] }) {
 
   return (
     <Card>
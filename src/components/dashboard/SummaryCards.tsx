@@ -1,4 +1,3 @@
-import { useEffect, useState } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "../ui/card";
 import { Users, CheckCircle, XCircle, Clock, AlertTriangle } from "lucide-react";
 
@@ -40,14 +39,7 @@ const cardMeta = [
   },
 ];
 
-export function SummaryCards() {
-  const [summary, setSummary] = useState<any>({});
-
-  useEffect(() => {
-    fetch("http://localhost:8000/api/dashboard-summary")
-      .then(res => res.json())
-      .then(data => setSummary(data));
-  }, []);
+export function SummaryCards({ summary = {} }: { summary?: any }) {
 
   return (
     <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-5 gap-4">
@@ -1,15 +1,7 @@
-import { useEffect, useState } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "../ui/card";
 import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from "recharts";
 
-export function TimelineChart() {
-  const [data, setData] = useState<any[]>([]);
-
-  useEffect(() => {
-    fetch("http://localhost:8000/api/timeline-chart")
-      .then(res => res.json())
-      .then(data => setData(data));
-  }, []);
+export function TimelineChart({ data = [] }: { data?: any[] }) {
 
   return (
     <Card>
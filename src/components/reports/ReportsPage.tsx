@@ -1,33 +1,65 @@
 
+import { useEffect, useState } from "react";
 import { Card, CardContent, CardHeader, CardTitle } from "../ui/card";
 import { Button } from "../ui/button";
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "../ui/select";
 import { BarChart, Bar, LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, PieChart, Pie, Cell } from "recharts";
 import { FileText, Download, BarChart2, TrendingUp } from "lucide-react";
 
-const migrationTrendsData = [
-  { date: "Jan 1", completed: 4, failed: 1, total: 5 },
-  { date: "Jan 2", completed: 8, failed: 2, total: 10 },
-  { date: "Jan 3", completed: 6, failed: 0, total: 6 },
-  { date: "Jan 4", completed: 12, failed: 3, total: 15 },
-  { date: "Jan 5", completed: 5, failed: 1, total: 6 },
-  { date: "Jan 6", completed: 9, failed: 2, total: 11 },
-  { date: "Jan 7", completed: 7, failed: 1, total: 8 },
-];
-
-const environmentData = [
-  { name: "Production", completed: 25, failed: 3, warning: 5 },
-  { name: "UAT", completed: 18, failed: 2, warning: 3 },
-  { name: "Development", completed: 12, failed: 1, warning: 1 },
-];
-
-const successRateData = [
-  { name: "Successful", value: 85, fill: "#10b981" },
-  { name: "Failed", value: 10, fill: "#ef4444" },
-  { name: "Warning", value: 5, fill: "#f59e0b" },
-];
+const API = "http://localhost:8000/api";
+
+const outcomeColors: { [key: string]: string } = {
+  Successful: "#10b981",
+  Failed: "#ef4444",
+  Warning: "#f59e0b",
+};
+
+const delta = (current: number | null, previous: number | null, unit = "") => {
+  if (current == null || previous == null) return "";
+  const diff = Math.round((current - previous) * 10) / 10;
+  return `${diff >= 0 ? "+" : ""}${diff}${unit} from previous period`;
+};
 
 export function ReportsPage() {
+  const [days, setDays] = useState("7");
+  const [report, setReport] = useState<any>(null);
+  const [exporting, setExporting] = useState(false);
+
+  useEffect(() => {
+    fetch(`${API}/reports/overview?days=${days}`)
+      .then(res => res.json())
+      .then(data => setReport(data));
+  }, [days]);
+
+  const exportCsv = () => {
+    setExporting(true);
+    const download = (id: number) => {
+      window.location.href = `${API}/reports/exports/${id}/download`;
+      setExporting(false);
+    };
+    const poll = (id: number) => {
+      fetch(`${API}/reports/exports/${id}`)
+        .then(res => res.json())
+        .then(exp => {
+          if (exp.status === "succeeded") download(exp.id);
+          else if (exp.status === "failed") setExporting(false);
+          else setTimeout(() => poll(id), 1000);
+        });
+    };
+    fetch(`${API}/reports/exports`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ kind: "migrations", days: Number(days) }),
+    })
+      .then(res => res.json())
+      .then(exp => (exp.status === "succeeded" ? download(exp.id) : poll(exp.id)))
+      .catch(() => setExporting(false));
+  };
+
+  const summary = report?.summary ?? {};
+  const previous = report?.previous ?? {};
+  const successRateData = (report?.success_rate ?? []).map((d: any) => ({ ...d, fill: outcomeColors[d.name] }));
+
   return (
     <div className="space-y-6">
       <div className="flex items-center justify-between">
@@ -36,23 +68,23 @@ export function ReportsPage() {
           <p className="text-gray-600 mt-1">Migration insights and performance metrics</p>
         </div>
         <div className="flex gap-2">
-          <Select defaultValue="7days">
+          <Select value={days} onValueChange={setDays}>
             <SelectTrigger className="w-40">
               <SelectValue />
             </SelectTrigger>
             <SelectContent>
-              <SelectItem value="7days">Last 7 days</SelectItem>
-              <SelectItem value="30days">Last 30 days</SelectItem>
-              <SelectItem value="90days">Last 90 days</SelectItem>
+              <SelectItem value="7">Last 7 days</SelectItem>
+              <SelectItem value="30">Last 30 days</SelectItem>
+              <SelectItem value="90">Last 90 days</SelectItem>
             </SelectContent>
           </Select>
-          <Button>
+          <Button onClick={() => window.print()}>
             <Download className="h-4 w-4 mr-2" />
             Export PDF
           </Button>
-          <Button variant="outline">
+          <Button variant="outline" onClick={exportCsv} disabled={exporting}>
             <FileText className="h-4 w-4 mr-2" />
-            Export CSV
+            {exporting ? "Exporting..." : "Export CSV"}
           </Button>
         </div>
       </div>
@@ -66,8 +98,8 @@ export function ReportsPage() {
             <BarChart2 className="h-4 w-4 text-blue-600" />
           </CardHeader>
           <CardContent>
-            <div className="text-2xl font-bold text-gray-900">147</div>
-            <p className="text-xs text-green-600 mt-1">+12 from last week</p>
+            <div className="text-2xl font-bold text-gray-900">{summary.total_migrations ?? "-"}</div>
+            <p className="text-xs text-gray-600 mt-1">{delta(summary.total_migrations, previous.total_migrations)}</p>
           </CardContent>
         </Card>
 
@@ -79,8 +111,10 @@ export function ReportsPage() {
             <TrendingUp className="h-4 w-4 text-green-600" />
           </CardHeader>
           <CardContent>
-            <div className="text-2xl font-bold text-gray-900">85.7%</div>
-            <p className="text-xs text-green-600 mt-1">+2.1% from last week</p>
+            <div className="text-2xl font-bold text-gray-900">
+              {summary.success_rate != null ? `${summary.success_rate}%` : "-"}
+            </div>
+            <p className="text-xs text-gray-600 mt-1">{delta(summary.success_rate, previous.success_rate, "%")}</p>
           </CardContent>
         </Card>
 
@@ -92,8 +126,10 @@ export function ReportsPage() {
             <BarChart2 className="h-4 w-4 text-purple-600" />
           </CardHeader>
           <CardContent>
-            <div className="text-2xl font-bold text-gray-900">2.4h</div>
-            <p className="text-xs text-red-600 mt-1">+15min from last week</p>
+            <div className="text-2xl font-bold text-gray-900">
+              {summary.avg_migration_hours != null ? `${summary.avg_migration_hours}h` : "-"}
+            </div>
+            <p className="text-xs text-gray-600 mt-1">{delta(summary.avg_migration_hours, previous.avg_migration_hours, "h")}</p>
           </CardContent>
         </Card>
 
@@ -105,8 +141,8 @@ export function ReportsPage() {
             <FileText className="h-4 w-4 text-red-600" />
           </CardHeader>
           <CardContent>
-            <div className="text-2xl font-bold text-gray-900">8</div>
-            <p className="text-xs text-green-600 mt-1">-3 from yesterday</p>
+            <div className="text-2xl font-bold text-gray-900">{summary.active_issues ?? "-"}</div>
+            <p className="text-xs text-gray-600 mt-1">Unresolved alerts</p>
           </CardContent>
         </Card>
       </div>
@@ -118,7 +154,7 @@ export function ReportsPage() {
           </CardHeader>
           <CardContent>
             <ResponsiveContainer width="100%" height={300}>
-              <BarChart data={migrationTrendsData}>
+              <BarChart data={report?.trends ?? []}>
                 <CartesianGrid strokeDasharray="3 3" />
                 <XAxis dataKey="date" />
                 <YAxis />
@@ -164,11 +200,12 @@ export function ReportsPage() {
         </CardHeader>
         <CardContent>
           <ResponsiveContainer width="100%" height={400}>
-            <BarChart data={environmentData} layout="horizontal">
+            <BarChart data={report?.environments ?? []} layout="horizontal">
               <CartesianGrid strokeDasharray="3 3" />
               <XAxis type="number" />
               <YAxis dataKey="name" type="category" width={100} />
               <Tooltip />
+              <Bar dataKey="passed" fill="#3b82f6" name="Passed" />
               <Bar dataKey="completed" fill="#10b981" name="Completed" />
               <Bar dataKey="failed" fill="#ef4444" name="Failed" />
               <Bar dataKey="warning" fill="#f59e0b" name="Warning" />
@@ -180,30 +217,30 @@ export function ReportsPage() {
       <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
         <Card>
           <CardHeader>
-            <CardTitle>Weekly Performance Summary</CardTitle>
+            <CardTitle>Period Summary</CardTitle>
           </CardHeader>
           <CardContent>
             <div className="space-y-4">
               <div className="flex justify-between items-center p-3 bg-green-50 rounded-lg">
                 <div>
                   <p className="font-medium text-green-900">Migrations Completed</p>
-                  <p className="text-sm text-green-700">This week</p>
+                  <p className="text-sm text-green-700">Last {days} days</p>
                 </div>
-                <div className="text-2xl font-bold text-green-900">51</div>
+                <div className="text-2xl font-bold text-green-900">{summary.completed ?? "-"}</div>
               </div>
               <div className="flex justify-between items-center p-3 bg-red-50 rounded-lg">
                 <div>
                   <p className="font-medium text-red-900">Migrations Failed</p>
-                  <p className="text-sm text-red-700">This week</p>
+                  <p className="text-sm text-red-700">Last {days} days</p>
                 </div>
-                <div className="text-2xl font-bold text-red-900">9</div>
+                <div className="text-2xl font-bold text-red-900">{summary.failed ?? "-"}</div>
               </div>
               <div className="flex justify-between items-center p-3 bg-blue-50 rounded-lg">
                 <div>
-                  <p className="font-medium text-blue-900">Average Response Time</p>
-                  <p className="text-sm text-blue-700">API endpoints</p>
+                  <p className="font-medium text-blue-900">Migrations Previous Period</p>
+                  <p className="text-sm text-blue-700">The {days} days before</p>
                 </div>
-                <div className="text-2xl font-bold text-blue-900">187ms</div>
+                <div className="text-2xl font-bold text-blue-900">{previous.total_migrations ?? "-"}</div>
               </div>
             </div>
           </CardContent>
@@ -211,20 +248,15 @@ export function ReportsPage() {
 
         <Card>
           <CardHeader>
-            <CardTitle>Top Issues This Week</CardTitle>
+            <CardTitle>Top Issues</CardTitle>
           </CardHeader>
           <CardContent>
             <div className="space-y-3">
-              {[
-                { issue: "Database connection timeout", count: 12, severity: "high" },
-                { issue: "Disk space warnings", count: 8, severity: "medium" },
-                { issue: "Network latency", count: 5, severity: "medium" },
-                { issue: "Service startup delays", count: 3, severity: "low" },
-              ].map((issue, i) => (
+              {(report?.top_issues ?? []).map((issue: any, i: number) => (
                 <div key={i} className="flex items-center justify-between p-3 bg-gray-50 rounded-lg">
                   <div>
                     <p className="font-medium text-gray-900">{issue.issue}</p>
-                    <p className="text-sm text-gray-600">Severity: {issue.severity}</p>
+                    <p className="text-sm text-gray-600">Servers affected</p>
                   </div>
                   <div className="text-lg font-bold text-gray-900">{issue.count}</div>
                 </div>
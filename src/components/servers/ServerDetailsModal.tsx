@@ -5,7 +5,7 @@ import { Badge } from "../ui/badge";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "../ui/tabs";
 import { Separator } from "../ui/separator";
 import { CheckCircle, XCircle, AlertTriangle, Clock, FileText, Loader2 } from "lucide-react";
-import { useState } from "react";
+import { useCallback, useEffect, useState, UIEvent } from "react";
 
 type Server = {
   id: number;
@@ -22,6 +22,21 @@ type Server = {
   tags: string[];
 };
 
+type StatusEntry = {
+  id: number;
+  migration_status: string;
+  precheck_status: string | null;
+  postcheck_status: string | null;
+  issue_summary: string | null;
+  last_checked: string | null;
+  version: number;
+};
+
+type ServerDetail = {
+  current_status: StatusEntry | null;
+  counts: { statuses: number; alerts: number; open_alerts: number; migrations: number };
+};
+
 interface ServerDetailsModalProps {
   server: Server;
   open: boolean;
@@ -78,6 +93,43 @@ export function ServerDetailsModal({ server, open, onClose }: ServerDetailsModal
   };
 
   const [running, setRunning] = useState<'precheck' | 'postcheck' | null>(null);
+  const [detail, setDetail] = useState<ServerDetail | null>(null);
+  const [history, setHistory] = useState<StatusEntry[]>([]);
+  const [nextBefore, setNextBefore] = useState<number | null>(null);
+  const [historyState, setHistoryState] = useState<'idle' | 'loading' | 'done'>('idle');
+
+  useEffect(() => {
+    if (!open) return;
+    setDetail(null);
+    setHistory([]);
+    setNextBefore(null);
+    setHistoryState('idle');
+    fetch(`http://localhost:8000/api/servers/${server.id}`)
+      .then(res => res.json())
+      .then(data => setDetail(data));
+  }, [open, server.id]);
+
+  // Status history is paged newest first; each page hands back the cursor for the next one
+  const loadHistory = useCallback((before: number | null) => {
+    setHistoryState('loading');
+    const cursor = before !== null ? `&before=${before}` : "";
+    fetch(`http://localhost:8000/api/servers/${server.id}/statuses?limit=20${cursor}`)
+      .then(res => res.json())
+      .then(page => {
+        setHistory(prev => before === null ? page.items : [...prev, ...page.items]);
+        setNextBefore(page.next_before);
+        setHistoryState(page.next_before === null ? 'done' : 'idle');
+      });
+  }, [server.id]);
+
+  const onHistoryScroll = (e: UIEvent<HTMLDivElement>) => {
+    const el = e.currentTarget;
+    if (historyState === 'idle' && nextBefore !== null && el.scrollTop + el.clientHeight >= el.scrollHeight - 40) {
+      loadHistory(nextBefore);
+    }
+  };
+
+  const migrationStatus = detail?.current_status?.migration_status ?? server.migrationStatus;
 
   const rerunCheck = (type: 'precheck' | 'postcheck') => {
     setRunning(type);
@@ -102,10 +154,13 @@ export function ServerDetailsModal({ server, open, onClose }: ServerDetailsModal
         </DialogHeader>
 
         <Tabs defaultValue="overview" className="w-full">
-          <TabsList className="grid w-full grid-cols-4">
+          <TabsList className="grid w-full grid-cols-5">
             <TabsTrigger value="overview">Overview</TabsTrigger>
             <TabsTrigger value="precheck">PreCheck</TabsTrigger>
             <TabsTrigger value="postcheck">PostCheck</TabsTrigger>
+            <TabsTrigger value="history" onClick={() => history.length === 0 && historyState === 'idle' && loadHistory(null)}>
+              History{detail ? ` (${detail.counts.statuses})` : ""}
+            </TabsTrigger>
             <TabsTrigger value="logs">Agent Logs</TabsTrigger>
           </TabsList>
 
@@ -138,8 +193,8 @@ export function ServerDetailsModal({ server, open, onClose }: ServerDetailsModal
                   </div>
                   <div>
                     <label className="text-sm font-medium text-gray-600">Migration Status</label>
-                    <Badge variant="outline" className={`mt-1 ${getStatusColor(server.migrationStatus)}`}>
-                      {server.migrationStatus}
+                    <Badge variant="outline" className={`mt-1 ${getStatusColor(migrationStatus)}`}>
+                      {migrationStatus}
                     </Badge>
                   </div>
                 </div>
@@ -238,6 +293,43 @@ export function ServerDetailsModal({ server, open, onClose }: ServerDetailsModal
             </Card>
           </TabsContent>
 
+          <TabsContent value="history" className="space-y-4">
+            <Card>
+              <CardHeader>
+                <CardTitle>Status History</CardTitle>
+              </CardHeader>
+              <CardContent>
+                <div className="space-y-2 max-h-96 overflow-y-auto" onScroll={onHistoryScroll}>
+                  {history.map(entry => (
+                    <div key={entry.id} className="flex items-center justify-between p-3 bg-gray-50 rounded-lg">
+                      <div>
+                        <div className="flex items-center gap-2">
+                          <Badge variant="outline" className={getStatusColor(entry.migration_status)}>
+                            {entry.migration_status}
+                          </Badge>
+                          <span className="text-xs text-gray-500">v{entry.version}</span>
+                        </div>
+                        <p className="text-sm text-gray-600 mt-1">
+                          PreCheck: {entry.precheck_status ?? "-"} · PostCheck: {entry.postcheck_status ?? "-"}
+                          {entry.issue_summary ? ` · ${entry.issue_summary}` : ""}
+                        </p>
+                      </div>
+                      <span className="text-xs text-gray-500">
+                        {entry.last_checked ? new Date(entry.last_checked).toLocaleString() : "-"}
+                      </span>
+                    </div>
+                  ))}
+                  {historyState === 'loading' && (
+                    <div className="flex justify-center p-2"><Loader2 className="animate-spin h-4 w-4 text-gray-500" /></div>
+                  )}
+                  {historyState === 'done' && history.length === 0 && (
+                    <p className="text-sm text-gray-500">No status changes recorded.</p>
+                  )}
+                </div>
+              </CardContent>
+            </Card>
+          </TabsContent>
+
           <TabsContent value="logs" className="space-y-4">
             <Card>
               <CardHeader>
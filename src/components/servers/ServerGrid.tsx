@@ -16,6 +16,7 @@ type Server = {
   os: string;
   owner: string;
   created_at: string;
+  current_status: any | null;
   statuses: any[];
   tags: { tag: string }[];
 };
@@ -42,6 +43,8 @@ export function ServerGrid() {
   const [environmentFilter, setEnvironmentFilter] = useState<string>("all");
   const [statusFilter, setStatusFilter] = useState<string>("all");
   const [runningCheck, setRunningCheck] = useState<{[key: number]: 'precheck' | 'postcheck' | null}>({});
+  // Ranked server ids from the search API, or null when there is no search term
+  const [searchHits, setSearchHits] = useState<number[] | null>(null);
 
   useEffect(() => {
     fetch("http://localhost:8000/api/servers")
@@ -49,6 +52,20 @@ export function ServerGrid() {
       .then(data => setServers(data));
   }, []);
 
+  useEffect(() => {
+    const term = searchTerm.trim();
+    if (!term) {
+      setSearchHits(null);
+      return;
+    }
+    const timer = setTimeout(() => {
+      fetch(`http://localhost:8000/api/search/servers?q=${encodeURIComponent(term)}&limit=200`)
+        .then(res => res.json())
+        .then(data => setSearchHits(data.items.map((item: { id: number }) => item.id)));
+    }, 250);
+    return () => clearTimeout(timer);
+  }, [searchTerm]);
+
   const runCheck = (serverId: number, type: 'precheck' | 'postcheck') => {
     setRunningCheck(prev => ({ ...prev, [serverId]: type }));
     fetch(`http://localhost:8000/api/servers/${serverId}/run-${type}`, { method: "POST" })
@@ -66,14 +83,17 @@ export function ServerGrid() {
   };
 
   const filteredServers = servers.filter((server) => {
-    const matchesSearch = server.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         server.ip_address.includes(searchTerm);
+    const matchesSearch = searchHits === null || searchHits.includes(server.id);
     const matchesEnv = environmentFilter === "all" || server.environment === environmentFilter;
-    const latestStatus = server.statuses && server.statuses.length > 0 ? server.statuses[server.statuses.length - 1] : null;
+    const latestStatus = server.current_status;
     const migrationStatus = latestStatus ? latestStatus.migration_status : "";
     const matchesStatus = statusFilter === "all" || migrationStatus === statusFilter;
     return matchesSearch && matchesEnv && matchesStatus;
   });
+  if (searchHits !== null) {
+    // Keep the search ranking
+    filteredServers.sort((a, b) => searchHits.indexOf(a.id) - searchHits.indexOf(b.id));
+  }
 
   const getStatusColor = (status: string) => {
     switch (status?.toLowerCase()) {
@@ -109,7 +129,7 @@ export function ServerGrid() {
           <div className="flex flex-col sm:flex-row gap-4 mt-4">
             <div className="flex-1">
               <Input
-                placeholder="Search servers by name or IP..."
+                placeholder="Search name, owner, OS, tag, IP or CIDR..."
                 value={searchTerm}
                 onChange={(e) => setSearchTerm(e.target.value)}
                 className="max-w-md"
@@ -160,7 +180,7 @@ export function ServerGrid() {
               </TableHeader>
               <TableBody>
                 {filteredServers.map((server) => {
-                  const latestStatus = server.statuses && server.statuses.length > 0 ? server.statuses[server.statuses.length - 1] : {};
+                  const latestStatus = server.current_status || {};
                   const canRunPreCheck =
                     (latestStatus?.migration_status === "Ready") &&
                     (!latestStatus?.precheck_status || latestStatus?.precheck_status === "N/A" || latestStatus?.precheck_status === "Not Started");